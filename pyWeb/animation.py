@@ -0,0 +1,134 @@
+"""
+Animated images written one frame at a time
+
+An animation starts from a full first frame, and every later frame
+only carries the rectangle of pixels that changed, placed over the
+frames before it. Each frame is encoded as soon as it is added, so
+nothing but the encoded bytes is kept and the work per frame grows
+with the size of the change rather than the size of the image.
+
+APNG frames are written here with zlib; GIF frames are quantized to
+the palette of the first frame and LZW encoded by Pillow.
+"""
+
+import io
+import zlib
+import struct
+import numpy as np
+
+def png_chunk(kind, data):
+    body = kind + data
+    return struct.pack('>I', len(data)) + body + \
+            struct.pack('>I', zlib.crc32(body) & 0xffffffff)
+
+class ApngWriter:
+    """
+    @type width: int
+    @param width: width of the animation in pixels
+    @type height: int
+    @param height: height of the animation in pixels
+    @type frames: int
+    @param frames: number of frames that will be added, first included
+    @type compress: int
+    @param compress: zlib level, 0 (fastest) to 9 (smallest)
+    """
+    contentType = 'image/apng'
+
+    def __init__(self, width, height, frames, compress=6, loop=0):
+        self.size = (width, height)
+        self.compress = compress
+        self.seq = 0
+        self.out = io.BytesIO()
+        self.out.write(b'\x89PNG\r\n\x1a\n')
+        # 8 bit RGB
+        self.out.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB',
+                width, height, 8, 2, 0, 0, 0)))
+        self.out.write(png_chunk(b'acTL', struct.pack('>II', frames, loop)))
+
+    def encode(self, rgb):
+        """
+        Compresses rows of pixels, each with the Sub filter (the
+        difference from the pixel to its left), which suits the flat
+        colors of a plot
+        """
+        rows = np.ascontiguousarray(rgb, dtype=np.uint8)
+        sub = rows.copy()
+        sub[:,1:] -= rows[:,:-1]
+        data = np.empty((len(rows), 1 + rows.shape[1]*3), dtype=np.uint8)
+        data[:,0] = 1
+        data[:,1:] = sub.reshape(len(rows), -1)
+        return zlib.compress(data.tobytes(), self.compress)
+
+    def add(self, rgb, x=0, y=0, delay=500):
+        """
+        Adds a frame
+
+        @type rgb: numpy array
+        @param rgb: (rows, columns, 3) pixels of the changed rectangle,
+            the whole image for the first frame
+        @type x: int
+        @param x: column of the rectangle from the left
+        @type y: int
+        @param y: row of the rectangle from the top
+        @type delay: int
+        @param delay: milliseconds the frame is shown
+        """
+        h, w = rgb.shape[:2]
+        # Dispose none, blend source: the rectangle replaces what was there
+        self.out.write(png_chunk(b'fcTL', struct.pack('>IIIIIHHBB',
+                self.seq, w, h, x, y, int(delay), 1000, 0, 0)))
+        self.seq += 1
+        data = self.encode(rgb)
+        if self.seq == 1:
+            self.out.write(png_chunk(b'IDAT', data))
+        else:
+            self.out.write(png_chunk(b'fdAT', struct.pack('>I', self.seq) + data))
+            self.seq += 1
+
+    def finish(self):
+        self.out.write(png_chunk(b'IEND', b''))
+        return self.out.getbuffer()
+
+class GifWriter:
+    """
+    @type width: int
+    @param width: width of the animation in pixels
+    @type height: int
+    @param height: height of the animation in pixels
+    @type frames: int
+    @param frames: number of frames that will be added (unused, GIF
+        does not need it up front)
+    """
+    contentType = 'image/gif'
+
+    def __init__(self, width, height, frames, loop=0):
+        self.size = (width, height)
+        self.loop = loop
+        self.palette = None
+        self.out = io.BytesIO()
+
+    def add(self, rgb, x=0, y=0, delay=500):
+        """
+        Adds a frame, see ApngWriter.add. GIF delays are in 1/100 s.
+        """
+        from PIL import Image, GifImagePlugin
+        img = Image.fromarray(np.ascontiguousarray(rgb, dtype=np.uint8), 'RGB')
+        if self.palette is None:
+            # The first frame sets the colors of the whole animation
+            self.palette = img.quantize(255, dither=Image.Dither.NONE)
+            header, used = GifImagePlugin.getheader(self.palette,
+                    info={'loop':self.loop, 'optimize':False})
+            for part in header:
+                self.out.write(part)
+            frame = self.palette
+        else:
+            frame = img.quantize(palette=self.palette, dither=Image.Dither.NONE)
+        for part in GifImagePlugin.getdata(frame, (x, y), duration=delay,
+                disposal=1):
+            self.out.write(part)
+
+    def finish(self):
+        self.out.write(b';')
+        return self.out.getbuffer()
+
+writers = {'apng':ApngWriter, 'gif':GifWriter}
@@ -0,0 +1,75 @@
+"""
+Render benchmark
+
+Times Oopgui.render() for each output format, DPI and PNG compression
+level and reports the image size and, for the lossy formats, the PSNR
+against the raw canvas at the same DPI.
+
+    python benchRender.py [repeats]
+"""
+
+import sys
+import io
+import time
+import numpy as np
+from PIL import Image
+import oopgui
+
+CONFIG = {
+    'keckID':'0', 'ddfname':'bench', 'imgMode':'Slave1', 'dataset':'bench',
+    'object':'bench', 'targType':'target', 'coordSys':'instr',
+    'units':'arcsec', 'pa':'0.0', 'aoType':'NGS', 'lgsMode':'No Laser',
+    'specFilter':'Kbb', 'scale':'0.05', 'specCoadds':'1', 'specItime':'2',
+    'initOffX':'0.0', 'initOffY':'0.0', 'objPattern':'Raster Scan',
+    'objFrames1':'10', 'objFrames2':'10', 'objLenX':'1.0', 'objHgtY':'3.0',
+    'imgFilter':'Opn', 'repeats':'1', 'imgCoadds':'1', 'imgItime':'2',
+    'nodOffX':'40.0', 'nodOffY':'0.0', 'skyPattern':'Box9',
+    'skyFrames1':'9', 'skyFrames2':'1', 'skyLenX':'2.0', 'skyHgtY':'2.0',
+    'defs':'',
+}
+
+CASES = [
+    ('png', 100, 6, 90),
+    ('png', 100, 1, 90),
+    ('png', 100, 0, 90),
+    ('png', 60, 1, 90),
+    ('png', 150, 6, 90),
+    ('jpeg', 100, 6, 90),
+    ('jpeg', 100, 6, 70),
+    ('webp', 100, 6, 90),
+    ('webp', 100, 6, 70),
+    ('rgba', 100, 6, 90),
+]
+
+def psnr(img, ref):
+    err = np.mean((img.astype(float) - ref.astype(float))**2)
+    if err == 0:
+        return float('inf')
+    return 10*np.log10(255.0**2/err)
+
+def bench(repeats):
+    oop = oopgui.Oopgui()
+    oop.update(dict((key, [val]) for key, val in CONFIG.items()))
+    print('%-5s %4s %8s %7s %9s %8s' %
+            ('fmt', 'dpi', 'compress', 'quality', 'ms', 'bytes'))
+    for fmt, dpi, compress, quality in CASES:
+        times = []
+        for i in range(repeats):
+            # Empty the cache so every repeat encodes again
+            oop.images = {}
+            start = time.perf_counter()
+            img = oop.render(fmt, dpi, compress, quality)
+            times.append(time.perf_counter() - start)
+        quality_col = ''
+        if fmt in ['jpeg', 'webp']:
+            width, height = oop.render_size(dpi)
+            ref = np.frombuffer(oop.render('rgba', dpi), np.uint8)
+            ref = ref.reshape(height, width, 4)[:,:,:3]
+            dec = np.asarray(Image.open(io.BytesIO(img)).convert('RGB'))
+            quality_col = ' psnr=%.1fdB' % psnr(dec, ref)
+        print('%-5s %4d %8d %7d %9.1f %8d%s' % (fmt, dpi, compress, quality,
+                1000*min(times), memoryview(img).nbytes, quality_col))
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    bench(repeats)
@@ -0,0 +1,129 @@
+"""
+Bulk target list and DDF import
+
+Checks many configurations at once. Each entry is the base webform
+values with the columns of one target list row, or the values read
+from one uploaded DDF, laid over them. The entries are validated and
+drawn as thumbnails in a pool of worker processes, each with its own
+Oopgui, so a long list is not limited to a single core.
+"""
+
+import csv
+import io
+import json
+import base64
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import oopgui
+
+pool = None
+worker = None
+
+def init_worker():
+    """
+    Creates the Oopgui used by every entry drawn in this process
+    """
+    global worker
+    worker = oopgui.Oopgui()
+
+def get_pool():
+    """
+    Starts the worker pool the first time it is needed
+
+    @return returns the process pool
+    """
+    global pool
+    if pool is None:
+        # spawn so the workers do not inherit the server's threads
+        pool = ProcessPoolExecutor(max_workers=max(1, mp.cpu_count()-1),
+                mp_context=mp.get_context('spawn'),
+                initializer=init_worker)
+    return pool
+
+def parse_targets(data):
+    """
+    Reads an uploaded target list
+
+    @type data: bytes or string
+    @param data: a JSON list of objects, or CSV with a header row
+        naming the webform fields
+
+    @return returns a list of dictionaries of strings
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    data = data.strip()
+    if data[:1] in ['[', '{']:
+        rows = json.loads(data)
+        if isinstance(rows, dict):
+            rows = [rows]
+    else:
+        rows = list(csv.DictReader(io.StringIO(data)))
+    return [dict((key.strip(), str(val).strip()) for key, val in row.items()
+            if key and val is not None) for row in rows]
+
+def check_entry(config):
+    """
+    Validates and draws one entry in a worker process
+
+    @type config: dictionary
+    @param config: webform values as lists of strings
+
+    @return returns a dictionary with the errors and, for a valid
+        entry, a base64 PNG thumbnail
+    """
+    res = {'errors':worker.validate(config), 'thumbnail':''}
+    if res['errors']:
+        return res
+    try:
+        worker.update(config)
+        img = worker.render('png', 20, compress=1)
+    except Exception as exc:
+        res['errors'] = [''.join(('could not draw: ', str(exc)))]
+    else:
+        res['thumbnail'] = base64.b64encode(img).decode()
+    return res
+
+def check_entries(base, entries):
+    """
+    Validates and draws every entry in the worker pool
+
+    @type base: dictionary
+    @param base: webform values shared by all entries
+    @type entries: list
+    @param entries: dictionaries of the values of each entry
+
+    @return returns the configurations and the results, in the
+        order of the entries
+    """
+    configs = []
+    for entry in entries:
+        config = dict(base)
+        config.update((key, [val]) for key, val in entry.items())
+        configs.append(config)
+    results = list(get_pool().map(check_entry, configs, chunksize=4))
+    return configs, results
+
+def ddf_entries(files):
+    """
+    Reads uploaded DDFs into entries
+
+    @type files: list
+    @param files: (name, content) of each DDF
+
+    @return returns a list of entries and a list of errors for the
+        files that could not be read
+    """
+    entries = []
+    errors = []
+    for name, text in files:
+        try:
+            config = oopgui.ddf_to_config(text)
+        except Exception as exc:
+            errors.append({'name':name, 'errors':[''.join(('bad DDF: ',
+                    str(exc)))]})
+            continue
+        entry = dict((key, val[0]) for key, val in config.items())
+        entry['ddfname'] = name
+        entries.append(entry)
+    return entries, errors
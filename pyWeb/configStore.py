@@ -0,0 +1,369 @@
+"""
+Storage backends for saved configurations
+
+Oopgui keeps configurations (and ToO requests) through a store with
+four operations: insert, find, ensure_indexes and close. MongoStore
+uses the osiris Mongo database through db_conn_mongo. SQLiteStore
+keeps them in a local SQLite file, so the tool also works without a
+network database, and can copy what it stores to another store (e.g.
+Mongo) in the background.
+
+Lookups use criteria dictionaries built by Oopgui.config_query:
+semester, progname, keckID and ddfname match exactly, object matches
+the start of the name, and filter matches the spec or imager filter.
+"""
+
+import os
+import re
+import json
+import uuid
+import sqlite3
+import threading
+
+try:
+    import db_conn_mongo as dcm
+except ImportError:
+    dcm = None
+
+store = None
+storeLock = threading.Lock()
+
+def open_store():
+    """
+    Opens the store named by the environment: OOPGUI_DB is the path
+    of a SQLite file to use instead of Mongo, and OOPGUI_SYNC=1 copies
+    what is saved there to Mongo, once start_sync is called
+
+    @return returns the store
+    """
+    path = os.environ.get('OOPGUI_DB', '')
+    if not path:
+        return MongoStore()
+    sync = MongoStore() if os.environ.get('OOPGUI_SYNC') == '1' else None
+    return SQLiteStore(path, sync)
+
+def get_store():
+    """
+    Returns the store of this process, opening it the first time it
+    is asked for
+    """
+    global store
+    with storeLock:
+        if store is None:
+            store = open_store()
+    return store
+
+class MongoStore:
+    """
+    @type database: string
+    @param database: name of the Mongo database
+    """
+    def __init__(self, database='osiris'):
+        self.database = database
+
+    def connect(self, collection):
+        if dcm is None:
+            raise RuntimeError('db_conn_mongo is not available')
+        mc = dcm.db_conn_mongo(self.database)
+        mc.db_connect()
+        mc.db = mc.client[mc.database]
+        mc.col = mc.db[collection]
+        return mc
+
+    def query(self, criteria):
+        """
+        Converts lookup criteria to a Mongo query
+        """
+        query = {}
+        for key, val in criteria.items():
+            if key == 'object':
+                query['object'] = {'$regex':''.join(('^', re.escape(val)))}
+            elif key == 'filter':
+                query['$or'] = [{'specFilter':val}, {'imgFilter':val}]
+            else:
+                query[key] = val
+        return query
+
+    def insert(self, records, collection='instrConfigs'):
+        """
+        Stores records with one insert
+
+        @return returns True if they were stored
+        """
+        mc = self.connect(collection)
+        try:
+            mc.col.insert_many(records, ordered=False)
+        except:
+            return False
+        else:
+            return True
+        finally:
+            mc.db_close()
+
+    def find(self, criteria, fields=None, page=0, perPage=50,
+            collection='instrConfigs'):
+        """
+        Reads one page of records, newest first
+
+        @type fields: list
+        @param fields: values returned for each record, all if None
+        @type perPage: int
+        @param perPage: records per page, 0 for all of them
+
+        @return returns the total number of matches and the page
+        """
+        query = self.query(criteria)
+        if fields:
+            projection = dict((key, 1) for key in fields)
+        else:
+            projection = {}
+        projection['_id'] = 0
+        mc = self.connect(collection)
+        try:
+            cur = mc.col.find(query, projection).sort('_id', -1)
+            if perPage > 0:
+                cur = cur.skip(page*perPage).limit(perPage)
+            records = list(cur)
+            total = len(records) if perPage <= 0 else \
+                    mc.col.count_documents(query)
+        finally:
+            mc.db_close()
+        return total, records
+
+    def upsert(self, records, key, collection='instrConfigs'):
+        """
+        Stores records, replacing those with the same key value, so
+        storing a record again does not duplicate it
+
+        @return returns True if they were all stored
+        """
+        from pymongo import ReplaceOne
+        mc = self.connect(collection)
+        try:
+            mc.col.create_index(key, background=True)
+            mc.col.bulk_write([ReplaceOne({key:rec[key]}, rec, upsert=True)
+                    for rec in records], ordered=False)
+        except:
+            return False
+        else:
+            return True
+        finally:
+            mc.db_close()
+
+    def ensure_indexes(self, indexes, collection='instrConfigs'):
+        mc = self.connect(collection)
+        try:
+            for keys in indexes:
+                mc.col.create_index(keys, background=True)
+        finally:
+            mc.db_close()
+
+    def start_sync(self):
+        pass
+
+    def close(self):
+        pass
+
+class SQLiteStore:
+    """
+    Each collection is a table holding the record as JSON, with the
+    values used for lookups copied into indexed columns. Every thread
+    has its own connection; the file is in WAL mode so readers do not
+    wait for a writer.
+
+    @type path: string
+    @param path: SQLite file
+    @type sync: store
+    @param sync: store that saved records are copied to in the
+        background once start_sync is called, or None. Records are
+        given a syncId when saved and copied by it, so copying a
+        record again replaces it
+    @type syncInterval: float
+    @param syncInterval: seconds between copies when nothing new
+        has been saved
+    @type syncBatch: int
+    @param syncBatch: records copied per insert
+    """
+    columns = ['semester', 'progname', 'keckID', 'ddfname', 'object',
+            'specFilter', 'imgFilter']
+    syncInterval = 60.0
+    syncBatch = 500
+
+    def __init__(self, path, sync=None):
+        self.path = path
+        self.sync = sync
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.tables = set()
+        self.pending = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start_sync(self):
+        """
+        Starts copying to the sync store. Only one process should copy
+        from a file, so this is left to the server rather than done on
+        open.
+        """
+        with self.lock:
+            if self.sync is not None and self.thread is None:
+                self.thread = threading.Thread(target=self.run_sync,
+                        daemon=True)
+                self.thread.start()
+
+    def connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def table(self, collection):
+        """
+        Creates the table of a collection the first time it is used
+
+        @return returns the table name
+        """
+        if collection not in self.tables:
+            if not collection.isidentifier():
+                raise ValueError(''.join(('bad collection name ', collection)))
+            cols = ''.join([', "{}" TEXT'.format(col) for col in self.columns])
+            with self.lock, self.connect() as conn:
+                conn.execute(''.join(('CREATE TABLE IF NOT EXISTS ', collection,
+                        ' (id INTEGER PRIMARY KEY', cols,
+                        ', doc TEXT NOT NULL, synced INTEGER DEFAULT 0)')))
+                conn.execute(''.join(('CREATE INDEX IF NOT EXISTS ', collection,
+                        '_synced ON ', collection, ' (synced) WHERE synced = 0')))
+                self.tables.add(collection)
+        return collection
+
+    def insert(self, records, collection='instrConfigs'):
+        """
+        Stores records in one transaction
+
+        @return returns True if they were stored
+        """
+        table = self.table(collection)
+        sql = ''.join(('INSERT INTO ', table, ' (',
+                ', '.join('"{}"'.format(col) for col in self.columns),
+                ', doc) VALUES (', ', '.join('?'*(len(self.columns)+1)), ')'))
+        if self.sync is not None:
+            records = [dict(rec, syncId=rec.get('syncId', uuid.uuid4().hex))
+                    for rec in records]
+        rows = [[None if rec.get(col) is None else str(rec[col])
+                for col in self.columns] + [json.dumps(rec, default=str)]
+                for rec in records]
+        try:
+            with self.connect() as conn:
+                conn.executemany(sql, rows)
+        except sqlite3.Error:
+            return False
+        self.pending.set()
+        return True
+
+    def where(self, criteria):
+        """
+        Converts lookup criteria to a WHERE clause and its parameters
+        """
+        clauses = []
+        params = []
+        for key, val in criteria.items():
+            if key == 'object':
+                # A range rather than LIKE, so the index is used
+                clauses.append('object >= ? AND object < ?')
+                params.extend((val, val + '\uffff'))
+            elif key == 'filter':
+                clauses.append('(specFilter = ? OR imgFilter = ?)')
+                params.extend((val, val))
+            elif key in self.columns:
+                clauses.append('"{}" = ?'.format(key))
+                params.append(val)
+            else:
+                raise ValueError(''.join(('cannot look up ', key)))
+        if not clauses:
+            return '', params
+        return ''.join((' WHERE ', ' AND '.join(clauses))), params
+
+    def find(self, criteria, fields=None, page=0, perPage=50,
+            collection='instrConfigs'):
+        """
+        Reads one page of records, newest first; see MongoStore.find
+        """
+        table = self.table(collection)
+        where, params = self.where(criteria)
+        sql = ''.join(('SELECT doc FROM ', table, where, ' ORDER BY id DESC'))
+        conn = self.connect()
+        if perPage > 0:
+            rows = conn.execute(sql + ' LIMIT ? OFFSET ?',
+                    params + [perPage, page*perPage]).fetchall()
+            total = conn.execute(''.join(('SELECT COUNT(*) FROM ', table,
+                    where)), params).fetchone()[0]
+        else:
+            rows = conn.execute(sql, params).fetchall()
+            total = len(rows)
+        records = [json.loads(row[0]) for row in rows]
+        if fields:
+            records = [dict((key, rec[key]) for key in fields if key in rec)
+                    for rec in records]
+        return total, records
+
+    def ensure_indexes(self, indexes, collection='instrConfigs'):
+        table = self.table(collection)
+        with self.lock, self.connect() as conn:
+            for keys in indexes:
+                cols = [('id' if key == '_id' else key, order)
+                        for key, order in keys]
+                name = '_'.join([table] + [col for col, order in cols])
+                conn.execute(''.join(('CREATE INDEX IF NOT EXISTS ', name,
+                        ' ON ', table, ' (', ', '.join(
+                        '"{}" {}'.format(col, 'DESC' if order < 0 else 'ASC')
+                        for col, order in cols), ')')))
+
+    def sync_once(self):
+        """
+        Copies one batch of unsynced records of each table
+
+        @return returns the number of records copied
+        """
+        conn = self.connect()
+        copied = 0
+        tables = conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        for table, in tables:
+            rows = conn.execute(''.join(('SELECT id, doc FROM ', table,
+                    ' WHERE synced = 0 ORDER BY id LIMIT ?')),
+                    [self.syncBatch]).fetchall()
+            if not rows:
+                continue
+            records = [json.loads(doc) for id, doc in rows]
+            for (id, doc), rec in zip(rows, records):
+                # Saved before syncing was turned on
+                rec.setdefault('syncId', ''.join((table, ':', str(id))))
+            if not self.sync.upsert(records, 'syncId', table):
+                continue
+            with conn:
+                conn.executemany(''.join(('UPDATE ', table,
+                        ' SET synced = 1 WHERE id = ?')),
+                        [(id,) for id, doc in rows])
+            copied += len(rows)
+        return copied
+
+    def run_sync(self):
+        while not self.stopped.is_set():
+            self.pending.wait(self.syncInterval)
+            self.pending.clear()
+            try:
+                while self.sync_once() and not self.stopped.is_set():
+                    pass
+            except Exception as e:
+                print ('sync failed:', e)
+
+    def close(self):
+        self.stopped.set()
+        self.pending.set()
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
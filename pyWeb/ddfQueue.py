@@ -0,0 +1,356 @@
+"""
+DDF queue directory index
+
+A DDFQueue keeps an in-memory index of the DDFs in a queue directory
+(name, size, modification time and content hash) and their order, so
+listings do not rescan the directory. The index follows changes made
+by other programs through inotify on Linux, or by polling the
+modification times elsewhere. The order is kept in the directory in
+queueOrder, one file name per line, so the observing tool and other
+servers see it too.
+
+Queue directories must lie under the root named by OOPGUI_QUEUE_ROOT
+(the home directory by default), and at most maxQueues are watched at
+once; the least recently used one is stopped to make room.
+"""
+
+import os
+import sys
+import struct
+import select
+import hashlib
+import threading
+import ctypes
+import ctypes.util
+from collections import OrderedDict
+
+root = os.path.realpath(os.path.expanduser(
+        os.environ.get('OOPGUI_QUEUE_ROOT', '~/')))
+maxQueues = 8
+queues = OrderedDict()
+queuesLock = threading.Lock()
+
+def queue_path(directory):
+    """
+    Resolves a queue directory, links included, and checks it is under
+    the queue root
+
+    @type directory: string
+    @param directory: queue directory, may start with ~
+
+    @return returns the absolute path of the directory, raises
+        ValueError if it is outside the root
+    """
+    directory = os.path.realpath(os.path.expanduser(directory))
+    if os.path.commonpath([root, directory]) != root:
+        raise ValueError(''.join(('queue directory must be under ', root)))
+    return directory
+
+def check_name(name):
+    """
+    Checks a DDF name can be written in a queue directory: a plain
+    file name, not hidden and not the order file
+
+    @return returns the name, raises ValueError if it can not
+    """
+    if os.path.basename(name) != name or name.startswith('.') or \
+            name == DDFQueue.orderFile:
+        raise ValueError(''.join(('bad queue file name ', name)))
+    return name
+
+def get_queue(directory):
+    """
+    Returns the queue of a directory, starting its watcher the first
+    time it is asked for
+
+    @type directory: string
+    @param directory: queue directory, may start with ~, see queue_path
+    """
+    directory = queue_path(directory)
+    with queuesLock:
+        queue = queues.get(directory)
+        if queue is None:
+            queue = queues[directory] = DDFQueue(directory)
+            queue.start()
+            while len(queues) > maxQueues:
+                queues.popitem(last=False)[1].stop()
+        queues.move_to_end(directory)
+    return queue
+
+class Inotify:
+    """
+    Minimal inotify watch of one directory through libc; raises
+    OSError where inotify is not available
+    """
+    # IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    # IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    mask = 0x002 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200 | 0x400
+    overflow = 0x4000
+    header = struct.Struct('iIII')
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        wd = libc.inotify_add_watch(self.fd, directory.encode(), self.mask)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+
+    def read(self, timeout):
+        """
+        Waits for events
+
+        @return returns the names of the changed files, or None if
+            events were lost and the directory must be rescanned
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64*1024)
+        names = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, size = self.header.unpack_from(data, pos)
+            pos += self.header.size
+            if mask & self.overflow:
+                return None
+            names.append(data[pos:pos+size].rstrip(b'\0').decode())
+            pos += size
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+class DDFQueue:
+    """
+    @type directory: string
+    @param directory: absolute path of the queue directory
+    @type entries: dictionary
+    @param entries: file name -> name, size, mtime and hash
+    @type order: list
+    @param order: queued file names, first to be observed first
+    @type hashes: dictionary
+    @param hashes: content hash -> set of file names, for duplicates
+    @type interval: float
+    @param interval: seconds between scans when polling
+    """
+    orderFile = 'queueOrder'
+    interval = 2.0
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = {}
+        self.order = []
+        self.hashes = {}
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.watcher = None
+        os.makedirs(directory, exist_ok=True)
+        self.read_order()
+        self.scan()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def file_hash(self, path):
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64*1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def read_order(self):
+        try:
+            with open(self.path(self.orderFile)) as f:
+                self.order = [line.strip() for line in f if line.strip()]
+        except OSError:
+            self.order = []
+
+    def write_order(self):
+        tmp = self.path(''.join(('.', self.orderFile, '.tmp')))
+        with open(tmp, 'w') as f:
+            f.write(''.join([name + '\n' for name in self.order]))
+        os.replace(tmp, self.path(self.orderFile))
+
+    def forget_hash(self, digest, name):
+        names = self.hashes.get(digest, set())
+        names.discard(name)
+        if not names:
+            self.hashes.pop(digest, None)
+
+    def refresh(self, name):
+        """
+        Updates the index entry of one file after it changed
+
+        @return returns True if the index changed
+        """
+        if not name.endswith('.ddf'):
+            return False
+        with self.lock:
+            old = self.entries.get(name)
+            try:
+                st = os.stat(self.path(name))
+            except OSError:
+                if old is None:
+                    return False
+                del self.entries[name]
+                self.forget_hash(old['hash'], name)
+                if name in self.order:
+                    self.order.remove(name)
+                return True
+            if old is not None and old['mtime'] == st.st_mtime and \
+                    old['size'] == st.st_size:
+                return False
+            try:
+                digest = self.file_hash(self.path(name))
+            except OSError:
+                return False
+            if old is not None:
+                self.forget_hash(old['hash'], name)
+            self.entries[name] = {'name':name, 'size':st.st_size,
+                    'mtime':st.st_mtime, 'hash':digest}
+            self.hashes.setdefault(digest, set()).add(name)
+            if name not in self.order:
+                self.order.append(name)
+            return True
+
+    def scan(self):
+        """
+        Brings the whole index up to date with the directory
+        """
+        with self.lock:
+            names = set(name for name in os.listdir(self.directory)
+                    if name.endswith('.ddf'))
+            changed = False
+            for name in names | set(self.entries):
+                changed = self.refresh(name) or changed
+            # Drop names whose files have gone and queue files that
+            # queueOrder does not list at the end
+            order = [name for name in self.order if name in self.entries]
+            order += sorted(set(self.entries) - set(order))
+            if changed or order != self.order:
+                self.order = order
+                self.write_order()
+
+    def run(self):
+        try:
+            self.watcher = Inotify(self.directory) if sys.platform.startswith(
+                    'linux') else None
+        except OSError:
+            self.watcher = None
+        try:
+            # Catch what changed before the watch was set up
+            self.scan()
+            self.watch()
+        finally:
+            if self.watcher is not None:
+                self.watcher.close()
+                self.watcher = None
+
+    def watch(self):
+        while not self.stopped.is_set():
+            try:
+                if self.watcher is None:
+                    self.stopped.wait(self.interval)
+                    self.scan()
+                    continue
+                names = self.watcher.read(self.interval)
+                if names is None:
+                    self.scan()
+                elif names:
+                    with self.lock:
+                        changed = False
+                        for name in set(names):
+                            if name == self.orderFile:
+                                # Our own writes read back unchanged
+                                old = self.order
+                                self.read_order()
+                                if self.order != old:
+                                    self.scan()
+                            else:
+                                changed = self.refresh(name) or changed
+                        if changed:
+                            self.write_order()
+            except Exception as e:
+                print ('queue watch failed:', e)
+                self.stopped.wait(self.interval)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def list(self):
+        """
+        @return returns the queued DDFs in order
+        """
+        with self.lock:
+            return [dict(self.entries[name], position=i)
+                    for i, name in enumerate(self.order)]
+
+    def add(self, src, name=None):
+        """
+        Copies a DDF into the queue unless the same content is queued
+
+        @type src: string
+        @param src: path of the DDF
+        @type name: string
+        @param name: name in the queue, the name of src if None
+
+        @return returns the queue name of the DDF and whether it was
+            already queued; raises ValueError if name is not a plain
+            file name
+        """
+        name = check_name(name or os.path.basename(src))
+        digest = self.file_hash(src)
+        with self.lock:
+            if digest in self.hashes:
+                # The first queued copy
+                return min(self.hashes[digest], key=self.order_key), True
+            tmp = self.path(''.join(('.', name, '.tmp')))
+            with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+                fout.write(fin.read())
+            os.replace(tmp, self.path(name))
+            self.refresh(name)
+            self.write_order()
+        return name, False
+
+    def order_key(self, name):
+        return self.order.index(name) if name in self.order else len(self.order)
+
+    def reorder(self, names):
+        """
+        Moves the given DDFs to the front of the queue in the given
+        order, the rest keep their order after them
+
+        @return returns the new order
+        """
+        with self.lock:
+            front = [name for name in names if name in self.entries]
+            self.order = front + [name for name in self.order
+                    if name not in front]
+            self.write_order()
+            return list(self.order)
+
+    def dequeue(self, name):
+        """
+        Removes a DDF from the queue
+
+        @return returns True if it was queued
+        """
+        with self.lock:
+            if name not in self.entries or os.path.basename(name) != name:
+                return False
+            try:
+                os.remove(self.path(name))
+            except OSError:
+                pass
+            self.refresh(name)
+            self.write_order()
+            return True
@@ -101,10 +101,140 @@ function Oopgui(){
 
     self.showFile = function(){
         El("loadfile").classList.toggle("show");
+        if (El("loadfile").classList.contains("show")) {
+            self.listConfigs('dbConfigs', {'keckID':self.getKeckID()}, 0);
+        }
     };
 
     self.showQueue = function(){
         El('queue').classList.toggle('show');
+        if (El('queue').classList.contains('show')) {
+            ajaxPost('queue_list', {}, self.showQueueFiles);
+            self.listConfigs('queueConfigs', {'semid':El('pcodelist').value}, 0);
+        }
+    };
+
+    // Lists the queued DDFs, each can be moved to the front or removed
+    self.showQueueFiles = function(data){
+        var div = El('queueFiles');
+        while(div.hasChildNodes()){
+            div.removeChild(div.lastChild);
+        }
+        for (var i = 0; i < data.length; i++){
+            var row = document.createElement('div');
+            row.innerHTML = (i+1) + '. ' + data[i]['name'] + ' ';
+            var first = document.createElement('button');
+            first.innerHTML = '&uarr;';
+            first.onclick = (function(name){
+                return function(e){
+                    e.stopPropagation();
+                    ajaxPost('queue_reorder', {'names':name}, function(){
+                        ajaxPost('queue_list', {}, self.showQueueFiles);
+                    });
+                };
+            })(data[i]['name']);
+            var remove = document.createElement('button');
+            remove.innerHTML = 'x';
+            remove.onclick = (function(name){
+                return function(e){
+                    e.stopPropagation();
+                    ajaxPost('queue_dequeue', {'name':name}, function(){
+                        ajaxPost('queue_list', {}, self.showQueueFiles);
+                    });
+                };
+            })(data[i]['name']);
+            row.appendChild(first);
+            row.appendChild(remove);
+            div.appendChild(row);
+        }
+    };
+
+    window.setQueue = function(){
+        var qdir = prompt('Please enter the queue directory: ', '~/');
+        if (qdir) ajaxPost('set_queue', {'queueDir':qdir}, function(data){
+            if (data['error']) alert(data['error']);
+            else self.showQueueFiles(data);
+        });
+    };
+
+    window.sendQueue = function(force){
+        function callback(data){
+            if (data['overlaps']){
+                var counts = data['overlaps']['counts'];
+                var msg = [];
+                if (counts['spec']) msg.push(counts['spec'] + ' spec sky/object overlaps');
+                if (counts['imag']) msg.push(counts['imag'] + ' imager sky/object overlaps');
+                if (counts['objDuplicates']) msg.push(counts['objDuplicates'] + ' repeated object positions');
+                if (counts['skyDuplicates']) msg.push(counts['skyDuplicates'] + ' repeated sky positions');
+                if (confirm(msg.join('\n') + '\nQueue anyway?')) sendQueue(true);
+            }
+            else if (data['error']) alert(data['error']);
+            else if (data['duplicate']) alert('Already queued as ' + data['name']);
+        }
+        var params = self.createQstr();
+        if (force === true) params['force'] = 'true';
+        ajaxPost('send_to_queue', params, callback);
+    };
+
+    // Lists one page of the saved configs matching params in the
+    // element, each one loads the config into the form when clicked
+    self.listConfigs = function(id, params, page){
+        var perPage = 20;
+        function callback(data){
+            var div = El(id);
+            while(div.hasChildNodes()){
+                div.removeChild(div.lastChild);
+            }
+            var configs = data['configs'];
+            for (var i = 0; i < configs.length; i++){
+                var btn = document.createElement('button');
+                btn.innerHTML = configs[i]['ddfname'] + ' (' +
+                        unescape(configs[i]['object']) + ', ' +
+                        configs[i]['specFilter'] + ')';
+                btn.onclick = (function(cfg){
+                    return function(){ self.loadConfig(cfg); };
+                })(configs[i]);
+                div.appendChild(btn);
+            }
+            var pages = Math.ceil(data['total']/perPage);
+            if (pages > 1) {
+                var nav = [['<', page-1], ['>', page+1]];
+                for (var j = 0; j < nav.length; j++){
+                    if (nav[j][1] < 0 || nav[j][1] >= pages) continue;
+                    var btn = document.createElement('button');
+                    btn.innerHTML = nav[j][0];
+                    btn.onclick = (function(p){
+                        return function(e){
+                            // Keep the dropdown open while paging
+                            e.stopPropagation();
+                            self.listConfigs(id, params, p);
+                        };
+                    })(nav[j][1]);
+                    div.appendChild(btn);
+                }
+            }
+        }
+        var qry = {'page':page, 'perPage':perPage,
+                'fields':'semester,progname,ddfname,object,specFilter'};
+        for (var key in params) qry[key] = params[key];
+        ajaxPost('find_configs', qry, callback);
+    };
+
+    self.loadConfig = function(cfg){
+        function callback(data){
+            if (!data) return;
+            for (var key in data){
+                var el = El(key);
+                if (!el || key == 'ddfname') continue;
+                el.value = (key == 'object' || key == 'dataset') ?
+                        unescape(data[key]) : data[key];
+            }
+            El('ddfname').innerHTML = data['ddfname'];
+            self.update();
+        }
+        var params = {'semid':cfg['semester'] + '_' + cfg['progname'],
+                'ddfname':cfg['ddfname']};
+        ajaxPost('load_from_db', params, callback);
     };
 
     window.onclick = function(event) {
@@ -149,6 +279,8 @@ function Oopgui(){
 
     self.objMode = function () {
         var pattern = El('objPattern');
+        if (pattern.value == "Statistical Dither") El('objStat').style.display = '';
+        else El('objStat').style.display = 'none';
         if (pattern.value == "None") {
             self.userdefs = {};
             El('objRaster').style.display = 'none';
@@ -224,6 +356,8 @@ function Oopgui(){
 
     self.skyMode = function () {
         var pattern = El('skyPattern');
+        if (pattern.value == "Statistical Dither") El('skyStat').style.display = '';
+        else El('skyStat').style.display = 'none';
         if (pattern.value == "None") {
             self.userdefs = {};
             El('nodOffX').disabled = true;
@@ -531,6 +665,10 @@ function Oopgui(){
             'imgMode':El('imgMode').value,
             'dataset':escape(El('dataset').value),
             'object':escape(El('object').value),
+            'ra':El('ra').value,
+            'dec':El('dec').value,
+            'background':El('background').value,
+            'bgScale':El('bgScale').value,
             'targType':El('targType').value,
             'coordSys':El('coordSys').value,
             'aoType':El('aoType').value,
@@ -546,6 +684,10 @@ function Oopgui(){
             'objPattern':El('objPattern').value,
             'objFrames1':El('objFrames1').value,
             'objFrames2':El('objFrames2').value,
+            'objOrder':El('objOrder').value,
+            'objSampler':El('objSampler').value,
+            'objSeed':El('objSeed').value,
+            'objMinSep':El('objMinSep').value,
             'objLenX':objLenX,
             'objHgtY':objHgtY,
             'imgFilter':El('imgFilter').value,
@@ -557,9 +699,14 @@ function Oopgui(){
             'skyPattern':El('skyPattern').value,
             'skyFrames1':El('skyFrames1').value,
             'skyFrames2':El('skyFrames2').value,
+            'skyOrder':El('skyOrder').value,
+            'skySampler':El('skySampler').value,
+            'skySeed':El('skySeed').value,
+            'skyMinSep':El('skyMinSep').value,
             'skyLenX':skyLenX,
             'skyHgtY':skyHgtY,
-            'defs':self.defs
+            'defs':self.defs,
+            'coverage':El('coverage').checked ? 'true' : 'false'
         };
         console.log(params);
         return params;
@@ -572,10 +719,56 @@ function Oopgui(){
         }
 
         var params = self.createQstr();
+        // Let the server pick a resolution that fits the image element
+        params['width'] = El('imgResult').clientWidth;
+        params['dpr'] = window.devicePixelRatio || 1;
 
         var qry = formatGET(params);
         El('imgResult').src='drawgui?'+qry;
         //ajaxPost ('drawgui', params, callback);
+        self.showGuideStars(params);
+    };
+
+    // Shows the best guide star near the target, when it has a position
+    self.showGuideStars = function(params){
+        if (!params['ra'] || !params['dec']){
+            El('guideStars').innerHTML = '';
+            return;
+        }
+        ajaxPost('guide_stars', params, function(data){
+            var div = El('guideStars');
+            if (data === null) div.innerHTML = '';
+            else if (data['best'] === null) div.innerHTML = 'No ' +
+                    data['aoType'] + ' star within ' + data['radius'] + '"';
+            else div.innerHTML = data['candidates'] + ' stars, best R=' +
+                    data['best']['mag'] + ' at ' + data['best']['sep'] + '"';
+        });
+    };
+
+    self.estimateTime = function() {
+        function callback(data){
+            var est = data['configs'][0];
+            if (!est['valid']) alert('The exposure values are not complete');
+            else alert(est['frames'] + ' frames\n' +
+                    'Science: ' + (est['science']/60).toFixed(1) + ' min\n' +
+                    'Overhead: ' + (est['overhead']/60).toFixed(1) + ' min\n' +
+                    'Total: ' + (est['total']/60).toFixed(1) + ' min');
+        }
+        ajaxPost('estimate_time', self.createQstr(), callback);
+    };
+
+    self.downloadCoverage = function() {
+        var params = self.createQstr();
+        params['fmt'] = El('coverageFmt').value;
+        window.open('coverage?' + formatGET(params));
+    };
+
+    self.playSequence = function() {
+        var params = self.createQstr();
+        params['fmt'] = El('animFmt').value;
+        params['width'] = El('imgResult').clientWidth;
+        params['dpr'] = window.devicePixelRatio || 1;
+        El('imgResult').src = 'animate?' + formatGET(params);
     };
 
     self.getPCodes = function() {
@@ -611,4 +804,8 @@ function Oopgui(){
     El('saveBtn').onclick = self.saveDDF;
     El('saveDB').onclick = self.saveDB;
     El('ddfname').onclick = self.setDDF;
+    El('coverage').onchange = self.update;
+    El('coverageBtn').onclick = self.downloadCoverage;
+    El('estimateBtn').onclick = self.estimateTime;
+    El('playBtn').onclick = self.playSequence;
 }
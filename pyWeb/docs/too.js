@@ -0,0 +1,138 @@
+function ToO(){
+    var self = this;
+
+    function El(id){
+        return document.getElementById(id);
+    }
+
+    // Fills a select with values, labels default to the values
+    function fill(id, values, labels){
+        var select = El(id);
+        while(select.hasChildNodes()){
+            select.removeChild(select.lastChild);
+        }
+        var option = document.createElement('option');
+        option.value = '';
+        option.innerHTML = 'Select...';
+        select.appendChild(option);
+        for (var i = 0; i < values.length; i++){
+            option = document.createElement('option');
+            option.value = values[i];
+            option.innerHTML = labels ? labels[i] : values[i];
+            select.appendChild(option);
+        }
+    }
+
+    // Shows the given step and hides every step after it
+    function show(step){
+        var steps = ['Instrument', 'Night', 'InstrConfig', 'TargetList',
+                'Sequence', 'Trigger'];
+        var idx = steps.indexOf(step);
+        for (var i = 0; i < steps.length; i++){
+            El(steps[i]).style.display = (i <= idx) ? '' : 'none';
+        }
+    }
+
+    self.getProjects = function(){
+        function callback(data){
+            var values = [], labels = [];
+            for (var i = 0; i < data.length; i++){
+                values.push(data[i]['semid']);
+                labels.push(data[i]['semid'] + ': ' + data[i]['title']);
+            }
+            fill('projcode', values, labels);
+        }
+        ajaxPost('too_projects', {}, callback);
+    };
+
+    El('projcode').onchange = function(){
+        var semid = this.value;
+        if (semid == ''){ show(''); return; }
+        ajaxPost('too_instruments', {'semid':semid}, function(data){
+            fill('instrument', data);
+            show('Instrument');
+        });
+    };
+
+    El('instrument').onchange = function(){
+        var params = {'semid':El('projcode').value, 'instrument':this.value};
+        if (this.value == ''){ show('Instrument'); return; }
+        ajaxPost('too_nights', params, function(data){
+            fill('requestedNight', data);
+            show('Night');
+        });
+    };
+
+    El('requestedNight').onchange = function(){
+        if (this.value == ''){ show('Night'); return; }
+        ajaxPost('too_configs', {'semid':El('projcode').value}, function(data){
+            var values = [], labels = [];
+            for (var i = 0; i < data.length; i++){
+                values.push(data[i]['ddfname']);
+                labels.push(data[i]['ddfname'] + ' (' + data[i]['object'] +
+                        ', ' + data[i]['specFilter'] + ')');
+            }
+            fill('instrconfig', values, labels);
+            show('InstrConfig');
+            self.showVisibility(data);
+        });
+    };
+
+    // Lists how long each configured target is up on the chosen night
+    self.showVisibility = function(configs){
+        var targets = [];
+        for (var i = 0; i < configs.length; i++){
+            if (configs[i]['ra'] && configs[i]['dec']) targets.push(configs[i]);
+        }
+        var div = El('visibility');
+        div.innerHTML = '';
+        if (!targets.length) return;
+        var params = {'night':El('requestedNight').value,
+                'targets':JSON.stringify(targets)};
+        ajaxPost('visibility', params, function(data){
+            var rows = ['<tr><th>Target</th><th>Max alt</th><th>Airmass</th>' +
+                    '<th>Rise (UT)</th><th>Set (UT)</th><th>Dark hours</th></tr>'];
+            for (var i = 0; i < data['targets'].length; i++){
+                var t = data['targets'][i];
+                rows.push('<tr><td>' + unescape(t['name']) + '</td><td>' +
+                        t['maxAlt'] + '</td><td>' + (t['minAirmass'] || '-') +
+                        '</td><td>' + (t['rise'] || '-') + '</td><td>' +
+                        (t['set'] || '-') + '</td><td>' + t['darkHours'] +
+                        '</td></tr>');
+            }
+            div.innerHTML = '<table>' + rows.join('') + '</table>';
+        });
+    };
+
+    El('instrconfig').onchange = function(){
+        var params = {'semid':El('projcode').value, 'ddfname':this.value};
+        if (this.value == ''){ show('InstrConfig'); return; }
+        ajaxPost('too_targets', params, function(data){
+            fill('targetlist', data);
+            show('TargetList');
+        });
+    };
+
+    El('targetlist').onchange = function(){
+        show(this.value == '' ? 'TargetList' : 'Trigger');
+    };
+
+    El('trigger').onclick = function(){
+        var params = {
+            'semid':El('projcode').value,
+            'instrument':El('instrument').value,
+            'night':El('requestedNight').value,
+            'ddfname':El('instrconfig').value,
+            'object':El('targetlist').value,
+            'number':El('Number').value,
+            'pattern':El('Pattern').value,
+            'time':El('Time').value
+        };
+        ajaxPost('too_submit', params, function(data){
+            El('status').innerHTML = data['errors'].length ?
+                    data['errors'].join('; ') : 'ToO submitted';
+        });
+    };
+
+    self.getProjects();
+}
@@ -3,11 +3,17 @@ Easy HTTP Handler
 """
 
 import os
-import cgi
 import sys,threading,datetime,http.server,socketserver
+import socket
+import select
+import json
+import time
+import collections
+import http.cookies
 import traceback
+import tempfile
+import email.parser
 
-import cgi
 try:
     from http import HTTPStatus
 except:
@@ -18,19 +24,223 @@ except:
             obj.phrase = phrase
             obj.description = desc
 
+        OK = (200, "OK")
+        NO_CONTENT = (204, "No content")
+        BAD_REQUEST = (400, "Bad request")
         NOT_FOUND = (404, "Not found")
+        REQUEST_ENTITY_TOO_LARGE = (413, "Request entity too large")
         INTERNAL_SERVER_ERROR = (500, "Internal error")
+        SERVICE_UNAVAILABLE = (503, "Service unavailable")
 
 from urllib.parse import urlparse, parse_qs
 
 class ThreadedTCPServer (socketserver.ThreadingMixIn, socketserver.TCPServer):
     pass
 
+class RequestTooLarge (Exception):
+    pass
+
+class Admission:
+    """
+    Concurrency limits by request name with a bounded wait queue.
+    A request runs when its name and its pool (cheap or not) are
+    below their limits, waits in the queue otherwise, and is refused
+    when the queue is full or it waited longer than maxWait. Cheap
+    requests have their own larger pool and leave the queue first.
+    The name of a static file is ''.
+    """
+    def __init__ (self, limits=None, defaultLimit=4, maxActive=16,
+            cheap=(), maxCheap=32, queueSize=32, maxWait=10.0):
+        self.limits = dict (limits or {})
+        self.defaultLimit = defaultLimit
+        self.maxActive = maxActive
+        self.cheap = set (cheap) | set ([''])
+        self.maxCheap = maxCheap
+        self.queueSize = queueSize
+        self.maxWait = maxWait
+        self.active = collections.Counter ()
+        self.pools = [0, 0]
+        # Waiting requests, cheap first
+        self.queues = (collections.deque (), collections.deque ())
+        self.counts = collections.Counter ()
+        self.lock = threading.Lock ()
+
+    def canRun (self, name):
+        if name in self.cheap:
+            limit = self.limits.get (name, self.maxCheap)
+            return self.active[name] < limit and self.pools[0] < self.maxCheap
+        limit = self.limits.get (name, self.defaultLimit)
+        return self.active[name] < limit and self.pools[1] < self.maxActive
+
+    def start (self, name):
+        self.active[name] += 1
+        self.pools[0 if name in self.cheap else 1] += 1
+        self.counts['admitted'] += 1
+
+    def admit (self, name, item):
+        """
+        @return returns 'run', 'queued' or 'refused'
+        """
+        with self.lock:
+            if self.canRun (name):
+                self.start (name)
+                return 'run'
+            if len(self.queues[0]) + len(self.queues[1]) < self.queueSize:
+                self.queues[0 if name in self.cheap else 1].append (
+                        (name, item, time.time ()))
+                self.counts['queued'] += 1
+                return 'queued'
+            self.counts['refused'] += 1
+            return 'refused'
+
+    def release (self, name):
+        """
+        Frees the slot of a finished request
+
+        @return returns the (name, item) of the waiting requests that
+            can run now
+        """
+        ready = []
+        with self.lock:
+            self.active[name] -= 1
+            if not self.active[name]:
+                del self.active[name]
+            self.pools[0 if name in self.cheap else 1] -= 1
+            for queue in self.queues:
+                for entry in list(queue):
+                    if self.canRun (entry[0]):
+                        queue.remove (entry)
+                        self.start (entry[0])
+                        ready.append (entry[:2])
+        return ready
+
+    def expire (self):
+        """
+        @return returns the items that waited longer than maxWait
+        """
+        late = []
+        limit = time.time () - self.maxWait
+        with self.lock:
+            for queue in self.queues:
+                while queue and queue[0][2] < limit:
+                    late.append (queue.popleft ()[1])
+            self.counts['expired'] += len(late)
+        return late
+
+    def stats (self):
+        with self.lock:
+            return {'active':dict (self.active),
+                    'activeCheap':self.pools[0],
+                    'activeOther':self.pools[1],
+                    'queueDepth':len(self.queues[0]) + len(self.queues[1]),
+                    'queuedCheap':len(self.queues[0]),
+                    'admitted':self.counts['admitted'],
+                    'queued':self.counts['queued'],
+                    'refused':self.counts['refused'],
+                    'expired':self.counts['expired']}
+
+class MultipartParser:
+    """
+    Incremental multipart/form-data parser.
+    The body is read in chunks and every part is written to a
+    SpooledTemporaryFile, so at most spoolSize bytes of a part are
+    held in memory and larger parts go to a temporary file.
+    """
+    chunkSize = 64*1024
+    maxHeaderSize = 16*1024
+
+    def __init__ (self, fp, boundary, length, maxPartSize, spoolSize):
+        self.fp = fp
+        self.remaining = length
+        self.delim = b"\r\n--" + boundary
+        self.maxPartSize = maxPartSize
+        self.spoolSize = spoolSize
+        # The first boundary is not preceded by a CRLF
+        self.buf = b"\r\n"
+
+    def fill (self):
+        n = min(self.chunkSize, self.remaining)
+        if n <= 0:
+            return False
+        data = self.fp.read (n)
+        if not data:
+            self.remaining = 0
+            return False
+        self.remaining -= len(data)
+        self.buf += data
+        return True
+
+    def skipPreamble (self):
+        keep = len(self.delim) - 1
+        while True:
+            i = self.buf.find (self.delim)
+            if i >= 0:
+                self.buf = self.buf[i+len(self.delim):]
+                return
+            self.buf = self.buf[-keep:]
+            if not self.fill ():
+                raise ValueError ("multipart boundary not found")
+
+    def readHeaders (self):
+        while True:
+            i = self.buf.find (b"\r\n\r\n")
+            if i >= 0:
+                break
+            if len(self.buf) > self.maxHeaderSize:
+                raise RequestTooLarge ("multipart headers too large")
+            if not self.fill ():
+                raise ValueError ("multipart body truncated")
+        head = self.buf[:i].decode ("UTF-8", "replace").strip ()
+        self.buf = self.buf[i+4:]
+        return email.parser.HeaderParser().parsestr (head)
+
+    def readBody (self):
+        part = tempfile.SpooledTemporaryFile (max_size=self.spoolSize)
+        keep = len(self.delim) - 1
+        size = 0
+        while True:
+            i = self.buf.find (self.delim)
+            if i >= 0:
+                data = self.buf[:i]
+                self.buf = self.buf[i+len(self.delim):]
+            else:
+                data = self.buf[:max(len(self.buf)-keep, 0)]
+                self.buf = self.buf[len(data):]
+            size += len(data)
+            if size > self.maxPartSize:
+                part.close ()
+                raise RequestTooLarge ("multipart part too large")
+            part.write (data)
+            if i >= 0:
+                break
+            if not self.fill ():
+                part.close ()
+                raise ValueError ("multipart body truncated")
+        part.seek (0)
+        return part, size
+
+    def parts (self):
+        """
+        Generates (headers, file, size) for every part in the body
+        """
+        self.skipPreamble ()
+        while True:
+            while len(self.buf) < 2 and self.fill ():
+                pass
+            if self.buf[:2] == b"--":
+                return
+            headers = self.readHeaders ()
+            part, size = self.readBody ()
+            yield headers, part, size
+
 class EasyHTTPHandler (http.server.SimpleHTTPRequestHandler):
     """
     This class handles the HTTP request from clients.
     Only GET request is implemented.
     This class should be subclassed to extend the functionality.
+    A method may return a generator (or any iterable of str/bytes)
+    instead of the whole output; it is then streamed with
+    Transfer-Encoding: chunked.
     """
     PlainTextType = "text/plain; charset=utf-8"
     HTMLType = "text/html; charset=utf-8"
@@ -38,21 +248,39 @@ class EasyHTTPHandler (http.server.SimpleHTTPRequestHandler):
     logEnabled = False
     defaultFile = "index.html"
     oop = None
+    maxBodySize = 256*1024*1024
+    maxPartSize = 64*1024*1024
+    maxFormSize = 1024*1024
+    spoolSize = 1024*1024
+    # Admission control, see Admission: limits by request name, the
+    # requests that are cheap to serve besides static files, the
+    # pool sizes and how long a refused client should wait
+    requestLimits = {}
+    cheapRequests = ['server_stats']
+    defaultLimit = 4
+    maxActive = 16
+    maxCheap = 32
+    maxQueued = 32
+    maxWait = 10.0
+    retryAfter = 2
 
     def handleRequest (self, req, qs):
+        self.extraHeaders = []
+        self.status = HTTPStatus.OK
         try:
             res = self.callMethod (req, qs)
             if res:
                 out, contype = res
-                if not out:
+                if not out and self.status == HTTPStatus.OK:
                     return
                 if isinstance(out, type('')):
                     out = bytes(out, "UTF-8")
-                self.send_response (200, "OK")
-                self.send_header ("Expires", "Feb  1 17:17:37 HST 2016")
-                self.send_header ("Cache-Control", "no-cache, must-revalidate")
-                self.send_header ("Cache-Control", "no-store")
-                self.send_header ("Content-Type", contype)
+                if not isinstance(out, (bytes, bytearray, memoryview)):
+                    self.sendStream (out, contype)
+                    return
+                self.send_response (self.status)
+                self.sendHeaders (contype)
+                self.send_header ("Content-Length", memoryview(out).nbytes)
                 self.end_headers ()
                 self.wfile.write (out)
             else:
@@ -66,6 +294,52 @@ class EasyHTTPHandler (http.server.SimpleHTTPRequestHandler):
             traceback.print_exc()   
             self.send_error (HTTPStatus.INTERNAL_SERVER_ERROR)
 
+    def sendHeaders (self, contype):
+        self.send_header ("Expires", "Feb  1 17:17:37 HST 2016")
+        self.send_header ("Cache-Control", "no-cache, must-revalidate")
+        self.send_header ("Cache-Control", "no-store")
+        self.send_header ("Content-Type", contype)
+        for name, value in self.extraHeaders:
+            self.send_header (name, value)
+
+    def sendStream (self, chunks, contype):
+        """
+        Sends the output as it is produced. HTTP/1.1 clients get it
+        chunked, HTTP/1.0 clients get it unframed up to the close of
+        the connection.
+        """
+        chunked = self.request_version == "HTTP/1.1"
+        if chunked:
+            self.protocol_version = "HTTP/1.1"
+        self.send_response (self.status)
+        self.sendHeaders (contype)
+        if chunked:
+            self.send_header ("Transfer-Encoding", "chunked")
+        self.send_header ("Connection", "close")
+        self.end_headers ()
+        self.close_connection = True
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, type('')):
+                    chunk = bytes(chunk, "UTF-8")
+                if not chunk:
+                    continue
+                if chunked:
+                    self.wfile.write (b"%X\r\n" % memoryview(chunk).nbytes)
+                    self.wfile.write (chunk)
+                    self.wfile.write (b"\r\n")
+                else:
+                    self.wfile.write (chunk)
+        except BrokenPipeError:
+            return
+        except Exception as e:
+            # The headers are gone already, so leave the response
+            # unterminated for the client to see it was cut short
+            traceback.print_exc()
+            return
+        if chunked:
+            self.wfile.write (b"0\r\n\r\n")
+
     def do_GET(self):
         parts = urlparse (self.path)
         qs = parse_qs (parts.query)
@@ -74,18 +348,69 @@ class EasyHTTPHandler (http.server.SimpleHTTPRequestHandler):
 
     def do_POST(self):
         parts = urlparse (self.path)
-        length = int(self.headers['content-length'])
-        ctype, pdict = cgi.parse_header(self.headers['content-type'])
-        boundary = pdict.get('boundary')
-
-        if boundary:
-            pdict['boundary'] = bytes(boundary, 'UTF-8')
-            qs = cgi.parse_multipart(fp=self.rfile, pdict=pdict)
-        else:
-            qs = parse_qs(bytes.decode(self.rfile.read(length), 'UTF-8'))
+        try:
+            length = int(self.headers.get('content-length', 0))
+            boundary = self.headers.get_param('boundary')
+            if boundary:
+                qs = self.parseMultipart (bytes(boundary, 'UTF-8'), length)
+            else:
+                if length > self.maxFormSize:
+                    raise RequestTooLarge ("form too large")
+                qs = parse_qs(bytes.decode(self.rfile.read(length), 'UTF-8'))
+        except RequestTooLarge:
+            self.close_connection = True
+            self.send_error (HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            return
+        except ValueError:
+            self.close_connection = True
+            self.send_error (HTTPStatus.BAD_REQUEST)
+            return
         req = parts.path[1:]
         self.handleRequest (req, qs)
 
+    def parseMultipart (self, boundary, length):
+        """
+        Parses a multipart/form-data body without reading it all
+        into memory. Fields without a filename are returned as str.
+        Uploaded files up to spoolSize are returned as bytes, larger
+        ones as a temporary file positioned at the start. The file
+        names are listed under the field name plus '.filename'.
+        """
+        if length > self.maxBodySize:
+            raise RequestTooLarge ("body too large")
+        qs = {}
+        parser = MultipartParser (self.rfile, boundary, length,
+                self.maxPartSize, self.spoolSize)
+        for headers, part, size in parser.parts ():
+            name = headers.get_param ('name', header='content-disposition')
+            if headers.get_filename () is None:
+                value = bytes.decode (part.read (), 'UTF-8')
+                part.close ()
+            elif size <= self.spoolSize:
+                value = part.read ()
+                part.close ()
+            else:
+                value = part
+            qs.setdefault (name, []).append (value)
+            if headers.get_filename () is not None:
+                qs.setdefault (name + '.filename', []).append (
+                        headers.get_filename ())
+        return qs
+
+    def readChunks (self, f, size=64*1024):
+        """
+        Generates the content of a file in chunks and closes it,
+        for streaming an uploaded file back out
+        """
+        try:
+            while True:
+                data = f.read (size)
+                if not data:
+                    return
+                yield data
+        finally:
+            f.close ()
+
     def serveFile (self, req, qs):
         self.path = self.DocRoot + "/" + req
         f = self.send_head()
@@ -116,6 +441,43 @@ class EasyHTTPHandler (http.server.SimpleHTTPRequestHandler):
     def floatVal (self, qstr, name, defValue=0):
         return float(self.getDefValue(qstr, name, str(defValue)))
 
+    def addHeader (self, name, value):
+        """
+        Adds a header to the response of the current request
+        """
+        self.extraHeaders.append ((name, value))
+
+    def setStatus (self, status):
+        """
+        Sets the status of the response of the current request
+        """
+        self.status = status
+
+    @classmethod
+    def admissionName (cls, name, data):
+        """
+        Name a request is admitted under, see AdmissionMixIn. data is
+        the start of the request as peeked at, so a handler can tell
+        cheap calls of a method from costly ones.
+        """
+        return name
+
+    def getCookie (self, name, defValue=None):
+        try:
+            cookie = http.cookies.SimpleCookie (self.headers.get ('Cookie', ''))
+            return cookie[name].value
+        except:
+            return defValue
+
+    def server_stats (self, req, qstr):
+        """
+        Admission counts and queue depth. Under the forking server
+        they are those of the moment this request was forked.
+        """
+        admission = getattr (self.server, 'admission', None)
+        stats = admission.stats () if admission else {}
+        return self.response (json.dumps (stats), self.PlainTextType)
+
     def response (self, resp, contType):
         if isinstance(resp, type('')):
             resp = bytes(resp, "UTF-8")
@@ -134,25 +496,167 @@ class EasyHTTPHandler (http.server.SimpleHTTPRequestHandler):
             return False
         return False
 
-class EasyHTTPServerThreaded (ThreadedTCPServer):
+class AdmissionMixIn:
+    """
+    Admission control in the process that accepts the connections,
+    before a thread or child is started for a request. The request
+    line is peeked at to name the request, as callMethod would; names
+    that are not methods of the handler are static files, and the
+    handler's admissionName may rename the others. Connections
+    whose request line has not come in yet are looked at again on the
+    next accept or poll, so a slow client never holds up the accept
+    loop, and are closed after lineTimeout. Refused requests get 503
+    with Retry-After straight away.
+    """
+    admission = None
+    pollInterval = 0.05
+    lineTimeout = 10.0
+
+    def setupAdmission (self, hdl):
+        self.admission = Admission (hdl.requestLimits, hdl.defaultLimit,
+                hdl.maxActive, hdl.cheapRequests, hdl.maxCheap,
+                hdl.maxQueued, hdl.maxWait)
+        self.retryAfter = hdl.retryAfter
+        self.pending = []
+
+    def requestName (self, request):
+        """
+        @return returns the name of the request, '' for a static file,
+            None if the request line is not complete yet, or False if
+            the client closed the connection or sent no request line
+        """
+        try:
+            data = request.recv (2048, socket.MSG_PEEK)
+        except OSError:
+            return False
+        if b"\r\n" not in data and 0 < len(data) < 2048:
+            return None
+        parts = data.split (b"\r\n")[0].split ()
+        if len(parts) < 2:
+            return False
+        name = urlparse (parts[1].decode ('latin-1')).path[1:].split ('/')[-1]
+        if name and callable (getattr (self.RequestHandlerClass, name, None)):
+            return self.RequestHandlerClass.admissionName (name, data)
+        return ''
+
+    def process_request (self, request, client_address):
+        if self.admission is None:
+            return super().process_request (request, client_address)
+        self.pending.append ((request, client_address, time.time ()))
+        self.checkPending ()
+
+    def checkPending (self):
+        """
+        Admits the pending connections whose request line came in
+        """
+        if not self.pending:
+            return
+        ready = select.select ([entry[0] for entry in self.pending], [], [], 0)[0]
+        late = time.time () - self.lineTimeout
+        waiting = []
+        for request, client_address, since in self.pending:
+            name = self.requestName (request) if request in ready else None
+            if name is False or (name is None and since < late):
+                self.shutdown_request (request)
+            elif name is None:
+                waiting.append ((request, client_address, since))
+            else:
+                res = self.admission.admit (name, (request, client_address))
+                if res == 'run':
+                    self.startRequest (name, request, client_address)
+                elif res == 'refused':
+                    self.refuse (request)
+        self.pending = waiting
+
+    def startRequest (self, name, request, client_address):
+        super().process_request (request, client_address)
+
+    def requestDone (self, name):
+        for name, (request, client_address) in self.admission.release (name):
+            self.startRequest (name, request, client_address)
+
+    def refuse (self, request):
+        body = b"Server busy, try again later\n"
+        head = "HTTP/1.0 %d %s\r\nRetry-After: %d\r\n" \
+                "Content-Type: text/plain; charset=utf-8\r\n" \
+                "Content-Length: %d\r\nConnection: close\r\n\r\n" % (
+                HTTPStatus.SERVICE_UNAVAILABLE, "Service Unavailable",
+                self.retryAfter, len(body))
+        try:
+            request.sendall (bytes(head, "UTF-8") + body)
+            # Take in what the client sent, so closing does not reset
+            # the connection before it reads the answer
+            request.recv (65536, socket.MSG_DONTWAIT)
+        except OSError:
+            pass
+        self.shutdown_request (request)
+
+    def service_actions (self):
+        super().service_actions ()
+        if self.admission is not None:
+            self.checkPending ()
+            for request, client_address in self.admission.expire ():
+                self.refuse (request)
+
+class EasyHTTPServerThreaded (AdmissionMixIn, ThreadedTCPServer):
     def __init__(self, ipnp, hdl):
         super(EasyHTTPServerThreaded, self).__init__(ipnp, hdl)
+        self.setupAdmission (hdl)
+        self.running = {}
+
+    def startRequest (self, name, request, client_address):
+        # Requests finishing in their threads start waiting ones too,
+        # so running is shared with the admission queue and its lock
+        with self.admission.lock:
+            self.running[request] = name
+        super().startRequest (name, request, client_address)
+
+    def process_request_thread (self, request, client_address):
+        try:
+            super().process_request_thread (request, client_address)
+        finally:
+            if self.admission is not None:
+                with self.admission.lock:
+                    name = self.running.pop (request)
+                self.requestDone (name)
 
     def run4ever (self):
         try:
-            self.serve_forever()
+            self.serve_forever(self.pollInterval)
             self.shutdown()
         except Exception as e:
             traceback.print_exc()
             print ("HTTPD terminated")
 
-class EasyHTTPServer (socketserver.ForkingTCPServer):
+class EasyHTTPServer (AdmissionMixIn, socketserver.ForkingTCPServer):
     def __init__(self, ipnp, hdl):
         super(EasyHTTPServer, self).__init__(ipnp, hdl)
+        self.setupAdmission (hdl)
+        self.running = {}
+
+    def startRequest (self, name, request, client_address):
+        before = set (self.active_children or ())
+        super().startRequest (name, request, client_address)
+        with self.admission.lock:
+            for pid in set (self.active_children or ()) - before:
+                self.running[pid] = name
+
+    def collect_children (self, *, blocking=False):
+        # A request's slot is freed when its child is reaped
+        before = set (self.active_children or ())
+        super().collect_children (blocking=blocking)
+        if self.admission is None:
+            return
+        with self.admission.lock:
+            done = [self.running.pop (pid) for pid in
+                    before - set (self.active_children or ())
+                    if pid in self.running]
+        for name in done:
+            self.requestDone (name)
 
     def run4ever (self):
         try:
-            self.serve_forever()
+            self.serve_forever(self.pollInterval)
             self.shutdown()
         except Exception as e:
             traceback.print_exc()
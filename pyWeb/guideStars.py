@@ -0,0 +1,219 @@
+"""
+AO guide star lookup in a local star catalog
+
+The catalog is a NumPy file of records (ra and dec in degrees, R mag)
+opened memory-mapped, so only the pages a lookup touches are read.
+The stars are indexed by a KD-tree on their unit vectors, where a sky
+radius is a fixed chord length and there is no trouble at RA 0 or the
+poles. The tree is built once and saved as arrays next to the
+catalog, in catalog.idx/, which are memory-mapped as well. Lookups for
+many targets walk the tree together, one level at a time.
+
+To make a catalog from a CSV file with ra, dec and mag columns:
+
+    python guideStars.py stars.csv stars.npy
+"""
+
+import os
+import sys
+import csv
+import threading
+import numpy as np
+
+catalog = None
+catalogLock = threading.Lock()
+
+def get_catalog():
+    """
+    Opens the catalog named by OOPGUI_GUIDE_CATALOG the first time it
+    is asked for
+
+    @return returns the GuideCatalog, or None if there is none
+    """
+    global catalog
+    path = os.environ.get('OOPGUI_GUIDE_CATALOG', '')
+    if not path or not os.path.exists(path):
+        return None
+    with catalogLock:
+        if catalog is None or catalog.path != path:
+            catalog = GuideCatalog(path)
+    return catalog
+
+def unit_vectors(ra, dec):
+    ra = np.radians(np.asarray(ra, dtype=float))
+    dec = np.radians(np.asarray(dec, dtype=float))
+    return np.column_stack((np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra),
+            np.sin(dec)))
+
+def chord(arcsec):
+    """
+    Distance between unit vectors separated by an angle in arcsec
+    """
+    return 2.0*np.sin(np.radians(np.asarray(arcsec)/3600.0)/2.0)
+
+def write_catalog(rows, path):
+    """
+    Saves stars as a catalog file
+
+    @type rows: iterable
+    @param rows: (ra, dec, mag) of each star
+    @type path: string
+    @param path: .npy file to write
+    """
+    stars = np.array([tuple(float(v) for v in row) for row in rows],
+            dtype=[('ra', 'f8'), ('dec', 'f8'), ('mag', 'f4')])
+    np.save(path, stars)
+
+class GuideCatalog:
+    """
+    @type path: string
+    @param path: catalog .npy file
+    @type leafSize: int
+    @param leafSize: most stars in a leaf of the tree
+    @type limits: dictionary
+    @param limits: aoType -> search radius (arcsec) and faintest R mag
+        of a usable star (the NGS itself, or the LGS tip-tilt star)
+    """
+    leafSize = 32
+    limits = {'NGS':(30.0, 14.0), 'LGS':(60.0, 18.5)}
+    indexFiles = ['order', 'xyz', 'lo', 'hi', 'start', 'end']
+
+    def __init__(self, path):
+        self.path = path
+        self.stars = np.load(path, mmap_mode='r')
+        idx = path + '.idx'
+        if not os.path.exists(os.path.join(idx, 'end.npy')) or \
+                os.path.getmtime(os.path.join(idx, 'end.npy')) < \
+                os.path.getmtime(path):
+            self.build_index(idx)
+        for name in self.indexFiles:
+            setattr(self, name, np.load(os.path.join(idx, name + '.npy'),
+                    mmap_mode='r'))
+        self.depth = int(np.log2(len(self.start) + 1)) - 1
+
+    def build_index(self, idx):
+        """
+        Builds the KD-tree and saves its arrays. The tree is complete:
+        node i has children 2i+1 and 2i+2, and each node splits its
+        stars in half along the axis where they spread the most, so
+        the nodes are kept as ranges of the reordered stars with the
+        box around each range.
+        """
+        xyz = unit_vectors(self.stars['ra'], self.stars['dec'])
+        count = len(xyz)
+        depth = 0
+        while count > self.leafSize*2**depth:
+            depth += 1
+        nodes = 2**(depth+1) - 1
+        order = np.arange(count)
+        start = np.zeros(nodes, dtype=np.int64)
+        end = np.zeros(nodes, dtype=np.int64)
+        end[0] = count
+        for node in range(2**depth - 1):
+            s, e = start[node], end[node]
+            mid = (s + e)//2
+            if e - s > 1:
+                pts = xyz[order[s:e]]
+                axis = np.argmax(pts.max(axis=0) - pts.min(axis=0))
+                part = np.argpartition(pts[:,axis], mid - s)
+                order[s:e] = order[s:e][part]
+            start[2*node+1], end[2*node+1] = s, mid
+            start[2*node+2], end[2*node+2] = mid, e
+        xyz = xyz[order]
+        lo = np.full((nodes, 3), 2.0)
+        hi = np.full((nodes, 3), -2.0)
+        leaves = np.arange(2**depth - 1, nodes)
+        for node in leaves:
+            if end[node] > start[node]:
+                lo[node] = xyz[start[node]:end[node]].min(axis=0)
+                hi[node] = xyz[start[node]:end[node]].max(axis=0)
+        for node in range(2**depth - 2, -1, -1):
+            lo[node] = np.minimum(lo[2*node+1], lo[2*node+2])
+            hi[node] = np.maximum(hi[2*node+1], hi[2*node+2])
+        os.makedirs(idx, exist_ok=True)
+        arrays = {'order':order, 'xyz':xyz.astype(np.float32), 'lo':lo,
+                'hi':hi, 'start':start, 'end':end}
+        # end.npy last, so a partly written index is rebuilt
+        for name in self.indexFiles:
+            np.save(os.path.join(idx, name + '.npy'), arrays[name])
+
+    def query(self, ra, dec, radius):
+        """
+        Stars within a radius of each target
+
+        @type ra: numpy array
+        @param ra: (N,) target right ascensions in degrees
+        @type dec: numpy array
+        @param dec: (N,) target declinations in degrees
+        @type radius: float
+        @param radius: search radius in arcsec
+
+        @return returns the target index and catalog row of every
+            star found, and its separation in arcsec
+        """
+        q = unit_vectors(ra, dec)
+        r = chord(radius)
+        # (target, node) pairs still to look at, level by level
+        tgt = np.arange(len(q))
+        node = np.zeros(len(q), dtype=np.int64)
+        for level in range(self.depth + 1):
+            lo, hi = self.lo[node], self.hi[node]
+            gap = np.maximum(lo - q[tgt], 0) + np.maximum(q[tgt] - hi, 0)
+            near = (gap*gap).sum(axis=1) <= r*r
+            tgt, node = tgt[near], node[near]
+            if level < self.depth:
+                tgt = np.repeat(tgt, 2)
+                node = (2*np.repeat(node, 2) + 1) + np.tile([0, 1], len(node))
+        counts = self.end[node] - self.start[node]
+        total = counts.sum()
+        first = np.repeat(self.start[node] - np.cumsum(counts) + counts, counts)
+        rows = first + np.arange(total)
+        tgt = np.repeat(tgt, counts)
+        d = np.asarray(self.xyz[rows], dtype=float) - q[tgt]
+        dist = np.sqrt((d*d).sum(axis=1))
+        keep = dist <= r
+        sep = np.degrees(2.0*np.arcsin(dist[keep]/2.0))*3600.0
+        return tgt[keep], np.asarray(self.order[rows[keep]]), sep
+
+    def check(self, ra, dec, aoType):
+        """
+        Guide star candidates for targets
+
+        @type aoType: string
+        @param aoType: NGS or LGS, see limits
+
+        @return returns a list with, for each target, the number of
+            usable stars and the brightest of them, or None
+        """
+        radius, faintest = self.limits.get(aoType, self.limits['NGS'])
+        ra = np.atleast_1d(np.asarray(ra, dtype=float))
+        dec = np.atleast_1d(np.asarray(dec, dtype=float))
+        tgt, rows, sep = self.query(ra, dec, radius)
+        mag = np.asarray(self.stars['mag'][rows], dtype=float)
+        usable = mag <= faintest
+        tgt, rows, sep, mag = tgt[usable], rows[usable], sep[usable], mag[usable]
+        counts = np.bincount(tgt, minlength=len(ra))
+        # Brightest first, so the first star of each target is its best
+        order = np.lexsort((sep, mag, tgt))
+        found, first = np.unique(tgt[order], return_index=True)
+        best = dict(zip(found.tolist(), order[first].tolist()))
+        results = []
+        for i in range(len(ra)):
+            res = {'aoType':aoType, 'radius':radius, 'maxMag':faintest,
+                    'candidates':int(counts[i]), 'best':None}
+            if i in best:
+                star = self.stars[rows[best[i]]]
+                res['best'] = {'ra':float(star['ra']), 'dec':float(star['dec']),
+                        'mag':round(float(mag[best[i]]), 2),
+                        'sep':round(float(sep[best[i]]), 2)}
+            results.append(res)
+        return results
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python guideStars.py stars.csv stars.npy')
+        sys.exit(1)
+    with open(sys.argv[1]) as f:
+        write_catalog(((row['ra'], row['dec'], row['mag'])
+                for row in csv.DictReader(f)), sys.argv[2])
+    GuideCatalog(sys.argv[2])
@@ -0,0 +1,159 @@
+"""
+Observing time estimates for many configurations at once
+
+A configuration (webform values, as saved by Oopgui.save_to_db) takes
+its obj pattern frames, then nods to the sky pattern, takes those and
+nods back. Each frame integrates on the spec, the imager or both (in
+the slave modes the imager runs while the spec integrates, so a frame
+lasts as long as the longer of the two), and every coadd is read out.
+The overhead is the readouts, the moves between frames, the nods and
+the setup of the configuration.
+
+The configurations are read into one array per value and the times
+are computed on the arrays, so thousands of configurations take one
+call. The overhead constants are class attributes, to be tuned to the
+instrument and telescope.
+"""
+
+import numpy as np
+
+fixedFrames = {'Stare':1, 'Box4':4, 'Box5':5, 'Box9':9}
+
+def number(config, name, default=np.nan):
+    """
+    A numeric value of a configuration, default when it is missing
+    or not a number
+    """
+    val = config.get(name, default)
+    if isinstance(val, list):
+        val = val[0] if val else default
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return default
+
+def text(config, name):
+    val = config.get(name, '')
+    if isinstance(val, list):
+        val = val[0] if val else ''
+    return str(val)
+
+def pattern_frames(config, kind):
+    """
+    Number of frames of the obj or sky pattern of a configuration
+    """
+    pattern = text(config, kind + 'Pattern')
+    if pattern in fixedFrames:
+        return fixedFrames[pattern]
+    if pattern == 'Raster Scan':
+        return number(config, kind + 'Frames1')*number(config, kind + 'Frames2')
+    if pattern == 'Statistical Dither':
+        return number(config, kind + 'Frames1')
+    if pattern == 'User Defined':
+        flags = text(config, 'defs').split(',')[2::3]
+        return float(flags.count('true' if kind == 'sky' else 'false'))
+    return 0.0
+
+class TimeEstimator:
+    """
+    @type fields: list
+    @param fields: configuration values the estimate reads
+    @type setup: float
+    @param setup: seconds to set up a configuration (filters, AO
+        loops) once the target is acquired
+    @type specReadout: float
+    @param specReadout: seconds to read out one spec coadd
+    @type imgReadout: float
+    @param imgReadout: seconds to read out one imager coadd
+    @type ditherMove: float
+    @param ditherMove: seconds to move and settle between frames
+    @type nodMove: float
+    @param nodMove: seconds to settle after a nod to or from the sky
+    @type nodRate: float
+    @param nodRate: arcsec per second while nodding
+    """
+    fields = ['ddfname', 'object', 'imgMode', 'specItime', 'specCoadds',
+            'imgItime', 'imgCoadds', 'repeats', 'nodOffX', 'nodOffY',
+            'objPattern', 'objFrames1', 'objFrames2', 'skyPattern',
+            'skyFrames1', 'skyFrames2', 'defs']
+    setup = 120.0
+    specReadout = 8.0
+    imgReadout = 3.0
+    ditherMove = 10.0
+    nodMove = 20.0
+    nodRate = 5.0
+
+    def columns(self, configs):
+        """
+        Reads the values the estimate needs into arrays
+
+        @type configs: list
+        @param configs: dictionaries of webform values, either plain
+            values or lists of one value
+
+        @return returns a dictionary of (N,) arrays
+        """
+        cols = {}
+        for name in ['specItime', 'specCoadds', 'imgItime', 'imgCoadds',
+                'repeats']:
+            cols[name] = np.array([number(cfg, name) for cfg in configs])
+        for name in ['nodOffX', 'nodOffY']:
+            cols[name] = np.array([number(cfg, name, 0.0) for cfg in configs])
+        cols['objFrames'] = np.array([pattern_frames(cfg, 'obj')
+                for cfg in configs])
+        cols['skyFrames'] = np.array([pattern_frames(cfg, 'sky')
+                for cfg in configs])
+        modes = np.array([text(cfg, 'imgMode') for cfg in configs], dtype=str)
+        cols['spec'] = ~np.char.startswith(modes, 'Independent')
+        cols['imag'] = ~np.char.startswith(modes, 'Disabled')
+        return cols
+
+    def estimate_columns(self, cols):
+        """
+        Times of the configurations given as arrays, see columns
+
+        @return returns a dictionary of (N,) arrays: frames, science
+            (seconds integrating), overhead and total (seconds), and
+            valid (False where a value needed was missing)
+        """
+        spec, imag = cols['spec'], cols['imag']
+        specExp = np.where(spec, cols['specItime']*cols['specCoadds'], 0.0)
+        specFrame = specExp + np.where(spec,
+                self.specReadout*cols['specCoadds'], 0.0)
+        imgReads = cols['imgCoadds']*cols['repeats']
+        imgExp = np.where(imag, cols['imgItime']*imgReads, 0.0)
+        imgFrame = imgExp + np.where(imag, self.imgReadout*imgReads, 0.0)
+        # The spec integration sets the science time when it runs
+        frameExp = np.where(spec, specExp, imgExp)
+        frameTime = np.maximum(specFrame, imgFrame)
+
+        frames = cols['objFrames'] + cols['skyFrames']
+        moves = np.maximum(cols['objFrames'] - 1, 0) + \
+                np.maximum(cols['skyFrames'] - 1, 0)
+        nods = np.where(cols['skyFrames'] > 0, 2.0, 0.0)
+        nodDist = np.hypot(cols['nodOffX'], cols['nodOffY'])
+
+        science = frames*frameExp
+        overhead = frames*(frameTime - frameExp) + moves*self.ditherMove + \
+                nods*(self.nodMove + nodDist/self.nodRate) + self.setup
+        valid = np.isfinite(science) & np.isfinite(overhead) & (frames > 0)
+        science = np.where(valid, science, 0.0)
+        overhead = np.where(valid, overhead, 0.0)
+        return {'frames':np.where(valid, frames, 0.0), 'science':science,
+                'overhead':overhead, 'total':science + overhead,
+                'valid':valid}
+
+    def estimate(self, configs):
+        """
+        Times of a list of configurations
+
+        @type configs: list
+        @param configs: dictionaries of webform values
+
+        @return returns a list with the frames, science, overhead and
+            total seconds and validity of each configuration, in order
+        """
+        res = self.estimate_columns(self.columns(configs))
+        names = ['frames', 'science', 'overhead', 'total', 'valid']
+        return [dict(zip(names, row)) for row in zip(*[res[name].tolist()
+                for name in names])]
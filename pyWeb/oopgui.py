@@ -1,14 +1,24 @@
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.patches as pch
+import matplotlib.collections as clt
 import matplotlib.ticker as tkr
-import shutil as sh
+import matplotlib.colors as mcl
 import pandas as pd
 import numpy as np
 import urllib.request as url
-import db_conn_mongo as dcm
+import configStore
+import ddfQueue
+import overlap
+import guideStars
+import visibility
+import skyImage
+import animation
+import os
 import json
+import xml.etree.ElementTree as ET
+import io
 from datetime import date
-from random import random
 
 class Oopgui:
     """
@@ -90,11 +100,96 @@ class Oopgui:
     @type offDefs: dictionary
     @param offDefs: Directions to move the frames for BoxN when additional
         offsets are given by the user.
+    @type objOrder: string
+    @param objOrder: Order the object Raster Scan visits its positions
+        (serpentine or rowmajor)
+    @type skyOrder: string
+    @param skyOrder: Order the sky Raster Scan visits its positions
+        (serpentine or rowmajor)
+    @type objSampler: string
+    @param objSampler: Sampler used for the object Statistical Dither
+        (uniform, gaussian or poisson)
+    @type objSeed: int
+    @param objSeed: Random seed of the object Statistical Dither. The
+        same seed always reproduces the same pattern
+    @type objMinSep: float
+    @param objMinSep: Minimum separation between object positions
+        for the poisson sampler
+    @type objStat: numpy array
+    @param objStat: Generated object Statistical Dither positions
+    @type skySampler: string
+    @param skySampler: Sampler used for the sky Statistical Dither
+    @type skySeed: int
+    @param skySeed: Random seed of the sky Statistical Dither
+    @type skyMinSep: float
+    @param skyMinSep: Minimum separation between sky positions
+        for the poisson sampler
+    @type skyStat: numpy array
+    @param skyStat: Generated sky Statistical Dither positions
+    @type userDefs: numpy array
+    @param userDefs: User Defined positions parsed from defs
+    @type userSky: numpy array
+    @param userSky: sky flag ('true' or 'false') of each userDefs entry
+    @type minHalfWidth: float
+    @param minHalfWidth: the plot reaches at least this far (arcsec)
+        from the origin on every side
+    @type minGridScale: float
+    @param minGridScale: smallest grid tick spacing (arcsec)
+    @type lodThreshold: int
+    @param lodThreshold: Number of frames in a pattern above which only
+        some outlines are drawn over a density layer. 0 disables it
+    @type lodOutlines: int
+    @param lodOutlines: Approximate number of outlines drawn when a
+        pattern is above lodThreshold
     @type draw: dictionary
     @param draw: collection of the draw functions to be called using
         the spec and image mode
+    @type stages: tuple
+    @param stages: steps of update(), in order, that are skipped when
+        none of the webform values they depend on have changed
+    @type formKeys: list
+    @param formKeys: webform values update() requires
+    @type lastConfig: dictionary
+    @param lastConfig: webform values of the previous update()
+    @type skipped: list
+    @param skipped: stages skipped by the last update()
+    @type colorSeed: int
+    @param colorSeed: seed of the starting hue of the color palette.
+        The same seed always gives the same colors
+    @type palettes: dictionary
+    @param palettes: color palettes already computed, by seed. Shared
+        by every Oopgui
+    @type images: dictionary
+    @param images: encoded images of the current figure by render
+        options, emptied on every redraw
+    @type imageTypes: dictionary
+    @param imageTypes: content type of each format render() supports
+    @type animTypes: dictionary
+    @param animTypes: content type of each format animate() supports
+    @type animLimit: int
+    @param animLimit: most frames in an animation; longer sequences
+        highlight several positions per frame
+    @type store: MongoStore or SQLiteStore
+    @param store: where configurations are saved, shared by all
+        instances
     @type 
     """
+    palettes = {}
+    # Compound indexes of instrConfigs, one per way configurations
+    # are looked up by find_configs and load_from_db. Those ending in
+    # _id also give the newest first order without sorting.
+    configIndexes = [
+            [('semester', 1), ('progname', 1), ('_id', -1)],
+            [('semester', 1), ('progname', 1), ('ddfname', 1), ('_id', -1)],
+            [('keckID', 1), ('_id', -1)],
+            [('object', 1), ('semester', 1)],
+            [('specFilter', 1), ('semester', 1)],
+            [('imgFilter', 1), ('semester', 1)],
+        ]
+    listFields = ['semester', 'progname', 'keckID', 'ddfname', 'object',
+            'specFilter', 'scale', 'imgFilter', 'objPattern', 'skyPattern',
+            'aoType']
+
     def __init__(self):
         # Initial planning params
         self.mode = 'spec'
@@ -104,12 +199,13 @@ class Oopgui:
         self.units = 'arcsec'
         self.pa = 0.0
         self.aomode = 'NGS'
-        self.queueDir = '~/'
+        self.queueDir = ddfQueue.root
         self.ddfname = 'webtest.ddf'
         self.gridScale = 4.0 #0.8
         self.boxWidth = 0.32
         self.boxHeight = 1.28
         self.filters = SpecFilters()
+        self.colorSeed = 0
         self.colorList = self.gen_color(1)
         self.schedurl = 'https://www.keck.hawaii.edu/software/db_api/telSchedule.php?'
         self.propurl = 'https://www.keck.hawaii.edu/software/db_api/proposalsAPI.php?'
@@ -127,6 +223,9 @@ class Oopgui:
         self.specY = -0.64
         self.imagX = -14.388
         self.imagY = 15.138
+        self.imagSize = 14.3
+        self.imagTilt = 47.5
+        self.coordSys = 'instr'
         self.initOffX = 0.0
         self.initOffY = 0.0
         self.nodOffX = 0.0
@@ -141,9 +240,40 @@ class Oopgui:
                 'Box5':[(0,0),(-1,1),(1,1),(1,-1),(-1,-1)],
                 'Box9':[(0,0),(-1,1),(-1,-1),(1,1),(1,-1),
                         (-1,0),(1,0),(0,1),(0,-1)],
-                'Dither':{'frames':1, 'length':1.0, 'height':1.0},
-                'Raster':{'frames':9,'rows':1,'xstep':1.0, 'ystep':1.0},
+                'Dither':{'frames':1, 'length':1.0, 'height':1.0,
+                        'sampler':'uniform', 'seed':1, 'minsep':0.0},
+                'Raster':{'frames':9,'rows':1,'xstep':1.0, 'ystep':1.0,
+                        'order':'serpentine'},
             }
+        self.objOrder = self.offDefs['Raster']['order']
+        self.skyOrder = self.offDefs['Raster']['order']
+        self.objSampler = self.offDefs['Dither']['sampler']
+        self.objSeed = self.offDefs['Dither']['seed']
+        self.objMinSep = self.offDefs['Dither']['minsep']
+        self.skySampler = self.offDefs['Dither']['sampler']
+        self.skySeed = self.offDefs['Dither']['seed']
+        self.skyMinSep = self.offDefs['Dither']['minsep']
+        self.objStat = np.zeros((0,2))
+        self.skyStat = np.zeros((0,2))
+        self.userDefs = np.zeros((0,2))
+        self.userSky = np.zeros(0, dtype=str)
+        self.minHalfWidth = 2.0
+        self.minGridScale = 0.25
+        self.lodThreshold = 200
+        self.lodOutlines = 50
+        self.showCoverage = False
+        self.coverageMap = None
+        self.coveragePixels = 256
+        self.dupTolerance = 0.01
+        self.overlapLimit = 50
+        self.ra = ''
+        self.dec = ''
+        self.guideStars = None
+        self.background = ''
+        self.bgScale = 1.0
+        self.backgroundCut = None
+        self.backgroundPixels = 1024
+        self.imageDir = os.environ.get('OOPGUI_IMAGES', 'docs')
         self.imgFilters = [
                 'Opn','Jbb','Hbb','Kbb','Zbb',
                 'Jn1','Jn2','Jn3','Hn1','Hn2',
@@ -162,58 +292,88 @@ class Oopgui:
                 'User Defined':self.draw_user
             }
 
+        self.stages = ('colors', 'geometry', 'limits', 'ticks', 'overlap',
+                'coverage', 'background', 'raster')
+        self.colorKeys = set(['objFrames1', 'objFrames2',
+                'skyFrames1', 'skyFrames2', 'colorSeed'])
+        self.objStatKeys = set(['objPattern', 'objFrames1', 'objLenX',
+                'objHgtY', 'objSampler', 'objSeed', 'objMinSep'])
+        self.skyStatKeys = set(['skyPattern', 'skyFrames1', 'skyLenX',
+                'skyHgtY', 'skySampler', 'skySeed', 'skyMinSep'])
+        self.geometryKeys = set(['imgMode', 'specFilter', 'scale',
+                'initOffX', 'initOffY', 'nodOffX', 'nodOffY',
+                'objPattern', 'objFrames1', 'objFrames2', 'objLenX',
+                'objHgtY', 'objOrder', 'objSampler', 'objSeed',
+                'objMinSep', 'skyPattern', 'skyFrames1', 'skyFrames2',
+                'skyLenX', 'skyHgtY', 'skyOrder', 'skySampler',
+                'skySeed', 'skyMinSep', 'defs', 'pa', 'coordSys'])
+        self.guideKeys = set(['ra', 'dec', 'aoType'])
+        self.backgroundKeys = set(['background', 'bgScale', 'ra', 'dec'])
+        self.coverageKeys = set(['coverage', 'specItime', 'specCoadds',
+                'imgItime', 'imgCoadds', 'repeats'])
+        self.formKeys = ['keckID', 'ddfname', 'imgMode', 'dataset',
+                'object', 'targType', 'coordSys', 'units', 'pa', 'aoType',
+                'lgsMode', 'specFilter', 'scale', 'specCoadds', 'specItime',
+                'initOffX', 'initOffY', 'objPattern', 'objFrames1',
+                'objFrames2', 'objLenX', 'objHgtY', 'imgFilter', 'repeats',
+                'imgCoadds', 'imgItime', 'nodOffX', 'nodOffY', 'skyPattern',
+                'skyFrames1', 'skyFrames2', 'skyLenX', 'skyHgtY', 'defs']
+        self.lastConfig = None
+        self.skipped = []
+        self.images = {}
+        self.imageTypes = {
+                'png':'image/png',
+                'jpeg':'image/jpeg',
+                'webp':'image/webp',
+                'rgba':'application/octet-stream'
+            }
+        self.animTypes = {'apng':'image/apng', 'gif':'image/gif'}
+        self.animLimit = 300
+
         # Set up plot graphic
+        self.update_footprints()
+        self.overlaps = self.check_overlaps()
+        self.fig = None
         self.draw_fig()
-        self.ax.grid()
 
     # End __init__()
 
-    def hsv_to_rgb(self, h, s, v):
-        """
-        Martin Ankerl's hsv to rgb converter
-        from https://martin.ankerl.com/2009/12/09/
-        how-to-create-random-colors-programmatically
-
-        @type  h: double
-        @param h: hue
-        @type  s: double
-        @param s: saturation
-        @type  v: double
-        @param v: value
-        """
-        h_i = int(h*6)
-        f = h*6 - h_i
-        p = v * (1 - s)
-        q = v * (1 - f*s)
-        t = v * (1 - (1 - f) * s)
-        if h_i == 0: rgb = (v, t, p)
-        elif h_i == 1: rgb = (q, v, p)
-        elif h_i == 2: rgb = (p, v, t)
-        elif h_i == 3: rgb = (p, q, v)
-        elif h_i == 4: rgb = (t, p, v)
-        elif h_i == 5: rgb = (v, p, q)
-        return rgb
-
-    def gen_color(self, num):
+    def gen_color(self, num, seed=None):
         """
-        Martin Ankerl's color generator based on Phi distributions
+        Martin Ankerl's color generator based on Phi distributions.
+        The starting hue comes from the seed, so the colors are the
+        same for every call with the same seed. The palette is computed
+        once as an array and sliced to the number of colors needed.
 
         @type num: int
         @param num: Number of colors to produce
+        @type seed: int
+        @param seed: seed of the starting hue, colorSeed if None
 
-        @return returns a list of rgb tuples with values [0,1)
+        @return returns an (num,3) array of rgb values [0,1)
         """
-        PHI = 0.618033988749895
-        s = 0.5
-        v = 0.95
-        h = random()
-        colorList = []
-        for i in range(num):
-            h += PHI
-            h %= 1
-            rgb = self.hsv_to_rgb(h,s,v)
-            colorList.append(rgb)
-        return colorList
+        if seed is None: seed = self.colorSeed
+        palette = self.palettes.get(seed)
+        if palette is None or len(palette) < num:
+            PHI = 0.618033988749895
+            size = max(256, 2**int(np.ceil(np.log2(max(num, 1)))))
+            h = np.random.default_rng(seed).random()
+            hsv = np.empty((size,3))
+            hsv[:,0] = (h + PHI*np.arange(1, size+1)) % 1
+            hsv[:,1] = 0.5
+            hsv[:,2] = 0.95
+            palette = mcl.hsv_to_rgb(hsv)
+            self.palettes[seed] = palette
+        return palette[:num]
+
+    @property
+    def store(self):
+        """
+        Where configurations are saved, opened on first use so that
+        importing this module (e.g. in a bulk import worker) does not
+        open it; see configStore.open_store
+        """
+        return configStore.get_store()
 
     def set_queue_dir(self, qdir):
         """
@@ -221,110 +381,48 @@ class Oopgui:
         the observing tool pulls config files from.
 
         @type qdir: string
-        @param qdir: absolute directory of the queue folder
+        @param qdir: directory of the queue folder, under the queue
+            root (see ddfQueue.queue_path), raises ValueError otherwise
         """
-        self.queueDir = qdir
+        self.queueDir = ddfQueue.queue_path(qdir)
 
     def rescale(self):
         """
         Looks at the coordinates of the objects being drawn
         to figure out what the grid tick scale should be.
+        The limits are the exact extent of every box and diamond
+        in the obj and sky patterns, together with the origin,
+        padded as the plot always was: one step of a fixed pattern
+        around its start and scale/0.02 arcsec all round. They are
+        rounded out to even values and made square. With nothing
+        drawn the limits are minHalfWidth around the origin.
         """
-        # Initialize some variables to keep track of the current
-        # min and max x values
-        minX = 0
-        maxX = 0
-        minY = 0
-        maxY = 0
-
-        # Look at the object pattern to determine an initial
-        # min and max based off of initOffX and initOffY given
-        # by the user
-        if self.objPattern != 'None':
-            if self.initOffX < 0:
-                minX -= self.initOffX
-                maxX -= self.initOffX
-            elif self.initOffX > 0:
-                minX += self.initOffX
-                maxX += self.initOffX
-            if self.initOffY < 0:
-                minY -= self.initOffY
-                maxY -= self.initOffY
-            elif self.initOffX > 0:
-                minY += self.initOffY
-                maxY += self.initOffY
-            if self.objPattern != 'User Defined':
-                minX -= abs(self.objLenX)
-                maxX += abs(self.objLenX)
-                minY -= abs(self.objHgtY)
-                maxY += abs(self.objHgtY)
-            elif self.objPattern == 'User Defined':
-                for i in range(0, len(self.defs), 3):
-                    if float(self.defs[i]) < minX:
-                        minX = float(self.defs[i])
-                    if float(self.defs[i]) > maxX:
-                        maxX = float(self.defs[i])
-                    if float(self.defs[i+1]) < minY:
-                        minY = float(self.defs[i+1])
-                    if float(self.defs[i+1]) > maxY:
-                        maxY = float(self.defs[i+1])
-        # Check if the skyPattern changes any min or max
-        if self.skyPattern not in ['None', 'User Defined']:
-            if self.initOffX + self.nodOffX - abs(self.skyLenX) < minX:
-                minX = self.initOffX + self.nodOffX - abs(self.skyLenX)
-            if self.initOffX + self.nodOffX + abs(self.skyLenX) > maxX:
-                maxX = self.initOffX + self.nodOffX + abs(self.skyLenX)
-            if self.initOffY + self.nodOffY - abs(self.skyHgtY) < minY:
-                minY = self.initOffY + self.nodOffY - abs(self.skyHgtY)
-            if self.initOffY + self.nodOffY + abs(self.skyHgtY) > maxY:
-                maxY = self.initOffY + self.nodOffY + abs(self.skyHgtY)
-        elif self.skyPattern == 'User Defined':
-            for i in range(0, len(self.defs), 3):
-                if self.initOffX + self.nodOffX + float(self.defs[i]) < minX:
-                    minX = self.initOffX + self.nodOffX + float(self.defs[i])
-                if self.initOffX + self.nodOffX + float(self.defs[i]) > maxX:
-                    maxX = self.initOffX + self.nodOffX + float(self.defs[i])
-                if self.initOffY + self.nodOffY + float(self.defs[i+1]) < minY:
-                    minY = self.initOffY + self.nodOffY + float(self.defs[i+1])
-                if self.initOffY + self.nodOffY + float(self.defs[i+1]) > maxY:
-                    maxY = self.initOffY + self.nodOffY + float(self.defs[i+1])
-
-        # Set the min and max based on the determined value from above
-        # and the scale of the filter selected.
-        if self.mode == 'spec':
-            self.xMin = minX - 1.0*float(self.scale)/0.02
-            self.xMax = maxX + 1.0*float(self.scale)/0.02
-            self.yMin = minY - 1.0*float(self.scale)/0.02
-            self.yMax = maxY + 1.0*float(self.scale)/0.02
-        elif self.mode == 'imag':
-            self.xMin = minX + self.imagX - 14.3
-            self.xMax = maxX + self.imagX + 14.3
-            self.yMin = minY + self.imagY - 14.3
-            self.yMax = maxY + self.imagY + 14.3
-        else: # self.mode == both
-            xMinSpec = minX - 1.0*float(self.scale)/0.02
-            xMaxSpec = maxX + 1.0*float(self.scale)/0.02
-            yMinSpec = minY - 1.0*float(self.scale)/0.02
-            yMaxSpec = maxY + 1.0*float(self.scale)/0.02
-
-            xMinImag = minX + self.imagX - 14.3
-            xMaxImag = maxX + self.imagX + 14.3
-            yMinImag = minY + self.imagY - 14.3
-            yMaxImag = maxY + self.imagY + 14.3
-
-            self.xMin = xMinSpec if xMinSpec < xMinImag else xMinImag
-            self.xMax = xMaxSpec if xMaxSpec > xMaxImag else xMaxImag
-            self.yMin = yMinSpec if yMinSpec < yMinImag else yMinImag
-            self.yMax = yMaxSpec if yMaxSpec > yMaxImag else yMaxImag
-
-        self.xMin = int(self.xMin)
-        self.xMax = int(self.xMax)
-        self.yMin = int(self.yMin)
-        self.yMax = int(self.yMax)
-
-        self.xMin += self.xMin%2
+        verts = [self.footprint_verts().reshape(-1,2), [[0.0, 0.0]]]
+        for sky in [False, True]:
+            pattern = self.skyPattern if sky else self.objPattern
+            if pattern in ['Stare', 'Box4', 'Box5', 'Box9']:
+                base = self.frame_offsets(np.zeros((1,2)), sky)
+                step = np.array([self.skyLenX, self.skyHgtY] if sky
+                        else [self.objLenX, self.objHgtY])
+                reach = base + np.array([-1, 1])[:,None]*np.abs(step)
+                verts.append(reach.dot(self.offsetRot.T))
+        verts = np.vstack(verts)
+        try:
+            pad = float(self.scale)/0.02
+        except ValueError:
+            pad = 1.0
+        minX, minY = np.minimum(verts.min(axis=0) - pad, -self.minHalfWidth)
+        maxX, maxY = np.maximum(verts.max(axis=0) + pad, self.minHalfWidth)
+
+        # Round out to the next even value so nothing is cut off
+        self.xMin = int(np.floor(minX))
+        self.xMax = int(np.ceil(maxX))
+        self.yMin = int(np.floor(minY))
+        self.yMax = int(np.ceil(maxY))
+
+        self.xMin -= self.xMin%2
         self.xMax += self.xMax%2
-        self.yMin += self.yMin%2
+        self.yMin -= self.yMin%2
         self.yMax += self.yMax%2
 
         if self.xMin < self.yMin: self.yMin = self.xMin
@@ -332,44 +430,221 @@ class Oopgui:
         if self.xMax > self.yMax: self.yMax = self.xMax
         else: self.xMax = self.yMax
 
-        # Calculate the difference between min and max
-        xDiff = self.xMax - self.xMin
-        yDiff = self.yMax - self.yMin
-
-        # Make both ranges the same as the larger one
-        if xDiff > yDiff:
-            self.yMin -= 0.5*(xDiff-yDiff)
-            self.yMax += 0.5*(xDiff-yDiff)
-        elif yDiff > xDiff:
-            self.xMin -= 0.5*(yDiff-xDiff)
-            self.xMax += 0.5*(yDiff-xDiff)
-
-        gridScale = (self.xMax - self.xMin)/8.0
-
-        # Add a scale increment to the max so that
-        # they don't get cut off by a section
-        #self.xMax += gridScale
-        #self.yMax += gridScale
+        gridScale = max((self.xMax - self.xMin)/8.0, self.minGridScale)
 
         return gridScale
 
-    def draw_fig(self):
+    def draw_fig(self, ticks=True):
         """
-        Draws a figure based on the values set in the object variables
+        Draws a figure based on the values set in the object variables.
+        The figure is only created once; later calls replace the
+        footprints drawn on it.
+
+        @type ticks: boolean
+        @param ticks: False to keep the current ticks and limits
         """
-        # create a mathplotlib figure that's 8in x 8in
-        self.fig = plt.figure(figsize=(8,8))
-        self.ax = self.fig.gca()
-        self.ax.xaxis.set_major_formatter(tkr.FormatStrFormatter('%10.1f"'))
-        self.ax.yaxis.set_major_formatter(tkr.FormatStrFormatter('%10.1f"'))
-        self.ax.set_xticks(np.arange(self.xMin, self.xMax, self.gridScale))
-        self.ax.set_yticks(np.arange(self.yMin, self.yMax, self.gridScale))
+        if self.fig is None:
+            # create a mathplotlib figure that's 8in x 8in
+            self.fig = Figure(figsize=(8,8))
+            FigureCanvasAgg(self.fig)
+            self.ax = self.fig.add_subplot()
+            self.ax.xaxis.set_major_formatter(tkr.FormatStrFormatter('%10.1f"'))
+            self.ax.yaxis.set_major_formatter(tkr.FormatStrFormatter('%10.1f"'))
+            # Apply the grid for visual scale
+            self.ax.grid(True)
+        else:
+            for artist in list(self.ax.patches) + list(self.ax.collections) \
+                    + list(self.ax.images):
+                artist.remove()
+        if ticks:
+            self.ax.set_xticks(np.arange(self.xMin, self.xMax, self.gridScale))
+            self.ax.set_yticks(np.arange(self.yMin, self.yMax, self.gridScale))
+            pad = 0.05*(self.xMax - self.xMin)
+            self.ax.set_xlim(self.xMin - pad, self.xMax + pad)
+            self.ax.set_ylim(self.yMin - pad, self.yMax + pad)
 
         # Activate the draw function for the correct pattern
+        # Each draw function handles both the obj and sky pattern,
+        # so only call it once when they are the same
         self.draw[self.objPattern]()
-        self.draw[self.skyPattern]()
+        if self.skyPattern != self.objPattern:
+            self.draw[self.skyPattern]()
+        if self.backgroundCut is not None:
+            self.add_background()
+        if self.coverageMap is not None:
+            self.add_coverage()
         self.add_origin()
         self.add_ref()
+        self.images = {}
+
+    def render(self, fmt='png', dpi=100, compress=6, quality=90, size=8.0):
+        """
+        Encodes the current figure, reusing the last image with the
+        same options when nothing was redrawn since it was encoded.
+        Encoded images are returned as a view of the encoder's buffer
+        so they can be written to the socket without another copy.
+
+        @type fmt: string
+        @param fmt: one of the formats in imageTypes. 'rgba' is the raw
+            canvas, 4 bytes per pixel, row by row from the top
+        @type dpi: int
+        @param dpi: resolution of the image
+        @type compress: int
+        @param compress: PNG zlib level, 0 (fastest) to 9 (smallest)
+        @type quality: int
+        @param quality: JPEG and WebP quality, 1 to 100
+        @type size: float
+        @param size: width and height of the figure in inches
+
+        @return returns the image as a memoryview or bytes
+        """
+        key = (fmt, dpi, compress, quality, size)
+        if key in self.images:
+            return self.images[key]
+        if tuple(self.fig.get_size_inches()) != (size, size):
+            self.fig.set_size_inches(size, size)
+        if fmt == 'rgba':
+            self.fig.set_dpi(dpi)
+            self.fig.canvas.draw()
+            # Copied because the canvas buffer is reused by the next draw
+            img = bytes(self.fig.canvas.buffer_rgba())
+        else:
+            if fmt == 'png':
+                opts = {'compress_level':compress}
+            else:
+                opts = {'quality':quality}
+            imgData = io.BytesIO()
+            self.fig.savefig(imgData, format=fmt, dpi=dpi, pil_kwargs=opts)
+            img = imgData.getbuffer()
+        self.images[key] = img
+        return img
+
+    def render_size(self, dpi=100, size=8.0):
+        """
+        Width and height in pixels of an image from render()
+
+        @return returns a (width, height) tuple
+        """
+        return int(round(size*dpi)), int(round(size*dpi))
+
+    def visit_sequence(self):
+        """
+        Frame offsets in the order they are taken: the obj pattern,
+        then the sky pattern, or the order of the definitions when
+        both are User Defined
+
+        @return returns an (N,2) array of offsets and the position in
+            colorList of each, as add_footprints colors them
+        """
+        skyStart = self.objFrames1*self.objFrames2
+        obj = self.frame_offsets(self.pattern_units())
+        sky = self.frame_offsets(self.pattern_units(sky=True), sky=True)
+        objIndex = np.arange(len(obj))
+        skyIndex = np.arange(len(sky))
+        if self.objPattern == 'User Defined':
+            objIndex = np.nonzero(self.userSky == 'false')[0]
+        if self.skyPattern == 'User Defined':
+            skyIndex = np.nonzero(self.userSky == 'true')[0]
+        offsets = np.vstack((obj, sky))
+        index = np.concatenate((objIndex, skyStart + skyIndex))
+        if self.objPattern == self.skyPattern == 'User Defined':
+            order = np.argsort(np.concatenate((objIndex, skyIndex)),
+                    kind='stable')
+            offsets, index = offsets[order], index[order]
+        return offsets, index
+
+    def animate(self, fmt='apng', dpi=100, size=8.0, delay=500, compress=6):
+        """
+        Plays the pattern back in the order its positions are visited.
+        The figure is drawn once; each frame then draws only the next
+        highlighted footprint over the canvas and encodes the
+        rectangle it touched, so the time taken grows with the number
+        of positions, not with that many full renders.
+
+        @type fmt: string
+        @param fmt: one of the formats in animTypes
+        @type delay: int
+        @param delay: milliseconds each position is shown; the last
+            frame stays four times as long
+        @type compress: int
+        @param compress: APNG zlib level, 0 (fastest) to 9 (smallest)
+
+        @return returns the animation as a memoryview
+        """
+        key = (fmt, dpi, compress, delay, size)
+        if key in self.images:
+            return self.images[key]
+        offsets, index = self.visit_sequence()
+        steps = []
+        if len(offsets):
+            steps = np.array_split(np.arange(len(offsets)),
+                    min(len(offsets), self.animLimit))
+        if tuple(self.fig.get_size_inches()) != (size, size):
+            self.fig.set_size_inches(size, size)
+        self.fig.set_dpi(dpi)
+        self.fig.canvas.draw()
+        renderer = self.fig.canvas.get_renderer()
+        width, height = self.fig.canvas.get_width_height()
+        # The canvas pixels, drawn on in place by draw_artist
+        pixels = np.asarray(self.fig.canvas.buffer_rgba())
+        if fmt == 'gif':
+            writer = animation.GifWriter(width, height, len(steps) + 1)
+        else:
+            writer = animation.ApngWriter(width, height, len(steps) + 1,
+                    compress)
+        writer.add(pixels[:,:,:3], 0, 0, delay)
+
+        colors = np.take(np.asarray(self.colorList), index, axis=0, mode='wrap')
+        pad = int(np.ceil(3*dpi/72.0)) + 2
+        for num, step in enumerate(steps):
+            verts = []
+            if self.mode in ['spec','both']:
+                verts.append(self.box_verts(offsets[step]))
+            if self.mode in ['imag','both']:
+                verts.append(self.diamond_verts(offsets[step]))
+            verts = np.concatenate(verts)
+            stepColors = np.tile(colors[step], (len(verts)//len(step), 1))
+            poly = clt.PolyCollection(verts,
+                    facecolors = mcl.to_rgba_array(stepColors, alpha=0.4),
+                    edgecolors = stepColors,
+                    linewidths = 3
+                )
+            self.ax.add_collection(poly, autolim=False)
+            center = verts[0].mean(axis=0)
+            if len(step) == 1:
+                name = str(step[0] + 1)
+            else:
+                name = '%d-%d' % (step[0] + 1, step[-1] + 1)
+            label = self.ax.text(center[0], center[1], name,
+                    ha = 'center',
+                    va = 'center',
+                    fontsize = 9,
+                    clip_on = True
+                )
+            self.ax.draw_artist(poly)
+            self.ax.draw_artist(label)
+
+            # Rectangle touched, clipped to the axes, rows from the top
+            corners = self.ax.transData.transform(verts.reshape(-1,2))
+            text = label.get_window_extent(renderer)
+            box = self.ax.bbox
+            left = max(int(min(corners[:,0].min(), text.x0)) - pad, int(box.x0))
+            right = min(int(max(corners[:,0].max(), text.x1)) + pad + 1,
+                    int(np.ceil(box.x1)) + 1, width)
+            bottom = max(int(min(corners[:,1].min(), text.y0)) - pad, int(box.y0))
+            top = min(int(max(corners[:,1].max(), text.y1)) + pad + 1,
+                    int(np.ceil(box.y1)) + 1, height)
+            poly.remove()
+            label.remove()
+            if left >= right or bottom >= top:
+                left, right, bottom, top = 0, 1, 0, 1
+            last = num == len(steps) - 1
+            writer.add(pixels[height-top:height-bottom, left:right, :3],
+                    left, height - top, delay*4 if last else delay)
+
+        img = writer.finish()
+        self.images[key] = img
+        return img
 
     def add_origin(self):
         """
@@ -377,7 +652,7 @@ class Oopgui:
         """
         self.ax.add_patch(
             pch.Circle(
-                (self.oriX,self.oriY),
+                tuple(self.origin),
                 radius=0.025*self.gridScale,
                 fill=False,
                 color='red'
@@ -397,151 +672,503 @@ class Oopgui:
             )
         )
 
-    def add_obj_box(self, xpos, ypos, index):
+    def gen_raster(self, frames, rows, order='serpentine'):
+        """
+        Generates the positions of a Raster Scan in a single pass.
+        The scan starts at the initial offset and steps in +x along
+        each row, moving one row down (-y) at the end of a row.
+
+        @type frames: int
+        @param frames: number of positions along each row
+        @type rows: int
+        @param rows: number of rows in the scan
+        @type order: string
+        @param order: 'serpentine' reverses every other row so the
+            telescope never slews back across the field, 'rowmajor'
+            starts every row from the same side
+
+        @return returns an (frames*rows, 2) array of x and y multipliers
+            for the step sizes
+        """
+        cols = np.tile(np.arange(frames), rows)
+        rowIdx = np.repeat(np.arange(rows), frames)
+        if order == 'serpentine':
+            odd = rowIdx % 2 == 1
+            cols[odd] = frames - 1 - cols[odd]
+        return np.column_stack((cols, -rowIdx)).astype(float)
+
+    def gen_dither(self, frames, sampler='uniform', seed=1, minSep=0.0,
+            length=1.0, height=1.0):
+        """
+        Generates the positions of a Statistical Dither. The positions
+        are drawn from a numpy Generator seeded with seed, so the same
+        parameters always give back the same pattern.
+
+        @type frames: int
+        @param frames: number of positions to generate
+        @type sampler: string
+        @param sampler: 'uniform' over the region, 'gaussian' centered
+            on the region with the region edges at 2 sigma, or 'poisson'
+            for uniform positions at least minSep apart
+        @type seed: int
+        @param seed: seed for the random number generator
+        @type minSep: float
+        @param minSep: minimum separation (arcsec) for 'poisson'
+        @type length: float
+        @param length: length of the region (arcsec)
+        @type height: float
+        @param height: height of the region (arcsec)
+
+        @return returns an (N,2) array of x and y multipliers for the
+            region length and height, each within [-0.5, 0.5]
+        """
+        rng = np.random.default_rng(seed)
+        if sampler == 'gaussian':
+            units = rng.normal(0, 0.25, (frames,2))
+            # Redraw the positions that fall outside of the region
+            out = np.abs(units) > 0.5
+            while out.any():
+                units[out] = rng.normal(0, 0.25, out.sum())
+                out = np.abs(units) > 0.5
+            return units
+        if sampler == 'poisson' and minSep > 0:
+            return self.poisson_disk(rng, frames, minSep, length, height)
+        return rng.uniform(-0.5, 0.5, (frames,2))
+
+    def poisson_disk(self, rng, frames, minSep, length, height):
+        """
+        Dart throwing with a background grid: each cell is small
+        enough to hold at most one position, so a candidate only has
+        to be checked against the 5x5 cells around it and the cost
+        grows linearly with the number of frames.
+
+        @type rng: numpy Generator
+        @param rng: seeded random number generator
+        @type frames: int
+        @param frames: number of positions to generate
+        @type minSep: float
+        @param minSep: minimum separation between positions (arcsec)
+        @type length: float
+        @param length: length of the region (arcsec)
+        @type height: float
+        @param height: height of the region (arcsec)
+
+        @return returns an (N,2) array of x and y multipliers for the
+            region length and height. N is less than frames if the
+            region can not hold that many positions, which validate()
+            and dither_shortfall() report.
+        """
+        size = np.array([abs(length), abs(height)], dtype=float)
+        cell = minSep/np.sqrt(2)
+        nx, ny = (np.ceil(size/cell).astype(int) + 1).tolist()
+        grid = -np.ones((nx+4, ny+4), dtype=int)
+        pts = np.empty((frames,2))
+        minSep2 = minSep*minSep
+        count = 0
+        tries = 0
+        # Give up after 30 failed candidates per position, as in
+        # Bridson's algorithm
+        while count < frames and tries < 30*frames:
+            cands = rng.uniform(0, 1, (frames,2))*size
+            for x, y in cands.tolist():
+                tries += 1
+                gx, gy = int(x/cell)+2, int(y/cell)+2
+                near = grid[gx-2:gx+3, gy-2:gy+3]
+                near = near[near >= 0]
+                if near.size:
+                    d = pts[near] - (x, y)
+                    if (d*d).sum(1).min() < minSep2: continue
+                grid[gx,gy] = count
+                pts[count] = (x, y)
+                count += 1
+                if count == frames: break
+        units = pts[:count]/np.where(size > 0, size, 1) - 0.5
+        return units
+
+    def frame_offsets(self, units, sky=False):
         """
-        Creates an object box around the given x and y positions
+        Converts an array of dither positions into the offsets of
+        each frame, in the coordinates of the pattern (coordSys)
 
-        @type xpos: float
-        @param xpos: x position around which to draw the object box
-        @typp ypos: float
-        @param ypos: y position around which to draw the object box
+        @type units: numpy array
+        @param units: (N,2) array of x and y multipliers
+        @type sky: boolean
+        @param sky: True if the positions belong to the sky pattern
+
+        @return returns an (N,2) array of x and y offsets
         """
-        if self.objPattern == 'User Defined':
-            initOffX = 0
-            initOffY = 0
+        if sky:
+            step = np.array([self.skyLenX, self.skyHgtY])
+            base = np.array([self.initOffX + self.nodOffX,
+                    self.initOffY + self.nodOffY])
+            if self.skyPattern == 'User Defined': base[:] = 0
         else:
-            initOffX = self.initOffX
-            initOffY = self.initOffY
-        return pch.Rectangle(
-            (self.specX+initOffX+xpos*self.objLenX,
-            self.specY+initOffY+ypos*self.objHgtY),
-            self.boxWidth,
-            self.boxHeight,
-            fill = False,
-            linewidth = 3,
-            color = self.colorList[index]
-        )
+            step = np.array([self.objLenX, self.objHgtY])
+            base = np.array([self.initOffX, self.initOffY])
+            if self.objPattern == 'User Defined': base[:] = 0
+        return base + np.asarray(units, dtype=float).reshape(-1,2)*step
 
-    def add_sky_box(self, xpos, ypos, index):
+    def rotation(self, angle):
         """
-        Creates a sky box around the given x and y positions
+        Matrix rotating column vectors counterclockwise
+
+        @type angle: float
+        @param angle: rotation in degrees
 
-        @type xpos: float
-        @param xpos: x position around which to draw the sky box
-        @type ypos: float
-        @param ypos: y position around which to draw the sky box
+        @return returns a (2,2) array
         """
-        if self.skyPattern == 'User Defined':
-            initOffX = 0
-            initOffY = 0
-            nodOffX = 0
-            nodOffY = 0
+        c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+        return np.array([[c, -s], [s, c]])
+
+    def update_footprints(self):
+        """
+        Rotates the spec box and imager diamond and the frame offsets
+        by the sky PA once, so drawing a pattern is one matrix product
+        over all of its frames. Offsets given in instrument coordinates
+        turn with the instrument; those given on the sky do not. The
+        47.5 degree tilt of the imager CCD is folded into its rotation.
+        """
+        try:
+            pa = float(self.pa)
+        except ValueError:
+            pa = 0.0
+        rot = self.rotation(pa)
+        if self.coordSys == 'sky':
+            self.offsetRot = np.identity(2)
         else:
-            initOffX = self.initOffX
-            initOffY = self.initOffY
-            nodOffX = self.nodOffX
-            nodOffY = self.nodOffY
-        return pch.Rectangle(
-            (self.specX+initOffX+nodOffX+xpos*self.skyLenX,
-            self.specY+initOffY+nodOffY+ypos*self.skyHgtY),
-            self.boxWidth,
-            self.boxHeight,
-            fill = False,
-            linewidth = 3,
-            color = self.colorList[index]
-        )
+            self.offsetRot = rot
+        box = np.array([
+                [0, 0],
+                [self.boxWidth, 0],
+                [self.boxWidth, self.boxHeight],
+                [0, self.boxHeight]
+            ]) + [self.specX, self.specY]
+        self.boxCorners = box.dot(rot.T)
+        self.boxRot = rot
+        self.diamondRot = self.rotation(pa + self.imagTilt)
+        # The imager field is 14.3" from its center to each corner
+        half = self.imagSize/np.sqrt(2.0)
+        square = np.array([[-half, half], [half, half],
+                [half, -half], [-half, -half]])
+        self.diamondCorners = square.dot(self.diamondRot.T) + rot.dot(
+                [self.imagX, self.imagY])
+        self.origin = rot.dot([self.oriX, self.oriY])
+
+    def box_verts(self, offsets):
+        """
+        Corners of the spec box for every frame offset
+
+        @type offsets: numpy array
+        @param offsets: (N,2) array of frame offsets
 
-    def add_obj_diamond(self, xpos, ypos, index):
+        @return returns an (N,4,2) array of box vertices
         """
-        Creates an object diamond around the given x and y positions
+        return offsets.dot(self.offsetRot.T)[:,None,:] + self.boxCorners
 
-        @type xpos: float
-        @param xpos: x position around which to draw the object diamond
-        @type ypos: float
-        @param ypos: y position around which to draw the object diamond
+    def diamond_verts(self, offsets):
         """
-        # Tilt offset for the image CCD
-        xoff = np.cos(np.radians(47.5))
-        yoff = np.sin(np.radians(47.5))
-        if self.objPattern == 'User Defined':
-            initOffX = 0
-            initOffY = 0
-        else:
-            initOffX = self.initOffX
-            initOffY = self.initOffY
-        return pch.Polygon(
-            np.array(
-                [
-                    [self.imagX - 14.3 + initOffX
-                            + xoff + xpos*self.objLenX,
-                        self.imagY + 0 + initOffY
-                            - yoff + ypos*self.objHgtY],
-                    [self.imagX + 0 + initOffX
-                            - xoff + xpos*self.objLenX,
-                        self.imagY + 14.3 + initOffY
-                            - yoff + ypos*self.objHgtY],
-                    [self.imagX + 14.3 + initOffX
-                            - xoff + xpos*self.objLenX,
-                        self.imagY + 0 + initOffY
-                            + yoff + ypos*self.objHgtY],
-                    [self.imagX + 0 + initOffX
-                            + xoff + xpos*self.objLenX,
-                        self.imagY -14.3 + initOffY
-                            + yoff + ypos*self.objHgtY]
-                ]
-            ),
-            fill = False,
-            linewidth = 3,
-            color = self.colorList[index]
-        )
+        Corners of the imager diamond for every frame offset
 
-    def add_sky_diamond(self, xpos, ypos, index):
+        @type offsets: numpy array
+        @param offsets: (N,2) array of frame offsets
+
+        @return returns an (N,4,2) array of diamond vertices
         """
-        Creates a sky diamond around the given x and y positions
+        return offsets.dot(self.offsetRot.T)[:,None,:] + self.diamondCorners
 
-        @type xpos: float
-        @param xpos: x position around which to draw the sky diamond
-        @type ypos: float
-        @param ypos: y position around which to draw the sky diamond
+    def add_footprints(self, offsets, index):
         """
-        # Tilt offset for the imager CCD
-        xoff = np.cos(np.radians(47.5))
-        yoff = np.sin(np.radians(47.5))
-        if self.skyPattern == 'User Defined':
-            initOffX = 0
-            initOffY = 0
-            nodOffX = 0
-            nodOffY = 0
-        else:
-            initOffX = self.initOffX
-            initOffY = self.initOffY
-            nodOffX = self.nodOffX
-            nodOffY = self.nodOffY
-        return pch.Polygon(
-            np.array(
-                [
-                    [self.imagX -14.3 + initOffX
-                        + nodOffX + xoff + xpos*self.skyLenX,
-                    self.imagY +0 + initOffY + nodOffY
-                        - yoff + ypos*self.skyHgtY],
-                    [self.imagX + 0 + initOffX
-                        + nodOffX - xoff + xpos*self.skyLenX,
-                    self.imagY + 14.3 + initOffY + nodOffY
-                        - yoff + ypos*self.skyHgtY],
-                    [self.imagX + 14.3 + initOffX + nodOffX
-                        - xoff + xpos*self.skyLenX,
-                    self.imagY +0 + initOffY + nodOffY
-                        + yoff + ypos*self.skyHgtY],
-                    [self.imagX + 0 + initOffX + nodOffX
-                        + xoff + xpos*self.skyLenX,
-                    self.imagY - 14.3 + initOffY + nodOffY
-                        + yoff + ypos*self.skyHgtY]
-                ]
-            ),
-            fill = False,
-            linewidth = 3,
-            color = self.colorList[index]
-        )
+        Draws the boxes and diamonds of many frames at once, with one
+        collection per CCD instead of one patch per frame. Above
+        lodThreshold frames only every few outlines are drawn and the
+        rest of the pattern is shown as a density layer.
+
+        @type offsets: numpy array
+        @param offsets: (N,2) array of frame offsets
+        @type index: int or numpy array
+        @param index: position in colorList of the first frame, or
+            of every frame
+        """
+        if len(offsets) == 0: return
+        if np.isscalar(index):
+            index = index + np.arange(len(offsets))
+        colors = np.take(np.asarray(self.colorList), index,
+                axis=0, mode='wrap')
+        outline = np.arange(len(offsets))
+        lod = self.lodThreshold and len(offsets) > self.lodThreshold
+        if lod:
+            step = int(np.ceil(len(offsets)/float(self.lodOutlines)))
+            outline = np.union1d(outline[::step], [len(offsets)-1])
+        verts = []
+        if self.mode in ['spec','both']: verts.append(self.box_verts(offsets))
+        if self.mode in ['imag','both']: verts.append(self.diamond_verts(offsets))
+        for v in verts:
+            self.ax.add_collection(clt.PolyCollection(
+                    v[outline],
+                    facecolors = 'none',
+                    edgecolors = colors[outline],
+                    linewidths = 3
+                ))
+            if lod:
+                centers = v.mean(axis=1)
+                self.ax.hexbin(centers[:,0], centers[:,1],
+                        gridsize = 40,
+                        mincnt = 1,
+                        cmap = 'Greys',
+                        alpha = 0.5,
+                        linewidths = 0
+                    )
+
+    def rasterize(self, verts, weights, x0, y0, pixel, shape):
+        """
+        Adds up the weights of convex quadrilaterals on a pixel grid.
+        Every polygon is cut into one span of pixels per grid row from
+        its four edges at once; the spans are accumulated as +weight
+        at their first pixel and -weight after their last one, and a
+        running sum along the rows fills them in. A pixel is covered
+        when its center is inside the polygon.
+
+        @type verts: numpy array
+        @param verts: (N,4,2) array of polygon vertices
+        @type weights: numpy array
+        @param weights: (N,) array of values added by each polygon
+        @type x0: float
+        @param x0: x of the left edge of the grid
+        @type y0: float
+        @param y0: y of the bottom edge of the grid
+        @type pixel: float
+        @param pixel: width and height of a pixel
+        @type shape: tuple
+        @param shape: rows and columns of the grid
+
+        @return returns a (rows, columns) array, bottom row first
+        """
+        ny, nx = shape
+        total = np.zeros(ny*(nx+1))
+        rows = y0 + (np.arange(ny) + 0.5)*pixel
+        # Keep the temporaries to a few MB for long patterns
+        step = max(1, 2**18//ny)
+        for first in range(0, len(verts), step):
+            v = verts[first:first+step]
+            w = np.broadcast_to(np.asarray(weights, dtype=float)[
+                    first:first+step, None], (len(v), ny))
+            # Counterclockwise, so the inside is left of every edge
+            x, y = v[:,:,0], v[:,:,1]
+            area = (x*np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1)*y).sum(1)
+            v = np.where((area < 0)[:,None,None], v[:,::-1], v)
+            ex = np.roll(v[:,:,0], -1, axis=1) - v[:,:,0]
+            ey = np.roll(v[:,:,1], -1, axis=1) - v[:,:,1]
+            # A point (px, py) is left of an edge when
+            # ey*px <= ex*(py - sy) + ey*sx
+            c = ex[:,None,:]*(rows[None,:,None] - v[:,None,:,1]) + \
+                    (ey*v[:,:,0])[:,None,:]
+            ey = np.broadcast_to(ey[:,None,:], c.shape)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                bound = c/ey
+            lo = np.where(ey < 0, bound, -np.inf).max(axis=2)
+            hi = np.where(ey > 0, bound, np.inf).min(axis=2)
+            hi[((ey == 0) & (c < 0)).any(axis=2)] = -np.inf
+            jl = np.clip(np.ceil((lo - x0)/pixel - 0.5), 0, nx)
+            jr = np.clip(np.floor((hi - x0)/pixel - 0.5), -1, nx-1)
+            keep = jl <= jr
+            row = np.broadcast_to(np.arange(ny)*(nx+1), keep.shape)[keep]
+            total += np.bincount(row + jl[keep].astype(int), w[keep],
+                    minlength=total.size)
+            total -= np.bincount(row + jr[keep].astype(int) + 1, w[keep],
+                    minlength=total.size)
+        return total.reshape(ny, nx+1).cumsum(axis=1)[:,:nx]
+
+    def coverage(self, pixels=256):
+        """
+        Effective exposure time reached at every point of the field
+        by the obj and sky patterns: specItime*specCoadds for each spec
+        box and imgItime*imgCoadds*repeats for each imager diamond.
+        The grid spans the current plot limits.
+
+        @type pixels: int
+        @param pixels: grid pixels along each axis
+
+        @return returns a dictionary with the grid extent (xMin, xMax,
+            yMin, yMax), the pixel size and the spec and imag maps in
+            seconds, bottom row first; a map is None when the mode does
+            not take that integration
+        """
+        offsets = np.vstack((self.frame_offsets(self.pattern_units()),
+                self.frame_offsets(self.pattern_units(sky=True), sky=True)))
+        pixel = float(self.xMax - self.xMin)/pixels
+        shape = (int(np.ceil((self.yMax - self.yMin)/pixel)), pixels)
+        result = {
+                'extent':[self.xMin, self.xMin + shape[1]*pixel,
+                        self.yMin, self.yMin + shape[0]*pixel],
+                'pixel':pixel,
+                'spec':None,
+                'imag':None
+            }
+        if self.mode in ['spec','both']:
+            itime = float(self.specItime)*int(self.specCoadds)
+            result['spec'] = self.rasterize(self.box_verts(offsets),
+                    np.full(len(offsets), itime), self.xMin, self.yMin,
+                    pixel, shape)
+        if self.mode in ['imag','both']:
+            itime = float(self.imgItime)*int(self.imgCoadds)*int(self.repeats)
+            result['imag'] = self.rasterize(self.diamond_verts(offsets),
+                    np.full(len(offsets), itime), self.xMin, self.yMin,
+                    pixel, shape)
+        return result
+
+    def background_cut(self):
+        """
+        Reads the part of the background image behind the plot
+
+        @return returns the pixels, their extent and the display range,
+            or None without a background
+        """
+        try:
+            img = skyImage.get_image(self.imageDir, self.background)
+            if img is None:
+                return None
+            try:
+                ra = visibility.parse_angle(self.ra, True)
+                dec = visibility.parse_angle(self.dec)
+            except ValueError:
+                ra = dec = None
+            pad = 0.05*(self.xMax - self.xMin)
+            cut = img.window(self.xMin - pad, self.xMax + pad,
+                    self.yMin - pad, self.yMax + pad,
+                    img.placement(ra, dec, self.bgScale), self.backgroundPixels)
+        except (OSError, ValueError, KeyError) as e:
+            print('background not read:', e)
+            return None
+        if cut is None:
+            return None
+        pixels, extent = cut
+        vmin, vmax = np.nanpercentile(pixels, [1.0, 99.5])
+        return pixels, extent, vmin, vmax
+
+    def add_background(self):
+        """
+        Draws the background image under everything else
+        """
+        pixels, extent, vmin, vmax = self.backgroundCut
+        self.ax.imshow(pixels,
+                origin = 'lower',
+                extent = extent,
+                cmap = 'gray',
+                vmin = vmin,
+                vmax = vmax,
+                interpolation = 'bilinear',
+                aspect = 'auto',
+                zorder = -1
+            )
+
+    def add_coverage(self):
+        """
+        Shades the plot with the exposure depth of the spec boxes, or
+        of the imager diamonds when only the imager integrates
+        """
+        cov = self.coverageMap
+        depth = cov['spec'] if cov['spec'] is not None else cov['imag']
+        self.ax.imshow(np.ma.masked_equal(depth, 0),
+                origin = 'lower',
+                extent = cov['extent'],
+                cmap = 'viridis',
+                alpha = 0.6,
+                interpolation = 'nearest',
+                aspect = 'auto',
+                zorder = 0
+            )
+
+    def obj_raster(self):
+        """
+        Frame offsets of the object Raster Scan
+        """
+        return self.frame_offsets(self.gen_raster(
+                self.objFrames1, self.objFrames2, self.objOrder))
+
+    def sky_raster(self):
+        """
+        Frame offsets of the sky Raster Scan
+        """
+        return self.frame_offsets(self.gen_raster(
+                self.skyFrames1, self.skyFrames2, self.skyOrder), sky=True)
+
+    def pattern_units(self, sky=False):
+        """
+        Positions of every frame in the obj or sky pattern as
+        multipliers of the pattern step sizes
+
+        @type sky: boolean
+        @param sky: True for the sky pattern, False for the object
+
+        @return returns an (N,2) array of x and y multipliers
+        """
+        pattern = self.skyPattern if sky else self.objPattern
+        if pattern in ['Stare', 'Box4', 'Box5', 'Box9']:
+            return np.array(self.offDefs[pattern], dtype=float)
+        elif pattern == 'Raster Scan':
+            if sky:
+                return self.gen_raster(self.skyFrames1, self.skyFrames2,
+                        self.skyOrder)
+            return self.gen_raster(self.objFrames1, self.objFrames2,
+                    self.objOrder)
+        elif pattern == 'Statistical Dither':
+            return self.skyStat if sky else self.objStat
+        elif pattern == 'User Defined':
+            flag = 'true' if sky else 'false'
+            return self.userDefs[self.userSky == flag]
+        return np.zeros((0,2))
+
+    def footprint_verts(self):
+        """
+        Vertices of every box and diamond drawn for the current
+        obj and sky patterns and mode
+
+        @return returns an (N,4,2) array of vertices
+        """
+        offsets = np.vstack((self.frame_offsets(self.pattern_units()),
+                self.frame_offsets(self.pattern_units(sky=True), sky=True)))
+        verts = [np.zeros((0,4,2))]
+        if self.mode in ['spec','both']: verts.append(self.box_verts(offsets))
+        if self.mode in ['imag','both']: verts.append(self.diamond_verts(offsets))
+        return np.concatenate(verts)
+
+    def check_overlaps(self):
+        """
+        Finds the sky frames that land on object frames, for each CCD
+        the mode integrates on, and the positions repeated within a
+        pattern (closer than dupTolerance on both axes). Pairs are
+        given as frame numbers, counting from 1 in each pattern, and
+        at most overlapLimit of each kind are listed.
+
+        @return returns a dictionary with the [obj, sky] pairs under
+            spec and imag, the [frame, frame] pairs under objDuplicates
+            and skyDuplicates, and the number of pairs of each kind
+            under counts
+        """
+        obj = self.frame_offsets(self.pattern_units())
+        sky = self.frame_offsets(self.pattern_units(sky=True), sky=True)
+        pairs = {}
+        ccds = []
+        if self.mode in ['spec','both']:
+            ccds.append(('spec', self.boxRot, (self.boxWidth, self.boxHeight)))
+        if self.mode in ['imag','both']:
+            side = self.imagSize*np.sqrt(2.0)
+            ccds.append(('imag', self.diamondRot, (side, side)))
+        for name, rot, size in ccds:
+            # Offsets on the plot, then along the edges of the footprint
+            toCcd = self.offsetRot.T.dot(rot)
+            pairs[name] = overlap.box_pairs(obj.dot(toCcd), sky.dot(toCcd),
+                    size)
+        tol = (self.dupTolerance, self.dupTolerance)
+        pairs['objDuplicates'] = overlap.box_pairs(obj, size=tol)
+        pairs['skyDuplicates'] = overlap.box_pairs(sky, size=tol)
+
+        result = {'counts':{}}
+        for name, (i, j) in pairs.items():
+            order = np.lexsort((j, i))[:self.overlapLimit]
+            result[name] = np.column_stack((i[order]+1, j[order]+1)).tolist()
+            result['counts'][name] = len(i)
+        return result
 
     def draw_none(self):
         """
@@ -550,199 +1177,208 @@ class Oopgui:
         """
         pass
 
+    def draw_fixed(self, pattern):
+        """
+        Draws the obj and sky frames of a fixed pattern (Stare or one
+        of the Box patterns) on the figure
+
+        @type pattern: string
+        @param pattern: name of the pattern in offDefs
+        """
+        if self.objPattern == pattern:
+            self.add_footprints(self.frame_offsets(self.pattern_units()), 0)
+        if self.skyPattern == pattern:
+            self.add_footprints(
+                    self.frame_offsets(self.pattern_units(sky=True), sky=True),
+                    self.objFrames1*self.objFrames2)
+
     def draw_stare(self):
         """
         Draws a stare pattern on the figure depending on the
         selected mode of the instrument and the stored values
         """
-        # Check if the mode takes a spec integration
-        if self.mode in ['spec','both']:
-            # Check if the object or sky box pattern is Stare
-            if self.objPattern == 'Stare':
-                self.ax.add_patch(self.add_obj_box(
-                        self.offDefs[self.objPattern][0][0],
-                        self.offDefs[self.objPattern][0][1],
-                        0))
-            if self.skyPattern == 'Stare':
-                self.ax.add_patch(self.add_sky_box(
-                        self.offDefs[self.skyPattern][0][0],
-                        self.offDefs[self.skyPattern][0][1],
-                        self.objFrames1*self.objFrames2+0))
-        # Check if the mode takes an imager integration
-        if self.mode in ['imag','both']:
-            # Check if the object or sky diamond pattern is Stare
-            if self.objPattern == 'Stare':
-                self.ax.add_patch(self.add_obj_diamond(
-                        self.offDefs[self.objPattern][0][0],
-                        self.offDefs[self.objPattern][0][1],
-                        0))
-            if self.skyPattern == 'Stare':
-                self.ax.add_patch(self.add_sky_diamond(
-                        self.offDefs[self.skyPattern][0][0],
-                        self.offDefs[self.skyPattern][0][1],
-                        self.objFrames1*self.objFrames2+0))
+        self.draw_fixed('Stare')
 
     def draw_box4(self):
         """
         Draws a box4 pattern on the figure using the stored values
         """
-        # Check if the mode takes a spec integration
-        if self.mode in ['spec','both']:
-            # check if the object or sky box pattern is Box4
-            if self.objPattern == 'Box4':
-                for i in range(4):
-                    self.ax.add_patch(self.add_obj_box(
-                            self.offDefs[self.objPattern][i][0],
-                            self.offDefs[self.objPattern][i][1],
-                            i))
-            if self.skyPattern == 'Box4':
-                for i in range(4):
-                    self.ax.add_patch(self.add_sky_box(
-                            self.offDefs[self.skyPattern][i][0],
-                            self.offDefs[self.skyPattern][i][1],
-                            self.objFrames1*self.objFrames2+i))
-        # Check if the mode takes an imager integration
-        if self.mode in ['imag','both']:
-            # Check if the object or sky diamond pattern is Box4
-            if self.objPattern == 'Box4':
-                for i in range(4):
-                    self.ax.add_patch(self.add_obj_diamond(
-                            self.offDefs[self.objPattern][i][0],
-                            self.offDefs[self.objPattern][i][1],
-                            i))
-            if self.skyPattern == 'Box4':
-                for i in range(4):
-                    self.ax.add_patch(self.add_sky_diamond(
-                            self.offDefs[self.skyPattern][i][0],
-                            self.offDefs[self.skyPattern][i][1],
-                            self.objFrames1*self.objFrames2+i))
+        self.draw_fixed('Box4')
 
     def draw_box5(self):
         """
         Draws a box5 pattern on the figure using the stored values
         """
-        # Check if the mode takes a spec integration
-        if self.mode in ['spec','both']:
-            # Check if the obj or sky box pattern is Box5
-            if self.objPattern == 'Box5':
-                for i in range(5):
-                    self.ax.add_patch(self.add_obj_box(
-                            self.offDefs[self.objPattern][i][0],
-                            self.offDefs[self.objPattern][i][1],
-                            i))
-            if self.skyPattern == 'Box5':
-                for i in range(5):
-                    self.ax.add_patch(self.add_sky_box(
-                            self.offDefs[self.skyPattern][i][0],
-                            self.offDefs[self.skyPattern][i][1],
-                            self.objFrames1*self.objFrames2+i))
-        # Check if the mode takes an imager integration
-        if self.mode in ['imag','both']:
-            # Check if the obj or sky diamond pattern is Box5
-            if self.objPattern == 'Box5':
-                for i in range(5):
-                    self.ax.add_patch(self.add_obj_diamond(
-                            self.offDefs[self.objPattern][i][0],
-                            self.offDefs[self.objPattern][i][1],
-                            i))
-            if self.skyPattern == 'Box5':
-                for i in range(5):
-                    self.ax.add_patch(self.add_sky_diamond(
-                            self.offDefs[self.skyPattern][i][0],
-                            self.offDefs[self.skyPattern][i][1],
-                            self.objFrames1*self.objFrames2+i))
+        self.draw_fixed('Box5')
 
     def draw_box9(self):
         """
         Draws a Box9 pattern on the figure using the stored values
         """
-        # Check if the mode takes a spec integration
-        if self.mode in ['spec','both']:
-            # Check if the obj or sky box pattern is Box9
-            if self.objPattern == 'Box9':
-                for i in range(9):
-                    self.ax.add_patch(self.add_obj_box(
-                            self.offDefs[self.objPattern][i][0],
-                            self.offDefs[self.objPattern][i][1],
-                            i))
-            if self.skyPattern == 'Box9':
-                for i in range(9):
-                    self.ax.add_patch(self.add_sky_box(
-                            self.offDefs[self.skyPattern][i][0],
-                            self.offDefs[self.skyPattern][i][1],
-                            self.objFrames1*self.objFrames2+i))
-        # Check if the mode takes an image integration
-        if self.mode in ['imag','both']:
-            # Check if the obj or sky diamond pattern is Box9
-            if self.objPattern == 'Box9':
-                for i in range(9):
-                    self.ax.add_patch(self.add_obj_diamond(
-                            self.offDefs[self.objPattern][i][0],
-                            self.offDefs[self.objPattern][i][1],
-                            i))
-            if self.skyPattern == 'Box9':
-                for i in range(9):
-                    self.ax.add_patch(self.add_sky_diamond(
-                            self.offDefs[self.skyPattern][i][0],
-                            self.offDefs[self.skyPattern][i][1],
-                            self.objFrames1*self.objFrames2+i))
+        self.draw_fixed('Box9')
 
     def draw_stat(self):
         """
-        To be done in the future... Creates a randomly generated
-        statistical dither pattern based on user input
+        Draws the generated Statistical Dither on the figure
         """
-        pass
+        if self.objPattern == 'Statistical Dither':
+            self.add_footprints(self.frame_offsets(self.objStat), 0)
+        if self.skyPattern == 'Statistical Dither':
+            self.add_footprints(self.frame_offsets(self.skyStat, sky=True),
+                    self.objFrames1*self.objFrames2)
 
     def draw_raster(self):
         """
-        To be done in the future... Uses an iterative Raster Scan
-        approach to take methodical integrations over the sky
+        Draws a Raster Scan on the figure using the stored frames,
+        rows and step sizes
         """
-        pass
+        if self.objPattern == 'Raster Scan':
+            self.add_footprints(self.obj_raster(), 0)
+        if self.skyPattern == 'Raster Scan':
+            self.add_footprints(self.sky_raster(),
+                    self.objFrames1*self.objFrames2)
 
     def draw_user(self):
         """
         Uses user defined values to draw boxes and diamonds on the
         figure
         """
-        # Iterate through the definitions provided by
-        # the user in groups of 3
-        for i in range(0,len(self.defs),3):
-            if self.mode in ['spec','both']:
-                if self.defs[i+2]=="false":
-                    self.ax.add_patch(
-                            self.add_obj_box(
-                                float(self.defs[i]),
-                                float(self.defs[i+1]),
-                                int(i/3)
-                            )
-                        )
-                elif self.defs[i+2]=="true":
-                    self.ax.add_patch(
-                            self.add_sky_box(
-                                float(self.defs[i]),
-                                float(self.defs[i+1]),
-                                self.objFrames1*self.objFrames2+int(i/3)
-                            )
-                        )
-            if self.mode in ['imag','both']:
-                if self.defs[i+2]=="false":
-                    self.ax.add_patch(
-                            self.add_obj_diamond(
-                                float(self.defs[i]),
-                                float(self.defs[i+1]),
-                                int(i/3)
-                            )
-                        )
-                elif self.defs[i+2]=="true":
-                    self.ax.add_patch(
-                            self.add_sky_diamond(
-                                float(self.defs[i]),
-                                float(self.defs[i+1]),
-                                self.objFrames1*self.objFrames2+int(i/3)
-                            )
-                        )
+        index = np.arange(len(self.userDefs))
+        obj = self.userSky == 'false'
+        sky = self.userSky == 'true'
+        self.add_footprints(self.frame_offsets(self.userDefs[obj]), index[obj])
+        self.add_footprints(self.frame_offsets(self.userDefs[sky], sky=True),
+                self.objFrames1*self.objFrames2 + index[sky])
+
+    def parse_defs(self, defs):
+        """
+        Converts the user defined positions from the webform into
+        arrays once so they are not parsed again for every frame
+
+        @type defs: list
+        @param defs: flat list of x, y, sky strings for each frame
+
+        @return returns an (N,2) array of positions and an (N,) array
+            of the sky flags ('true' or 'false')
+        """
+        num = len(defs)//3
+        defs = np.array(defs[:num*3], dtype=object).reshape(num,3)
+        return defs[:,:2].astype(float), defs[:,2].astype(str)
+
+    def validate(self, qstr):
+        """
+        Checks webform values against the filter and dither pattern
+        rules without changing the object
+
+        @type qstr: dictionary
+        @param qstr: values from the webform, or an imported target
+
+        @return returns a list of error messages, empty if valid
+        """
+        missing = [key for key in self.formKeys if key not in qstr]
+        if missing:
+            return ['missing ' + ', '.join(missing)]
+        val = dict((key, qstr[key][0]) for key in qstr)
+        errors = []
+        for key in ['specItime', 'initOffX', 'initOffY', 'objLenX',
+                'objHgtY', 'imgItime', 'nodOffX', 'nodOffY', 'skyLenX',
+                'skyHgtY', 'pa']:
+            try:
+                float(val[key])
+            except ValueError:
+                errors.append(''.join((key, ' is not a number')))
+        for key in ['specCoadds', 'objFrames1', 'objFrames2', 'repeats',
+                'imgCoadds', 'skyFrames1', 'skyFrames2']:
+            try:
+                if int(val[key]) < 1: raise ValueError
+            except ValueError:
+                errors.append(''.join((key, ' is not a positive integer')))
+        if errors:
+            return errors
+
+        filt = self.filters.get(val['specFilter'])
+        if filt is None:
+            errors.append(''.join(('unknown spec filter ', val['specFilter'])))
+        elif val['scale'] not in ['0.02', '0.035', '0.05', '0.10'] or \
+                filt[val['scale']] is None:
+            # Narrowband filters have no field of view at some scales
+            errors.append(''.join(('scale ', val['scale'],
+                    ' is not available with ', val['specFilter'])))
+        if val['imgFilter'] not in self.imgFilters:
+            errors.append(''.join(('unknown imager filter ', val['imgFilter'])))
+        if val['imgMode'] not in ['Disabled', 'Independent', 'Slave1',
+                'Slave2', 'Slave4']:
+            errors.append(''.join(('unknown imager mode ', val['imgMode'])))
+        if val['aoType'] not in ['NGS', 'LGS']:
+            errors.append(''.join(('unknown AO type ', val['aoType'])))
+
+        for kind in ['obj', 'sky']:
+            pattern = val[kind + 'Pattern']
+            frames = int(val[kind + 'Frames1'])
+            if pattern not in self.draw:
+                errors.append(''.join(('unknown ', kind, ' pattern ', pattern)))
+            elif pattern in ['Box4', 'Box5', 'Box9'] and \
+                    frames != len(self.offDefs[pattern]):
+                errors.append(''.join((pattern, ' needs ',
+                        str(len(self.offDefs[pattern])), ' ', kind, ' frames')))
+            elif pattern == 'Raster Scan' and \
+                    qstr.get(kind + 'Order', ['serpentine'])[0] not in \
+                    ['serpentine', 'rowmajor']:
+                errors.append(''.join(('unknown ', kind, ' raster order')))
+            elif pattern == 'Statistical Dither' and \
+                    qstr.get(kind + 'Sampler', ['uniform'])[0] not in \
+                    ['uniform', 'gaussian', 'poisson']:
+                errors.append(''.join(('unknown ', kind, ' sampler')))
+            elif pattern == 'Statistical Dither' and \
+                    qstr.get(kind + 'Sampler', ['uniform'])[0] == 'poisson':
+                dither = self.offDefs['Dither']
+                try:
+                    seed = int(self.opt_value(qstr, kind + 'Seed',
+                            dither['seed']))
+                    minSep = float(self.opt_value(qstr, kind + 'MinSep',
+                            dither['minsep']))
+                except ValueError:
+                    errors.append(''.join((kind,
+                            ' seed or separation is not a number')))
+                    continue
+                placed = len(self.gen_dither(frames, 'poisson', seed, minSep,
+                        float(val[kind + 'LenX']), float(val[kind + 'HgtY'])))
+                if placed < frames:
+                    errors.append(''.join(('only ', str(placed), ' ', kind,
+                            ' positions fit with a separation of ',
+                            str(minSep))))
+
+        if 'User Defined' in [val['objPattern'], val['skyPattern']]:
+            try:
+                defs, sky = self.parse_defs(val['defs'].split(','))
+            except ValueError:
+                errors.append('user defined positions are not numbers')
+            else:
+                if val['objPattern'] == 'User Defined' and \
+                        (sky == 'false').sum() < int(val['objFrames1']):
+                    errors.append('too few user defined obj positions')
+                if val['skyPattern'] == 'User Defined' and \
+                        (sky == 'true').sum() < int(val['skyFrames1']):
+                    errors.append('too few user defined sky positions')
+        return errors
+
+    def opt_value(self, qstr, name, defValue):
+        """
+        Returns an optional webform value, or defValue when the
+        form did not send it or left it empty
+
+        @type qstr: dictionary
+        @param qstr: values from the webform
+        @type name: string
+        @param name: name of the value
+        @type defValue: any
+        @param defValue: value to use when name is missing
+        """
+        try:
+            val = qstr[name][0]
+        except (KeyError, IndexError):
+            return defValue
+        return val if val != '' else defValue
 
     def update(self, qstr):
         """
@@ -804,10 +1440,104 @@ class Oopgui:
         self.skyLenX = float(qstr['skyLenX'][0])
         self.skyHgtY = float(qstr['skyHgtY'][0])
         self.defs = qstr['defs'][0].split(',')
+        raster = self.offDefs['Raster']
+        dither = self.offDefs['Dither']
+        self.objOrder = self.opt_value(qstr, 'objOrder', raster['order'])
+        self.skyOrder = self.opt_value(qstr, 'skyOrder', raster['order'])
+        self.objSampler = self.opt_value(qstr, 'objSampler', dither['sampler'])
+        self.objSeed = int(self.opt_value(qstr, 'objSeed', dither['seed']))
+        self.objMinSep = float(self.opt_value(qstr, 'objMinSep', dither['minsep']))
+        self.skySampler = self.opt_value(qstr, 'skySampler', dither['sampler'])
+        self.skySeed = int(self.opt_value(qstr, 'skySeed', dither['seed']))
+        self.skyMinSep = float(self.opt_value(qstr, 'skyMinSep', dither['minsep']))
+        self.showCoverage = self.opt_value(qstr, 'coverage', 'false') == 'true'
+        self.ra = self.opt_value(qstr, 'ra', '')
+        self.dec = self.opt_value(qstr, 'dec', '')
+        self.background = self.opt_value(qstr, 'background', '')
+        self.bgScale = float(self.opt_value(qstr, 'bgScale', 1.0))
+
+        # Compare against the previous update so only the stages
+        # that depend on changed values are recomputed
+        config = dict((key, qstr[key][0]) for key in qstr)
+        if self.lastConfig is None:
+            changed = set(config)
+        else:
+            changed = set(key for key in set(config) | set(self.lastConfig)
+                    if config.get(key) != self.lastConfig.get(key))
+        # Kept only once every stage has run, so after a failed
+        # update the next one recomputes everything
+        self.lastConfig = None
+        done = []
+
+        if changed & self.guideKeys:
+            self.guideStars = self.check_guide_stars(
+                    [{'ra':self.ra, 'dec':self.dec, 'aoType':self.aoType}])[0]
 
         # Generate a color list based on the number of frames
-        numFrames = self.objFrames1*self.objFrames2+self.skyFrames1*self.skyFrames2
-        self.colorList = self.gen_color(numFrames)
+        if changed & self.colorKeys:
+            self.colorSeed = int(self.opt_value(qstr, 'colorSeed', 0))
+            numFrames = self.objFrames1*self.objFrames2+self.skyFrames1*self.skyFrames2
+            self.colorList = self.gen_color(numFrames)
+            done.append('colors')
+
+        if changed & self.geometryKeys:
+            self.update_geometry(changed)
+            done.append('geometry')
+
+            # Rescale the gridScale based on the extracted values
+            limits = (self.xMin, self.xMax, self.yMin, self.yMax, self.gridScale)
+            self.gridScale = self.rescale()
+            done.append('limits')
+            if limits != (self.xMin, self.xMax, self.yMin, self.yMax,
+                    self.gridScale):
+                done.append('ticks')
+
+            self.overlaps = self.check_overlaps()
+            done.append('overlap')
+
+        # The exposure depth layer follows the footprints and the
+        # exposure times
+        if changed & self.coverageKeys or (self.showCoverage and
+                'geometry' in done):
+            if self.showCoverage:
+                self.coverageMap = self.coverage(self.coveragePixels)
+            else:
+                self.coverageMap = None
+            done.append('coverage')
+
+        # Only the part of the sky image inside the plot is read, so it
+        # is read again when the limits move
+        if changed & self.backgroundKeys or 'ticks' in done:
+            self.backgroundCut = self.background_cut()
+            done.append('background')
+
+        # Redraw the figure based on the extracted values
+        if done:
+            self.draw_fig(ticks='ticks' in done)
+            done.append('raster')
+        self.skipped = [stage for stage in self.stages if stage not in done]
+        self.lastConfig = config
+
+    def update_geometry(self, changed):
+        """
+        Recomputes the footprint sizes and pattern positions after
+        any of the values they depend on changed
+
+        @type changed: set
+        @param changed: names of the webform values that changed
+        """
+        if changed & set(['objPattern', 'skyPattern', 'defs']):
+            if 'User Defined' in [self.objPattern, self.skyPattern]:
+                self.userDefs, self.userSky = self.parse_defs(self.defs)
+
+        # Generate the Statistical Dither positions once so the figure,
+        # the grid limits and the DDF all use the same pattern
+        if self.objPattern == 'Statistical Dither' and changed & self.objStatKeys:
+            self.objStat = self.gen_dither(self.objFrames1, self.objSampler,
+                    self.objSeed, self.objMinSep, self.objLenX, self.objHgtY)
+        if self.skyPattern == 'Statistical Dither' and changed & self.skyStatKeys:
+            self.skyStat = self.gen_dither(self.skyFrames1, self.skySampler,
+                    self.skySeed, self.skyMinSep, self.skyLenX, self.skyHgtY)
 
         # Update spec values based on specfilter
         self.boxWidth = self.filters[self.specFilter][self.scale][0]
@@ -832,21 +1562,39 @@ class Oopgui:
             self.oriX = -9.0*self.boxWidth / 32.0
         else:
             self.oriX = 0.0
+        self.update_footprints()
 
-        # Rescale the gridScale based on the extracted values
-        self.gridScale = self.rescale()
-        #self.print_all()
-        # Redraw the figure based on the extracted values
-        self.draw_fig()
-        #self.fig.tight_layout()
-        # draw the arrow in the upper right corner
-        #quivx = self.xMax - 0.1*(self.xMax + abs(self.xMin))
-        #quivy = self.yMax - 0.1*(self.yMax + abs(self.yMin))
-        #a = self.ax.quiver(quivx, quivy, [0,-1], [1,0], units='inches',
-        #        pivot='tail', minlength=3)
-        #self.ax.quiverkey(a,.8,.8,2,'N',coordinates='figure')
-        # Apply the grid for visual scale
-        self.ax.grid()
+    def check_guide_stars(self, targets):
+        """
+        Looks up the guide star candidates of targets in the local
+        catalog, see guideStars.GuideCatalog.check. Targets of the
+        same aoType are looked up together.
+
+        @type targets: list
+        @param targets: dictionaries with the ra (hours if
+            sexagesimal), dec and aoType of each target
+
+        @return returns a list with the candidates of each target, or
+            None where there is no catalog or no position
+        """
+        results = [None]*len(targets)
+        cat = guideStars.get_catalog()
+        if cat is None:
+            return results
+        groups = {}
+        for i, tgt in enumerate(targets):
+            try:
+                pos = (visibility.parse_angle(tgt['ra'], True),
+                        visibility.parse_angle(tgt['dec']))
+            except (KeyError, TypeError, ValueError):
+                continue
+            groups.setdefault(tgt.get('aoType', 'NGS'), []).append((i, pos))
+        for aoType, group in groups.items():
+            index, pos = zip(*group)
+            ra, dec = np.array(pos).T
+            for i, res in zip(index, cat.check(ra, dec, aoType)):
+                results[i] = res
+        return results
 
     def print_all(self):
         print('keckID:',self.keckID)
@@ -884,6 +1632,21 @@ class Oopgui:
         print('ymax  :',self.yMax)
         print('gscale:',self.gridScale)
 
+    def dither_lines(self, offsets, sky):
+        """
+        Formats an array of frame offsets as ditherPosition elements
+
+        @type offsets: numpy array
+        @param offsets: (N,2) array of frame offsets
+        @type sky: string
+        @param sky: value of the sky attribute ('true' or 'false')
+
+        @return returns the ditherPosition lines as one string
+        """
+        fmt = ''.join(('\t\t\t<ditherPosition sky="', sky,
+                '" xOff="{}" yOff="{}" />\n'))
+        return ''.join([fmt.format(x, y) for x, y in offsets.tolist()])
+
     def dither_out(self):
         """
 
@@ -924,9 +1687,9 @@ class Oopgui:
                 line1 = ''.join((line1, '\t\t\t<ditherPosition sky="false" xOff="', 
                         self.defs[i],'" yOff="', self.defs[i+1], '" />\n'))
         elif 'Raster Scan' == self.objPattern:
-            pass
+            line1 = self.dither_lines(self.obj_raster(), 'false')
         elif 'Statistical Dither' == self.objPattern:
-            pass
+            line1 = self.dither_lines(self.frame_offsets(self.objStat), 'false')
 
         # Determine the sky portion of the dither pattern
         if 'Stare' == self.skyPattern:
@@ -961,12 +1724,54 @@ class Oopgui:
                 line2 = ''.join((line2, '\t\t\t<ditherPosition sky="true" xOff="',
                         self.defs[i],'" yOff="', self.defs[i+1], '" />\n'))
         elif 'Raster Scan' == self.skyPattern:
-            pass
+            line2 = self.dither_lines(self.sky_raster(), 'true')
         elif 'Statistical Dither' == self.skyPattern:
-            pass
+            line2 = self.dither_lines(
+                    self.frame_offsets(self.skyStat, sky=True), 'true')
         out = ''.join((line1, line2))
         return out
 
+    def dither_shortfall(self):
+        """
+        Statistical Dithers that place fewer positions than their
+        frames, when the poisson sampler can not fit them all at the
+        minimum separation
+
+        @return returns a dictionary of obj and/or sky -> the number
+            of positions placed
+        """
+        short = {}
+        if self.objPattern == 'Statistical Dither' and \
+                len(self.objStat) < self.objFrames1:
+            short['obj'] = len(self.objStat)
+        if self.skyPattern == 'Statistical Dither' and \
+                len(self.skyStat) < self.skyFrames1:
+            short['sky'] = len(self.skyStat)
+        return short
+
+    def pattern_attrs(self, sky=False):
+        """
+        Extra dither attributes needed to reproduce a generated pattern
+
+        @type sky: boolean
+        @param sky: True for the sky pattern, False for the object
+
+        @return returns the attributes as a string for the DDF
+        """
+        if sky:
+            pattern, order = self.skyPattern, self.skyOrder
+            sampler, seed, minSep = self.skySampler, self.skySeed, self.skyMinSep
+        else:
+            pattern, order = self.objPattern, self.objOrder
+            sampler, seed, minSep = self.objSampler, self.objSeed, self.objMinSep
+        if pattern == 'Raster Scan':
+            return ''.join(('order="', order, '" '))
+        elif pattern == 'Statistical Dither':
+            return ''.join(('sampler="', sampler, '" ',
+                    'seed="', str(seed), '" ',
+                    'minSep="', str(minSep), '" '))
+        return ''
+
     def save_to_file(self):
         """
         Save the current configuration as a DDF (XML) file
@@ -1001,14 +1806,18 @@ class Oopgui:
                     'param1="', str(self.objLenX), '" ',
                     'param2="', str(self.objHgtY), '" ',
                     'xOffset="', str(self.initOffX), '" ',
-                    'yOffset="', str(self.initOffY), '" />\n')))
+                    'yOffset="', str(self.initOffY), '" ',
+                    self.pattern_attrs(),
+                    '/>\n')))
             ddf.write(''.join(('\t\t<skyDither type="', self.skyPattern, '" ',
                     'frames1="', str(self.skyFrames1), '" ',
                     'frames2="', str(self.skyFrames2), '" ',
                     'param1="', str(self.skyLenX), '" ',
                     'param2="', str(self.skyHgtY), '" ',
                     'nodXOffset="', str(self.nodOffX), '" ',
-                    'nodYOffset="', str(self.nodOffY), '"/>\n')))
+                    'nodYOffset="', str(self.nodOffY), '" ',
+                    self.pattern_attrs(sky=True),
+                    '/>\n')))
             ddf.write(''.join(('\t\t<ditherPattern coords="', self.coordSys,'" ',
                     'units="', self.units, '" skyPA="', self.pa,'" >\n')))
             ddf.write(self.dither_out())
@@ -1071,15 +1880,16 @@ class Oopgui:
                 codes.append(pcode)
         return codes
 
-    def save_to_db(self, qry):
+    def program_info(self, semid):
         """
-        Save the current configuration to the database
+        Looks up the PI and title of a program
 
-        @type qry: dictionary
-        @param qry: list of user input values from interface
+        @type semid: string
+        @param semid: semester and program code, e.g. 2018A_U020
+
+        @return returns a dictionary of the program values stored
+            with each configuration
         """
-        piID = ''
-        semid = qry['semid'][0]
         URL = ''.join((self.schedurl,'cmd=getPI&semid=',
                 semid))
         res = url.urlopen(URL).read().decode()
@@ -1090,43 +1900,152 @@ class Oopgui:
         res = url.urlopen(URL).read().decode()
         title = res
         semester, progname = semid.split('_')
+        return {'piID':piID, 'progname':progname,
+                'semester':semester, 'progtitl':title}
+
+    def ensure_indexes(self):
+        """
+        Creates the indexes of configIndexes on instrConfigs; indexes
+        that already exist are left alone
+        """
+        self.store.ensure_indexes(self.configIndexes)
+
+    def config_query(self, qstr):
+        """
+        Builds the criteria of a lookup of saved configurations from
+        request values
+
+        @type qstr: dictionary
+        @param qstr: any of semid, semester, progname, keckID, ddfname,
+            object (matches the start of the name) and filter (spec
+            or imager)
+
+        @return returns the criteria for the store
+        """
+        val = dict((key, qstr[key][0]) for key in qstr if qstr[key][0] != '')
+        query = {}
+        if 'semid' in val and '_' in val['semid']:
+            query['semester'], query['progname'] = val['semid'].split('_', 1)
+        for key in ['semester', 'progname', 'keckID', 'ddfname', 'object',
+                'filter']:
+            if key in val:
+                query[key] = val[key]
+        return query
+
+    def find_configs(self, query, fields=None, page=0, perPage=50):
+        """
+        Reads one page of saved configurations, newest first
+
+        @type query: dictionary
+        @param query: criteria, see config_query
+        @type fields: list
+        @param fields: values returned for each configuration,
+            listFields if None
+        @type page: int
+        @param page: page number, from 0
+        @type perPage: int
+        @param perPage: configurations per page, 0 for all of them
+
+        @return returns the total number of matches and the page
+        """
+        total, configs = self.store.find(query, fields or self.listFields,
+                page, perPage)
+        return {'total':total, 'page':page, 'perPage':perPage,
+                'configs':configs}
+
+    def semester_configs(self, semester):
+        """
+        Reads a summary of every configuration saved in a semester,
+        for the ToO schedule cache
+
+        @type semester: string
+        @param semester: semester, e.g. 2018A
+
+        @return returns a list of dictionaries
+        """
+        return self.find_configs({'semester':semester}, perPage=0)['configs']
+
+    def save_too(self, req):
+        """
+        Stores a ToO request
+
+        @type req: dictionary
+        @param req: values of the ToO request
+
+        @return returns True if the request was stored
+        """
+        return self.store.insert([req], 'tooRequests')
+
+    def save_to_db(self, qry):
+        """
+        Save the current configuration to the database
+
+        @type qry: dictionary
+        @param qry: list of user input values from interface
+        """
+        semid = qry['semid'][0]
+        info = self.program_info(semid)
 
-        mc = dcm.db_conn_mongo('osiris')
-        mc.db_connect()
-        mc.db = mc.client[mc.database]
-        mc.col = mc.db['instrConfigs']
         for key in qry:
             qry[key] = qry[key][0]
-        qry['piID'] = piID
-        qry['progname'] = progname
-        qry['semester'] = semester
-        qry['progtitl'] = title
-        try:
-            mc.col.insert(qry)
-        except:
-            return False
-        else:
+        qry.update(info)
+        # Store the seeds actually used so the pattern can be reproduced
+        qry['objSeed'] = self.objSeed
+        qry['skySeed'] = self.skySeed
+        if self.guideStars is not None:
+            qry['guideStars'] = self.guideStars
+        return self.store.insert([qry])
+
+    def save_many_to_db(self, records, semid):
+        """
+        Save many configurations of one program to the database
+        with a single insert
+
+        @type records: list
+        @param records: dictionaries of configuration values
+        @type semid: string
+        @param semid: semester and program code of all the records
+
+        @return returns True if the records were stored
+        """
+        if not records:
             return True
-        finally:
-            mc.db_close()
+        info = self.program_info(semid)
+        guide = self.check_guide_stars(records)
+        for rec, res in zip(records, guide):
+            rec.update(info)
+            if res is not None:
+                rec['guideStars'] = res
+        return self.store.insert(records)
 
     def send_to_queue(self):
         """
-        Moves the file to the directory set in queueDir
+        Copies the saved DDF to the queue in queueDir, unless the
+        same DDF is already queued
+
+        @return returns the name of the DDF in the queue and whether
+            it was already there, or None if it was not transferred
         """
         if '.ddf' not in self.ddfname: ''.join((self.ddfname, '.ddf'))
         try:
-            sh.copy(self.ddfname, self.queueDir)
+            return ddfQueue.get_queue(self.queueDir).add(
+                    ''.join(('docs/', self.ddfname)), self.ddfname)
         except:
             print('File was not transferred')
+            return None
 
     def load_from_db(self, qstr):
         """
-        """
-        keckid = qstr.get('keckid')
-        sem = qstr.get('semester')
-        projcode = qstr.get('projcode')
+        Reads the newest saved configuration matching the request
 
+        @type qstr: dictionary
+        @param qstr: semid (or semester and progname) and ddfname
+
+        @return returns the webform values of the configuration, or
+            None if there is none
+        """
+        total, configs = self.store.find(self.config_query(qstr), None, 0, 1)
+        return configs[0] if configs else None
 
     def get_semester(self):
         today = date.today()
@@ -1135,6 +2054,77 @@ class Oopgui:
         else: sem += 'A'
         return sem
 
+def ddf_to_config(text):
+    """
+    Reads a DDF written by Oopgui.save_to_file back into webform
+    values, so it can be validated and drawn like the form
+
+    @type text: string
+    @param text: content of the DDF
+
+    @return returns a dictionary of lists of strings, like the
+        parsed webform
+    """
+    root = ET.fromstring(text)
+    dataset = root.find('dataset')
+    spec = dataset.find('spec')
+    imag = dataset.find('imag')
+    obj = dataset.find('objectDither')
+    sky = dataset.find('skyDither')
+    pattern = dataset.find('ditherPattern')
+    imgModes = {'Disabled':'Disabled', 'Independent':'Independent',
+            'Slave 1':'Slave1', 'Slave 2':'Slave2', 'Slave 4':'Slave4'}
+    imgMode = imag.get('mode', 'Disabled')
+    imgMode = [val for key, val in imgModes.items()
+            if imgMode.startswith(key)] or ['Disabled']
+    imgFrame = imag.find('imagFrame')
+    if imgFrame is None: imgFrame = ET.Element('imagFrame')
+    config = {
+        'keckID':'', 'ddfname':'', 'imgMode':imgMode[0],
+        'dataset':dataset.get('name', ''),
+        'object':dataset.findtext('object', ''),
+        'targType':root.get('type', 'target'),
+        'coordSys':pattern.get('coords', 'instr'),
+        'units':pattern.get('units', 'arcsec'),
+        'pa':pattern.get('skyPA', '0.0'),
+        'aoType':dataset.get('aomode', 'NGS'),
+        'lgsMode':'No Laser',
+        'specFilter':spec.get('filter'),
+        'scale':spec.get('scale', '').split('"')[0].strip(),
+        'specCoadds':spec.get('coadds', '1'),
+        'specItime':spec.get('itime', '1'),
+        'imgFilter':imgFrame.get('filter', 'Opn'),
+        'imgItime':imgFrame.get('itime', '1'),
+        'imgCoadds':imgFrame.get('coadds', '1'),
+        'repeats':imgFrame.get('repeats', '1'),
+        'objPattern':obj.get('type'),
+        'objFrames1':obj.get('frames1', '1'),
+        'objFrames2':obj.get('frames2', '1'),
+        'objLenX':obj.get('param1', '0.0'),
+        'objHgtY':obj.get('param2', '0.0'),
+        'initOffX':obj.get('xOffset', '0.0'),
+        'initOffY':obj.get('yOffset', '0.0'),
+        'skyPattern':sky.get('type'),
+        'skyFrames1':sky.get('frames1', '1'),
+        'skyFrames2':sky.get('frames2', '1'),
+        'skyLenX':sky.get('param1', '0.0'),
+        'skyHgtY':sky.get('param2', '0.0'),
+        'nodOffX':sky.get('nodXOffset', '0.0'),
+        'nodOffY':sky.get('nodYOffset', '0.0'),
+    }
+    for kind, elem in [('obj', obj), ('sky', sky)]:
+        for attr, key in [('order', 'Order'), ('sampler', 'Sampler'),
+                ('seed', 'Seed'), ('minSep', 'MinSep')]:
+            if elem.get(attr) is not None:
+                config[kind + key] = elem.get(attr)
+    defs = []
+    for pos in pattern.findall('ditherPosition'):
+        sky = pos.get('sky')
+        if config[('sky' if sky == 'true' else 'obj') + 'Pattern'] == 'User Defined':
+            defs.extend((pos.get('xOff'), pos.get('yOff'), sky))
+    config['defs'] = ','.join(defs)
+    return dict((key, [val]) for key, val in config.items())
+
 def SpecFilters():
     """
     This function returns the filter specifications for all
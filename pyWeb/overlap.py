@@ -0,0 +1,67 @@
+"""
+Overlap checks between frames of a dither pattern
+
+Every frame of one CCD has the same footprint, only moved, so two
+frames overlap when the difference of their offsets, measured along
+the edges of the footprint, is less than its width and height. The
+offsets are hashed onto a grid of footprint sized cells and only the
+3x3 cells around each position are compared, so the work grows with
+the number of frames and overlaps found instead of with every pair.
+"""
+
+import numpy as np
+
+def cell_keys(cells, low, stride):
+    return (cells[:,0] - low[0])*stride + (cells[:,1] - low[1])
+
+def box_pairs(a, b=None, size=(1.0, 1.0)):
+    """
+    Pairs of positions closer than size along both axes
+
+    @type a: numpy array
+    @param a: (N,2) array of positions
+    @type b: numpy array
+    @param b: (M,2) array of positions, or None to pair a with itself
+    @type size: tuple
+    @param size: width and height of the footprint
+
+    @return returns two arrays of indices into a and b; with b None
+        each pair is given once, lowest index first
+    """
+    same = b is None
+    if same:
+        b = a
+    size = np.asarray(size, dtype=float)
+    if len(a) == 0 or len(b) == 0 or (size <= 0).any():
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    ca = np.floor(a/size).astype(np.int64)
+    cb = np.floor(b/size).astype(np.int64)
+    # One spare cell on each side for the neighbours
+    low = np.minimum(ca.min(axis=0), cb.min(axis=0)) - 1
+    stride = max(ca[:,1].max(), cb[:,1].max()) - low[1] + 2
+    keys = cell_keys(ca, low, stride)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    bkeys = cell_keys(cb, low, stride)
+    ia = []
+    ib = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            near = bkeys + dx*stride + dy
+            first = np.searchsorted(keys, near, 'left')
+            counts = np.searchsorted(keys, near, 'right') - first
+            total = counts.sum()
+            if not total:
+                continue
+            # Expand each [first, first+count) range into its indices
+            starts = np.repeat(first - np.cumsum(counts) + counts, counts)
+            ia.append(order[starts + np.arange(total)])
+            ib.append(np.repeat(np.arange(len(b)), counts))
+    if not ia:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    ia = np.concatenate(ia)
+    ib = np.concatenate(ib)
+    keep = (np.abs(a[ia] - b[ib]) < size).all(axis=1)
+    if same:
+        keep &= ia < ib
+    return ia[keep], ib[keep]
@@ -0,0 +1,211 @@
+"""
+Speculative drawing of the likely next states
+
+After a drawgui request the next one usually only changes the object
+or sky pattern, the imager mode or the scale. The Prerenderer draws
+those neighbours of a session's last request in the background, with
+a separate Oopgui so the session's own drawing is not disturbed, and
+puts them in the session's image cache. It only runs while no real
+drawgui request is being served.
+"""
+
+import json
+import threading
+import collections
+import oopgui
+
+patterns = ['None', 'Stare', 'Box4', 'Box5', 'Box9', 'Statistical Dither',
+        'Raster Scan']
+modes = ['Disabled', 'Independent', 'Slave1', 'Slave2', 'Slave4']
+scales = ['0.02', '0.035', '0.05', '0.10']
+
+def draw(oop, qstr, opts):
+    """
+    Updates and renders a drawing
+
+    @return returns the image, its type and the extra headers
+    """
+    oop.update(qstr)
+    buf = oop.render(**opts)
+    headers = [('X-Skipped-Stages', ','.join(oop.skipped)),
+            ('X-Overlaps', json.dumps(oop.overlaps['counts']))]
+    if oop.guideStars is not None:
+        headers.append(('X-Guide-Stars', json.dumps(oop.guideStars)))
+    short = oop.dither_shortfall()
+    if short:
+        headers.append(('X-Dither-Shortfall', json.dumps(short)))
+    if opts['fmt'] == 'rgba':
+        width, height = oop.render_size(opts['dpi'], opts['size'])
+        headers.append(('X-Width', str(width)))
+        headers.append(('X-Height', str(height)))
+    return buf, oop.imageTypes[opts['fmt']], headers
+
+def request_key(qstr):
+    """
+    Key of a drawgui request in the image cache
+    """
+    return tuple(sorted((name, tuple(val)) for name, val in qstr.items()
+            if name != 'rnd'))
+
+def with_pattern(qstr, kind, pattern):
+    """
+    The request after the webform changed the obj or sky pattern,
+    with the frame counts and disabled fields the form then sends
+    """
+    new = dict(qstr)
+    new[kind + 'Pattern'] = [pattern]
+    if pattern == 'Stare':
+        new[kind + 'Frames1'] = ['1']
+    elif pattern in ['Box4', 'Box5', 'Box9']:
+        new[kind + 'Frames1'] = [pattern[3]]
+    if pattern in ['None', 'Stare']:
+        new[kind + 'LenX'] = ['1.0']
+        new[kind + 'HgtY'] = ['1.0']
+    if kind == 'sky' and pattern == 'None':
+        new['nodOffX'] = ['0.0']
+        new['nodOffY'] = ['0.0']
+    return new
+
+def neighbors(qstr):
+    """
+    Requests likely to follow this one, most likely first
+
+    @return returns a list of requests
+    """
+    result = []
+    for kind, other in [('obj', 'sky'), ('sky', 'obj')]:
+        for pattern in patterns:
+            if pattern == qstr[kind + 'Pattern'][0]:
+                continue
+            # Nothing would be drawn
+            if pattern == 'None' and qstr[other + 'Pattern'][0] == 'None':
+                continue
+            result.append(with_pattern(qstr, kind, pattern))
+    for mode in modes:
+        if mode != qstr['imgMode'][0]:
+            result.append(dict(qstr, imgMode=[mode]))
+    for scale in scales:
+        if scale != qstr['scale'][0]:
+            result.append(dict(qstr, scale=[scale]))
+    return result
+
+class ImageCache:
+    """
+    The last images drawn for a session, by request
+
+    @type size: int
+    @param size: number of images kept
+    """
+    size = 32
+
+    def __init__(self):
+        self.images = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            result = self.images.get(key)
+            if result is not None:
+                self.images.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        with self.lock:
+            self.images[key] = result
+            self.images.move_to_end(key)
+            while len(self.images) > self.size:
+                self.images.popitem(last=False)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.images
+
+class Prerenderer:
+    """
+    One background thread drawing the neighbours of the last request
+    of each session. busy counts the real drawgui requests being
+    served; the thread waits while it is not zero, and a neighbour
+    interrupted by a real request is drawn again later.
+
+    @type jobs: OrderedDict
+    @param jobs: session id -> (session, neighbours left to draw,
+        render options)
+    """
+    def __init__(self):
+        self.jobs = collections.OrderedDict()
+        self.busy = 0
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def request_started(self):
+        with self.cond:
+            self.busy += 1
+
+    def request_finished(self):
+        with self.cond:
+            self.busy -= 1
+            self.cond.notify_all()
+
+    def schedule(self, sess, qstr, opts):
+        """
+        Replaces the neighbours waiting to be drawn for a session by
+        those of its latest request
+        """
+        with self.cond:
+            self.jobs[sess.sid] = (sess, collections.deque(neighbors(qstr)), opts)
+            self.jobs.move_to_end(sess.sid)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+    def next_job(self):
+        """
+        Waits until there is no real request and something to draw
+
+        @return returns the session, its neighbours left, the request
+            and the options to draw
+        """
+        with self.cond:
+            while True:
+                while self.busy or not self.jobs:
+                    self.cond.wait()
+                sid, (sess, todo, opts) = next(iter(self.jobs.items()))
+                if not todo:
+                    del self.jobs[sid]
+                    continue
+                qstr = todo.popleft()
+                # Take turns between sessions
+                self.jobs.move_to_end(sid)
+                return sess, todo, qstr, opts
+
+    def run(self):
+        while True:
+            sess, todo, qstr, opts = self.next_job()
+            key = request_key(qstr)
+            if key in sess.cache:
+                continue
+            try:
+                if sess.spec is None:
+                    sess.spec = oopgui.Oopgui()
+                if sess.spec.validate(qstr):
+                    continue
+                sess.spec.update(qstr)
+                with self.cond:
+                    interrupted = self.busy > 0
+                if interrupted:
+                    self.requeue(sess, todo, qstr)
+                    continue
+                sess.cache.put(key, draw(sess.spec, qstr, opts))
+            except Exception as e:
+                print ('prerender failed:', e)
+
+    def requeue(self, sess, todo, qstr):
+        """
+        Puts back an interrupted neighbour, unless the session has
+        made a new request since
+        """
+        with self.cond:
+            job = self.jobs.get(sess.sid)
+            if job is not None and job[1] is todo:
+                todo.appendleft(qstr)
@@ -0,0 +1,263 @@
+"""
+Sky images drawn behind the footprints
+
+A SkyImage is a FITS file or a plain image (JPEG, PNG) of the field.
+FITS data are opened memory-mapped straight from the file; a plain
+image is decoded once and kept as a .npy file that is memory-mapped
+from then on. Halved copies (each pixel the mean of 2x2 pixels of the
+level below) are built the first time they are needed and kept on
+disk next to the image, in image.pyr/, so a render only reads the
+pixels of the level that fits the plot window, and only those inside
+the window.
+
+The image is placed with its WCS (CRPIX, CRVAL and CD or CDELT, for
+the TAN projection) when the target has an ra and dec, otherwise with
+the target at the image center and a given scale. It is drawn north
+up and east left, like the footprints.
+"""
+
+import os
+import threading
+import numpy as np
+
+images = {}
+imagesLock = threading.Lock()
+
+def get_image(directory, name):
+    """
+    Returns the SkyImage of a file in the image directory, opening it
+    the first time it is asked for
+
+    @type directory: string
+    @param directory: directory the images are read from
+    @type name: string
+    @param name: file name, without any directory
+
+    @return returns the SkyImage, or None if there is no such file
+    """
+    path = os.path.join(directory, os.path.basename(name))
+    if not name or not os.path.isfile(path):
+        return None
+    with imagesLock:
+        img = images.get(path)
+        if img is None or img.mtime != os.path.getmtime(path):
+            img = images[path] = SkyImage(path)
+    return img
+
+def read_fits_header(f):
+    """
+    Reads the primary header of a FITS file
+
+    @return returns the header values by keyword and the offset of
+        the data
+    """
+    header = {}
+    while True:
+        block = f.read(2880)
+        if len(block) < 2880:
+            raise ValueError('truncated FITS header')
+        for i in range(0, 2880, 80):
+            card = block[i:i+80].decode('ascii', 'replace')
+            key = card[:8].strip()
+            if key == 'END':
+                return header, f.tell()
+            if card[8:10] != '= ':
+                continue
+            val = card[10:].strip()
+            if val.startswith("'"):
+                header[key] = val[1:].split("'")[0].strip()
+                continue
+            val = val.split('/')[0].strip()
+            try:
+                header[key] = int(val)
+            except ValueError:
+                try:
+                    header[key] = float(val)
+                except ValueError:
+                    header[key] = val
+    return header, f.tell()
+
+class SkyImage:
+    """
+    @type path: string
+    @param path: image file
+    @type wcs: dictionary
+    @param wcs: crpix (0 based), crval (degrees) and cd (degrees per
+        pixel) of a FITS image, or None
+    @type minSize: int
+    @param minSize: the smallest level is at least this many pixels
+        on its short side
+    """
+    bitpix = {8:'u1', 16:'>i2', 32:'>i4', 64:'>i8', -32:'>f4', -64:'>f8'}
+    minSize = 256
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.pyramid = path + '.pyr'
+        self.levels = {}
+        self.lock = threading.RLock()
+        self.wcs = None
+        self.scale = 1.0
+        self.zero = 0.0
+        with open(path, 'rb') as f:
+            fits = f.read(9) == b'SIMPLE  ='
+        if fits:
+            self.open_fits()
+        else:
+            self.open_picture()
+
+    def open_fits(self):
+        with open(self.path, 'rb') as f:
+            header, offset = read_fits_header(f)
+        shape = (header['NAXIS2'], header['NAXIS1'])
+        self.levels[0] = np.memmap(self.path, dtype=self.bitpix[header['BITPIX']],
+                mode='r', offset=offset, shape=shape)
+        self.scale = float(header.get('BSCALE', 1.0))
+        self.zero = float(header.get('BZERO', 0.0))
+        if 'CRVAL1' in header and 'CRPIX1' in header:
+            if 'CD1_1' in header:
+                cd = [[header.get('CD1_1', 0.0), header.get('CD1_2', 0.0)],
+                        [header.get('CD2_1', 0.0), header.get('CD2_2', 0.0)]]
+            else:
+                cd = [[header.get('CDELT1', 1.0), 0.0],
+                        [0.0, header.get('CDELT2', 1.0)]]
+            self.wcs = {'crpix':np.array([header['CRPIX1'], header['CRPIX2']],
+                    dtype=float) - 1, 'crval':np.array([header['CRVAL1'],
+                    header['CRVAL2']], dtype=float), 'cd':np.array(cd)}
+
+    def open_picture(self):
+        """
+        Decodes a plain image once into a grey level .npy, bottom row
+        first like FITS
+        """
+        level0 = os.path.join(self.pyramid, 'level0.npy')
+        if not os.path.exists(level0) or \
+                os.path.getmtime(level0) < self.mtime:
+            from PIL import Image
+            data = np.asarray(Image.open(self.path).convert('F'))[::-1]
+            os.makedirs(self.pyramid, exist_ok=True)
+            tmp = level0 + '.tmp.npy'
+            np.save(tmp, data.astype(np.float32))
+            os.replace(tmp, level0)
+        self.levels[0] = np.load(level0, mmap_mode='r')
+
+    @property
+    def shape(self):
+        return self.levels[0].shape
+
+    def level(self, k):
+        """
+        The image halved k times, built from level k-1 the first time
+        """
+        with self.lock:
+            if k not in self.levels:
+                self.levels[k] = self.build_level(k)
+            return self.levels[k]
+
+    def build_level(self, k):
+        below = self.level(k-1)
+        path = os.path.join(self.pyramid, ''.join(('level', str(k), '.npy')))
+        if not os.path.exists(path) or os.path.getmtime(path) < self.mtime:
+            rows, cols = below.shape[0]//2, below.shape[1]//2
+            os.makedirs(self.pyramid, exist_ok=True)
+            tmp = path + '.tmp.npy'
+            out = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32,
+                    shape=(rows, cols))
+            # A band of rows at a time, so a large image is never read
+            # into memory whole
+            for r in range(0, rows, 1024):
+                band = np.asarray(below[2*r:2*min(r+1024, rows),:2*cols],
+                        dtype=np.float32)
+                if k == 1:
+                    band = band*self.scale + self.zero
+                out[r:r+len(band)//2] = band.reshape(len(band)//2, 2,
+                        cols, 2).mean(axis=(1, 3))
+            out.flush()
+            del out
+            os.replace(tmp, path)
+        return np.load(path, mmap_mode='r')
+
+    def max_level(self):
+        k = 0
+        size = min(self.shape)
+        while size//2 >= self.minSize:
+            size //= 2
+            k += 1
+        return k
+
+    def placement(self, ra=None, dec=None, scale=1.0):
+        """
+        Where the target is on the image and the size of a pixel
+
+        @type scale: float
+        @param scale: arcsec per pixel when the image has no WCS
+
+        @return returns the 0 based x and y pixel of the target and
+            the arcsec per pixel along x and y, negative where the
+            pixels run east or south
+        """
+        if self.wcs is not None:
+            cd = self.wcs['cd']*3600.0
+            # +x on the plot is west, so RA falling with x is positive
+            sx = -np.hypot(cd[0,0], cd[1,0])*np.sign(cd[0,0] or 1.0)
+            sy = np.hypot(cd[0,1], cd[1,1])*np.sign(cd[1,1] or 1.0)
+            if ra is None or dec is None:
+                return self.wcs['crpix'][0], self.wcs['crpix'][1], sx, sy
+            return tuple(self.sky_to_pixel(ra, dec)) + (sx, sy)
+        rows, cols = self.shape
+        return (cols - 1)/2.0, (rows - 1)/2.0, scale, scale
+
+    def sky_to_pixel(self, ra, dec):
+        """
+        TAN projection of a sky position onto the image
+        """
+        ra0, dec0 = np.radians(self.wcs['crval'])
+        ra, dec = np.radians(ra), np.radians(dec)
+        cosc = np.sin(dec0)*np.sin(dec) + np.cos(dec0)*np.cos(dec)*np.cos(ra - ra0)
+        xi = np.cos(dec)*np.sin(ra - ra0)/cosc
+        eta = (np.cos(dec0)*np.sin(dec) -
+                np.sin(dec0)*np.cos(dec)*np.cos(ra - ra0))/cosc
+        off = np.linalg.solve(self.wcs['cd'], np.degrees([xi, eta]))
+        return self.wcs['crpix'] + off
+
+    def window(self, xMin, xMax, yMin, yMax, place, pixels=1024):
+        """
+        Reads the pixels of the plot window from the smallest level
+        with at least the given resolution
+
+        @type place: tuple
+        @param place: target pixel and arcsec per pixel, see placement
+        @type pixels: int
+        @param pixels: pixels wanted across the window
+
+        @return returns the pixels, bottom row and west column first,
+            and their extent on the plot, or None if the window is
+            off the image
+        """
+        x0, y0, sx, sy = place
+        k = 0
+        top = self.max_level()
+        while k < top and (xMax - xMin)/abs(sx)/2**(k+1) >= pixels:
+            k += 1
+        data = self.level(k)
+        f = 2.0**k
+        # Level k pixel j covers level 0 pixels j*f-0.5 to (j+1)*f-0.5
+        cx = sorted([x0 + xMin/sx, x0 + xMax/sx])
+        cy = sorted([y0 + yMin/sy, y0 + yMax/sy])
+        c0 = max(int(np.floor((cx[0] + 0.5)/f)), 0)
+        c1 = min(int(np.ceil((cx[1] + 0.5)/f)), data.shape[1])
+        r0 = max(int(np.floor((cy[0] + 0.5)/f)), 0)
+        r1 = min(int(np.ceil((cy[1] + 0.5)/f)), data.shape[0])
+        if c0 >= c1 or r0 >= r1:
+            return None
+        cut = np.asarray(data[r0:r1, c0:c1], dtype=np.float32)
+        if k == 0:
+            cut = cut*self.scale + self.zero
+        left, right = (c0*f - 0.5 - x0)*sx, (c1*f - 0.5 - x0)*sx
+        bottom, top = (r0*f - 0.5 - y0)*sy, (r1*f - 0.5 - y0)*sy
+        if left > right:
+            cut, left, right = cut[:,::-1], right, left
+        if bottom > top:
+            cut, bottom, top = cut[::-1], top, bottom
+        return cut, [left, right, bottom, top]
@@ -4,15 +4,118 @@ import socketserver
 import socket
 import math
 import io
+import time
+import uuid
+import threading
+import tarfile
+import os
+import numpy as np
 import matplotlib.pyplot as plt
 import oopgui
+import bulkImport
+import tooCache
+import ddfQueue
+import prerender
+import obsTime
+import visibility
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
 
-from easyHTTP import EasyHTTPHandler, EasyHTTPServer, EasyHTTPServerThreaded
+from easyHTTP import EasyHTTPHandler, EasyHTTPServer, EasyHTTPServerThreaded, \
+        HTTPStatus
 
 Globals = {}
 BASEURL = 'http://vm-opsbuild:8080/'
 
+class Render:
+    """
+    A drawgui render in progress; requests for the same image wait
+    for it instead of drawing it again. error is the exception the
+    render raised, if it failed.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class Session:
+    """
+    State kept for one browser between requests, so successive
+    updates only recompute what changed. renders holds the drawgui
+    renders in progress by request, latest is the newest request;
+    a render that is no longer the latest is dropped. cache holds the
+    last images by request, including those drawn ahead of time with
+    spec by the Prerenderer.
+    """
+    def __init__(self, sid):
+        self.sid = sid
+        self.oop = oopgui.Oopgui()
+        self.lock = threading.Lock()
+        self.lastUsed = time.time()
+        self.renders = {}
+        self.latest = None
+        self.renderLock = threading.Lock()
+        self.cache = prerender.ImageCache()
+        self.spec = None
+
 class TestAppHandler (EasyHTTPHandler):
+    # Least recently used first
+    sessions = OrderedDict()
+    sessionLock = threading.Lock()
+    sessionTimeout = 3600
+    maxSessions = 64
+    sessionCookie = 'oopSession'
+    too = None
+    tooLock = threading.Lock()
+    tooWait = 30
+    schedurl = 'https://www.keck.hawaii.edu/software/db_api/telSchedule.php?'
+    prerenderer = prerender.Prerenderer()
+    estimator = obsTime.TimeEstimator()
+    planner = visibility.NightPlanner()
+    # At most this many of each at once; the rest wait or get 503
+    requestLimits = {'drawgui':4, 'animate':2, 'coverage':2,
+            'save_to_db':2, 'bulk_import':1, 'save_to_file':2,
+            'send_to_queue':2, 'ddf_archive':1, 'estimate_time':2,
+            'visibility':2, 'find_configs':4, 'getPCodes:fetch':2}
+    # getPCodes is only cheap when the codes are cached, see
+    # admissionName
+    cheapRequests = ['getPCodes', 'server_stats', 'queue_list',
+            'too_projects', 'too_instruments', 'too_nights']
+    # Image resolution (dots per inch) and size (inches) allowed
+    dpiRange = (30, 200)
+    sizeRange = (2.0, 16.0)
+    coverageRange = (16, 1024)
+    # Program codes by keckID, least recently used first
+    pCodes = OrderedDict()
+    pCodesLock = threading.Lock()
+    pCodesTimeout = 600
+    maxPCodes = 256
+
+    def session(self):
+        """
+        Returns the Session of the requesting browser, starting a new
+        one (and setting its cookie) if there is none. Sessions unused
+        for sessionTimeout are dropped, and so is the least recently
+        used one when there would be more than maxSessions.
+        """
+        sid = self.getCookie(self.sessionCookie)
+        with self.sessionLock:
+            now = time.time()
+            while self.sessions and now - next(iter(
+                    self.sessions.values())).lastUsed > self.sessionTimeout:
+                self.sessions.popitem(last=False)
+            sess = self.sessions.get(sid)
+            if sess is None:
+                sess = Session(uuid.uuid4().hex)
+                self.sessions[sess.sid] = sess
+                self.addHeader('Set-Cookie',
+                        '%s=%s; path=/' % (self.sessionCookie, sess.sid))
+                while len(self.sessions) > self.maxSessions:
+                    self.sessions.popitem(last=False)
+            self.sessions.move_to_end(sess.sid)
+            sess.lastUsed = now
+        return sess
+
     def echo (self, req, qstr):
         return self.response (json.dumps(qstr), self.PlainTextType)
 
@@ -29,7 +132,10 @@ class TestAppHandler (EasyHTTPHandler):
         return self.response("done", self.HTMLType)
 
     def fileupload(self, req, qstr):
-        return self.response(qstr['content'][0], self.PlainTextType)
+        content = qstr['content'][0]
+        if hasattr(content, 'read'):
+            content = self.readChunks(content)
+        return self.response(content, self.PlainTextType)
 
     def echoJpeg(self, req, qstr):
         imgContent = qstr.get('imgcontent')
@@ -37,6 +143,8 @@ class TestAppHandler (EasyHTTPHandler):
             return None, ""
 
         imgData = imgContent[0]
+        if hasattr(imgData, 'read'):
+            imgData = self.readChunks(imgData)
         return self.response(imgData, "image/jpeg")
 
     def getResult(self, req, qstr):
@@ -58,17 +166,177 @@ class TestAppHandler (EasyHTTPHandler):
         buf = imgData.read()
         return self.response(buf, 'image/png')
 
+    def renderOptions(self, qstr):
+        """
+        Picks the image format and resolution for drawgui. The DPI
+        follows the width of the image element in the browser (times
+        its devicePixelRatio) unless it is given directly. DPI and
+        size are kept within dpiRange and sizeRange, so a request can
+        not ask for a huge canvas.
+        """
+        def clamp(value, limits):
+            # NaN compares false with everything, take the minimum
+            if value != value: return limits[0]
+            return min(max(value, limits[0]), limits[1])
+
+        size = clamp(self.floatVal(qstr, 'size', 8.0), self.sizeRange)
+        width = self.floatVal(qstr, 'width', 0) * self.floatVal(qstr, 'dpr', 1)
+        if width > 0:
+            dpi = int(round(clamp(width/size, self.dpiRange)))
+        else:
+            dpi = 100
+        return {
+            'fmt': self.getDefValue(qstr, 'fmt', 'png'),
+            'dpi': clamp(self.intVal(qstr, 'dpi', dpi), self.dpiRange),
+            'compress': clamp(self.intVal(qstr, 'compress', 6), (0, 9)),
+            'quality': clamp(self.intVal(qstr, 'quality', 90), (1, 95)),
+            'size': size
+        }
+
     def drawgui(self, req, qstr):
-        self.oop.update(qstr)
-        imgData = io.BytesIO()
-        self.oop.fig.savefig(imgData, format='png')
-        imgData.seek(0)
-        buf = imgData.read()
-        return self.response(buf, 'image/png')
+        """
+        Draws the configuration. Images already drawn, or drawn ahead
+        of time, come from the session's cache. Identical requests of
+        a session that arrive while it is drawn share the one image,
+        and a request that is superseded by a newer one before it is
+        drawn gets 204 No Content instead, since the browser has
+        moved on. Invalid forms get 400 with the validate() errors,
+        and the requests sharing a render that failed get 500.
+        """
+        sess = self.session()
+        # validate() does not change the object, no lock needed
+        errors = sess.oop.validate(qstr)
+        if errors:
+            self.setStatus(HTTPStatus.BAD_REQUEST)
+            return self.response(json.dumps({'errors':errors}),
+                    self.PlainTextType)
+        opts = self.renderOptions(qstr)
+        if opts['fmt'] not in sess.oop.imageTypes:
+            self.setStatus(HTTPStatus.BAD_REQUEST)
+            return self.response('unknown format', self.PlainTextType)
+        key = prerender.request_key(qstr)
+        self.prerenderer.request_started()
+        try:
+            with sess.renderLock:
+                sess.latest = key
+                cached = sess.cache.get(key)
+                render = sess.renders.get(key)
+                leader = cached is None and render is None
+                if leader:
+                    render = sess.renders[key] = Render()
+
+            if cached is not None:
+                result = cached
+                self.addHeader('X-Cache', 'hit')
+            elif leader:
+                try:
+                    render.result = self.renderSession(sess, key, qstr, opts)
+                except Exception as e:
+                    render.error = e
+                    raise
+                finally:
+                    with sess.renderLock:
+                        del sess.renders[key]
+                    render.done.set()
+                result = render.result
+                if result is not None:
+                    sess.cache.put(key, result)
+            else:
+                render.done.wait()
+                result = render.result
+                if render.error is not None:
+                    # The render waited for failed, it was not superseded
+                    self.setStatus(HTTPStatus.INTERNAL_SERVER_ERROR)
+                    return self.response(''.join(('drawing failed: ',
+                            str(render.error))), self.PlainTextType)
+        finally:
+            self.prerenderer.request_finished()
+
+        if result is None:
+            self.setStatus(HTTPStatus.NO_CONTENT)
+            self.addHeader('X-Superseded', '1')
+            return self.response(b'', self.PlainTextType)
+        if sess.latest == key:
+            self.prerenderer.schedule(sess, qstr, opts)
+        buf, contType, headers = result
+        for name, value in headers:
+            self.addHeader(name, value)
+        return self.response(buf, contType)
+
+    def renderSession(self, sess, key, qstr, opts):
+        """
+        Updates and renders the session's drawing unless a newer
+        request has come in meanwhile
+
+        @return returns the image, its type and the extra headers,
+            or None if the request was superseded
+        """
+        with sess.lock:
+            if sess.latest != key:
+                return None
+            sess.oop.update(qstr)
+            if sess.latest != key:
+                return None
+            return prerender.draw(sess.oop, qstr, opts)
+
+    def animate(self, req, qstr):
+        """
+        Plays back the configuration's positions in the order they
+        are visited, as an APNG or, with fmt=gif, a GIF
+        """
+        opts = self.renderOptions(qstr)
+        fmt = self.getDefValue(qstr, 'fmt', 'apng')
+        sess = self.session()
+        with sess.lock:
+            if fmt not in sess.oop.animTypes:
+                self.setStatus(HTTPStatus.BAD_REQUEST)
+                return self.response('unknown format', self.PlainTextType)
+            sess.oop.update(qstr)
+            buf = sess.oop.animate(fmt, opts['dpi'], opts['size'],
+                    self.intVal(qstr, 'delay', 500), opts['compress'])
+        return self.response(buf, sess.oop.animTypes[fmt])
+
+    def coverage(self, req, qstr):
+        """
+        Exposure depth map of the configuration, as JSON or, with
+        fmt=npz, as a NumPy archive download. The map is pixels
+        square, within coverageRange.
+        """
+        pixels = min(max(self.intVal(qstr, 'pixels', 256),
+                self.coverageRange[0]), self.coverageRange[1])
+        sess = self.session()
+        with sess.lock:
+            sess.oop.update(qstr)
+            cov = sess.oop.coverage(pixels)
+        if self.getDefValue(qstr, 'fmt', 'json') == 'npz':
+            buf = io.BytesIO()
+            np.savez_compressed(buf, extent=cov['extent'], pixel=cov['pixel'],
+                    **dict((key, cov[key]) for key in ['spec', 'imag']
+                    if cov[key] is not None))
+            self.addHeader('Content-Disposition',
+                    'attachment; filename="coverage.npz"')
+            return self.response(buf.getvalue(), 'application/octet-stream')
+        for key in ['spec', 'imag']:
+            if cov[key] is not None:
+                cov[key] = cov[key].tolist()
+        return self.response(json.dumps(cov), self.PlainTextType)
+
+    def guide_stars(self, req, qstr):
+        """
+        Guide star candidates of the configuration's ra and dec, null
+        without a catalog or a position
+        """
+        sess = self.session()
+        with sess.lock:
+            sess.oop.update(qstr)
+            result = sess.oop.guideStars
+        return self.response(json.dumps(result), self.PlainTextType)
 
     def save_to_db(self, req, qstr):
-        self.oop.update(qstr)
-        result = self.oop.save_to_db(qstr)
+        sess = self.session()
+        with sess.lock:
+            sess.oop.update(qstr)
+            result = sess.oop.save_to_db(qstr)
         if result == True:
             return self.response(json.dumps("File saved to db"),
                     self.PlainTextType)
@@ -76,25 +344,153 @@ class TestAppHandler (EasyHTTPHandler):
             return self.response(json.dumps("Error File not saved to DB"),
                     self.PlainTextType)
 
+    def bulk_import(self, req, qstr):
+        """
+        Validates a target list and/or DDFs in one request. Target
+        list rows and DDFs are laid over the webform values sent
+        with them. With save=true the valid entries are stored with
+        one bulk insert.
+        """
+        base = dict((key, val) for key, val in qstr.items()
+                if key not in ['targets', 'ddf', 'ddf.filename', 'save'])
+        base.setdefault('defs', [''])
+        entries = []
+        names = []
+        for data in qstr.get('targets', []):
+            if hasattr(data, 'read'):
+                data = b''.join(self.readChunks(data))
+            rows = bulkImport.parse_targets(data)
+            entries.extend(rows)
+            names.extend(row.get('object', row.get('ddfname', ''))
+                    for row in rows)
+        files = []
+        ddfNames = qstr.get('ddf.filename', [])
+        for i, data in enumerate(qstr.get('ddf', [])):
+            if hasattr(data, 'read'):
+                data = b''.join(self.readChunks(data))
+            name = ddfNames[i] if i < len(ddfNames) else ''.join(('ddf', str(i)))
+            files.append((name, data))
+        ddfEntries, results = bulkImport.ddf_entries(files)
+        entries.extend(ddfEntries)
+        names.extend(entry['ddfname'] for entry in ddfEntries)
+
+        configs, checked = bulkImport.check_entries(base, entries)
+        for name, res in zip(names, checked):
+            res['name'] = name
+        results.extend(checked)
+        resp = {'entries':results,
+                'valid':sum(1 for res in results if not res['errors'])}
+
+        if self.getDefValue(qstr, 'save', 'false') == 'true':
+            semid = self.getDefValue(qstr, 'semid', '')
+            records = [dict((key, val[0]) for key, val in config.items())
+                    for config, res in zip(configs, checked)
+                    if not res['errors']]
+            resp['saved'] = bool(semid) and \
+                    self.oop.save_many_to_db(records, semid)
+        return self.response(json.dumps(resp), self.PlainTextType)
+
     def save_to_file(self, req, qstr):
-        self.oop.update(qstr)
-        if self.oop.save_to_file():
-            furl = ''.join((BASEURL, self.oop.ddfname))
-            resp = {'furl':furl,'ddf':self.oop.ddfname}
+        sess = self.session()
+        with sess.lock:
+            sess.oop.update(qstr)
+            saved = sess.oop.save_to_file()
+        if saved:
+            furl = ''.join((BASEURL, sess.oop.ddfname))
+            resp = {'furl':furl,'ddf':sess.oop.ddfname}
             return self.response(json.dumps(resp), self.PlainTextType)
         else: return self.response(
                 json.dumps("File could not be saved"),
                 self.PlainTextType
             )
 
+    def overlaps(self, req, qstr):
+        """
+        Sky frames landing on object frames and repeated positions
+        of the configuration, see Oopgui.check_overlaps
+        """
+        sess = self.session()
+        with sess.lock:
+            sess.oop.update(qstr)
+            result = sess.oop.overlaps
+        return self.response(json.dumps(result), self.PlainTextType)
+
     def send_to_queue(self, req, qstr):
-        self.oop.update(qstr)
-        self.oop.save_to_file()
-        self.oop.send_to_queue()
-        return self.response(
-                json.dumps("Config moved to queue"),
-                self.PlainTextType
-        )
+        """
+        Saves the DDF and queues it. A configuration with overlaps is
+        only queued with force=true; otherwise the overlaps are sent
+        back so the observer can confirm.
+        """
+        try:
+            ddfQueue.check_name(self.getDefValue(qstr, 'ddfname', ''))
+        except ValueError as e:
+            return self.response(json.dumps({'error':str(e)}),
+                    self.PlainTextType)
+        sess = self.session()
+        with sess.lock:
+            sess.oop.update(qstr)
+            overlaps = sess.oop.overlaps
+            if any(overlaps['counts'].values()) and \
+                    self.getDefValue(qstr, 'force', 'false') != 'true':
+                return self.response(json.dumps({'overlaps':overlaps}),
+                        self.PlainTextType)
+            sess.oop.save_to_file()
+            queued = sess.oop.send_to_queue()
+        if queued is None:
+            resp = {'error':'Config could not be moved to queue'}
+        else:
+            resp = {'name':queued[0], 'duplicate':queued[1]}
+        return self.response(json.dumps(resp), self.PlainTextType)
+
+    def queue(self):
+        return ddfQueue.get_queue(self.session().oop.queueDir)
+
+    def set_queue(self, req, qstr):
+        sess = self.session()
+        try:
+            with sess.lock:
+                sess.oop.set_queue_dir(self.getDefValue(qstr, 'queueDir', '~/'))
+        except ValueError as e:
+            return self.response(json.dumps({'error':str(e)}),
+                    self.PlainTextType)
+        return self.queue_list(req, qstr)
+
+    def queue_list(self, req, qstr):
+        return self.response(json.dumps(self.queue().list()),
+                self.PlainTextType)
+
+    def queue_reorder(self, req, qstr):
+        """
+        Moves the DDFs named in names (comma separated) to the front
+        of the queue in that order
+        """
+        names = self.getDefValue(qstr, 'names', '').split(',')
+        return self.response(json.dumps(self.queue().reorder(names)),
+                self.PlainTextType)
+
+    def queue_dequeue(self, req, qstr):
+        removed = self.queue().dequeue(self.getDefValue(qstr, 'name', ''))
+        return self.response(json.dumps(removed), self.PlainTextType)
+
+    def ddf_archive(self, req, qstr):
+        """
+        Streams every saved DDF as one tar.gz, a file at a time
+        """
+        def chunks():
+            buf = io.BytesIO()
+            tar = tarfile.open(fileobj=buf, mode='w|gz')
+            for name in sorted(os.listdir(self.DocRoot)):
+                if name.endswith('.ddf'):
+                    tar.add(os.path.join(self.DocRoot, name), arcname=name)
+                    yield buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
+            tar.close()
+            yield buf.getvalue()
+
+        self.addHeader('Content-Disposition',
+                'attachment; filename="ddfs.tar.gz"')
+        return self.response(chunks(), 'application/gzip')
 
     def remove_file(self, req, qstr):
         fpath = qstr['ddf'][0]
@@ -106,9 +502,181 @@ class TestAppHandler (EasyHTTPHandler):
                 self.PlainTextType
             )
 
+    def find_configs(self, req, qstr):
+        """
+        Lists saved configurations a page at a time. Takes the
+        filters of Oopgui.config_query, page, perPage and fields (a
+        comma separated list of the values to return)
+        """
+        fields = self.getDefValue(qstr, 'fields', '')
+        fields = [key for key in fields.split(',') if key] or None
+        perPage = min(self.intVal(qstr, 'perPage', 50), 500)
+        res = self.oop.find_configs(self.oop.config_query(qstr), fields,
+                self.intVal(qstr, 'page', 0), max(perPage, 1))
+        return self.response(json.dumps(res), self.PlainTextType)
+
+    def estimate_time(self, req, qstr):
+        """
+        Science time, overhead and total duration in seconds of many
+        configurations. Takes configs, a JSON list of configurations;
+        or program=true with the filters of Oopgui.config_query for
+        the saved configurations of a program; or else estimates the
+        configuration in the request.
+        """
+        if 'configs' in qstr:
+            configs = json.loads(qstr['configs'][0])
+        elif self.getDefValue(qstr, 'program', 'false') == 'true':
+            configs = self.oop.find_configs(self.oop.config_query(qstr),
+                    self.estimator.fields, perPage=0)['configs']
+        else:
+            configs = [qstr]
+        times = self.estimator.estimate(configs)
+        for cfg, est in zip(configs, times):
+            for key in ['ddfname', 'object']:
+                val = cfg.get(key, '')
+                est[key] = val[0] if isinstance(val, list) else val
+        total = dict((key, sum(est[key] for est in times))
+                for key in ['science', 'overhead', 'total'])
+        return self.response(json.dumps({'configs':times, 'total':total}),
+                self.PlainTextType)
+
+    def visibility(self, req, qstr):
+        """
+        Altitude, airmass, rise and set of targets over a night from
+        Maunakea. Takes night (local date, today if not given) and
+        targets, a JSON list of name, ra and dec; or program=true with
+        the filters of Oopgui.config_query for the saved configurations
+        of a program. grid=true also returns the altitudes at every
+        step of the night.
+        """
+        night = self.getDefValue(qstr, 'night', '') or \
+                time.strftime('%Y-%m-%d', time.gmtime(time.time() +
+                visibility.utcOffset*3600))
+        if 'targets' in qstr:
+            targets = json.loads(qstr['targets'][0])
+        else:
+            targets = self.oop.find_configs(self.oop.config_query(qstr),
+                    ['ddfname', 'object', 'ra', 'dec'], perPage=0)['configs']
+        try:
+            res = self.planner.plan(night, targets,
+                    self.getDefValue(qstr, 'grid', 'false') == 'true')
+        except ValueError:
+            res = {'error':''.join(('bad night ', night))}
+        return self.response(json.dumps(res), self.PlainTextType)
+
+    def load_from_db(self, req, qstr):
+        config = self.oop.load_from_db(qstr)
+        return self.response(json.dumps(config), self.PlainTextType)
+
+    def tooCache(self):
+        """
+        Returns the ToO schedule cache, starting it on first use and
+        waiting up to tooWait seconds for its first load
+        """
+        cls = TestAppHandler
+        with cls.tooLock:
+            if cls.too is None:
+                cls.too = tooCache.ToOCache(cls.schedurl,
+                        self.oop.get_semester(),
+                        loadConfigs=self.oop.semester_configs)
+                cls.too.start()
+        # The thread does the loading, other requests are not held
+        # behind tooLock meanwhile
+        cls.too.ready.wait(cls.tooWait)
+        return cls.too
+
+    def too_projects(self, req, qstr):
+        return self.response(json.dumps(self.tooCache().get_projects()),
+                self.PlainTextType)
+
+    def too_instruments(self, req, qstr):
+        semid = self.getDefValue(qstr, 'semid', '')
+        return self.response(json.dumps(self.tooCache().get_instruments(semid)),
+                self.PlainTextType)
+
+    def too_nights(self, req, qstr):
+        semid = self.getDefValue(qstr, 'semid', '')
+        instr = self.getDefValue(qstr, 'instrument', '')
+        return self.response(json.dumps(self.tooCache().get_nights(semid, instr)),
+                self.PlainTextType)
+
+    def too_configs(self, req, qstr):
+        semid = self.getDefValue(qstr, 'semid', '')
+        return self.response(json.dumps(self.tooCache().get_configs(semid)),
+                self.PlainTextType)
+
+    def too_targets(self, req, qstr):
+        semid = self.getDefValue(qstr, 'semid', '')
+        ddfname = self.getDefValue(qstr, 'ddfname', '')
+        return self.response(
+                json.dumps(self.tooCache().get_targets(semid, ddfname)),
+                self.PlainTextType)
+
+    def too_submit(self, req, qstr):
+        """
+        Checks a ToO request against the cached schedule and stores it
+        """
+        keys = ['semid', 'instrument', 'night', 'ddfname', 'object',
+                'number', 'pattern', 'time']
+        too = dict((key, self.getDefValue(qstr, key, '')) for key in keys)
+        errors = self.tooCache().check_request(too)
+        if not errors:
+            too['submitted'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            if not self.oop.save_too(too):
+                errors.append('ToO request not saved to DB')
+        return self.response(json.dumps({'errors':errors}), self.PlainTextType)
+
+    @classmethod
+    def cachedPCodes(cls, keckid):
+        """
+        @return returns the program codes of an observer if they were
+            looked up less than pCodesTimeout ago, None otherwise
+        """
+        with cls.pCodesLock:
+            cached = cls.pCodes.get(keckid)
+            if cached is None or time.time() - cached[0] >= cls.pCodesTimeout:
+                return None
+            cls.pCodes.move_to_end(keckid)
+            return cached[1]
+
+    @classmethod
+    def admissionName(cls, name, data):
+        """
+        A getPCodes request whose codes are not cached asks the
+        schedule, so it is admitted as getPCodes:fetch, outside the
+        cheap pool. The keckID is read from the query string or from
+        the form body, if the whole body was peeked at.
+        """
+        if name != 'getPCodes':
+            return name
+        head, _, body = data.partition(b"\r\n\r\n")
+        lines = head.decode('latin-1').split('\r\n')
+        qstr = parse_qs(urlparse(lines[0].split()[1]).query)
+        length = [line.split(':', 1)[1].strip() for line in lines[1:]
+                if line.lower().startswith('content-length:')]
+        if length and length[0].isdigit() and len(body) >= int(length[0]):
+            qstr.update(parse_qs(body[:int(length[0])].decode('latin-1')))
+        keckid = qstr.get('keckID', [''])[0]
+        if keckid and cls.cachedPCodes(keckid) is not None:
+            return name
+        return 'getPCodes:fetch'
+
     def getPCodes(self, req, qstr):
+        """
+        Program codes of an observer, kept for pCodesTimeout seconds
+        so the schedule is not asked again on every page load. At
+        most maxPCodes observers are kept, and empty answers are not.
+        """
         keckid = qstr['keckID'][0]
-        codes = self.oop.get_p_codes(keckid)
+        codes = self.cachedPCodes(keckid)
+        if codes is None:
+            codes = self.oop.get_p_codes(keckid)
+            if codes:
+                with self.pCodesLock:
+                    self.pCodes[keckid] = (time.time(), codes)
+                    self.pCodes.move_to_end(keckid)
+                    while len(self.pCodes) > self.maxPCodes:
+                        self.pCodes.popitem(last=False)
         sem = self.oop.get_semester();
         res = {'keckid':codes, 'sem':sem}
         return self.response(
@@ -135,7 +703,18 @@ if __name__ == "__main__":
         TestAppHandler.DocRoot = "docs"
         TestAppHandler.logEnabled = True
         TestAppHandler.oop = oopgui.Oopgui()
-        ts = EasyHTTPServer (('', port), TestAppHandler)
+        try:
+            TestAppHandler.oop.ensure_indexes()
+        except Exception as e:
+            print ("Could not create the DB indexes:", e)
+        # Only the server copies the local store to Mongo (OOPGUI_SYNC),
+        # not the bulk import workers or other processes importing oopgui
+        TestAppHandler.oop.store.start_sync()
+        if len(sys.argv) > 2:
+            # e.g. a local stub: http://localhost:8090/telSchedule?
+            TestAppHandler.schedurl = sys.argv[2]
+        # Threaded so the sessions stay in memory between requests
+        ts = EasyHTTPServerThreaded (('', port), TestAppHandler)
         ts.run4ever()
     except Exception as e:
         print (e)
@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep saved configurations in a local file, no Mongo needed
+os.environ.setdefault('OOPGUI_DB', os.path.join(tempfile.mkdtemp(),
+        'test.db'))
+
+import matplotlib
+matplotlib.use('Agg')
+
+def form_values(**values):
+    """
+    The webform values of a drawgui request, as parse_qs gives them
+    """
+    form = dict(keckID='1', ddfname='test', imgMode='Disabled',
+            dataset='d', object='obj', targType='target', coordSys='instr',
+            units='arcsec', pa='0.0', aoType='NGS', lgsMode='No Laser',
+            specFilter='Zbb', scale='0.02', specCoadds='1', specItime='2',
+            initOffX='0.0', initOffY='0.0', objPattern='Stare',
+            objFrames1='1', objFrames2='1', objLenX='1.0', objHgtY='1.0',
+            imgFilter='Opn', repeats='1', imgCoadds='1', imgItime='2',
+            nodOffX='0.0', nodOffY='0.0', skyPattern='None', skyFrames1='1',
+            skyFrames2='1', skyLenX='1.0', skyHgtY='1.0', defs='')
+    form.update(values)
+    return dict((name, [str(val)]) for name, val in form.items())
+
+@pytest.fixture
+def form():
+    return form_values
+
+@pytest.fixture
+def oop():
+    import oopgui
+    return oopgui.Oopgui()
@@ -0,0 +1,42 @@
+import json
+import time
+import threading
+import urllib.request
+import urllib.error
+
+from easyHTTP import EasyHTTPHandler, EasyHTTPServerThreaded
+
+class SlowHandler(EasyHTTPHandler):
+    requestLimits = {'slow':2}
+    maxQueued = 64
+
+    def slow(self, req, qstr):
+        time.sleep(0.02)
+        return self.response('done', self.PlainTextType)
+
+def test_threaded_slots_released():
+    server = EasyHTTPServerThreaded(('127.0.0.1', 0), SlowHandler)
+    thread = threading.Thread(target=server.serve_forever,
+            args=(server.pollInterval,), daemon=True)
+    thread.start()
+    base = 'http://127.0.0.1:%d/' % server.server_address[1]
+    codes = []
+    def get():
+        try:
+            res = urllib.request.urlopen(base + 'slow', timeout=30)
+            codes.append(res.status)
+        except urllib.error.HTTPError as e:
+            codes.append(e.code)
+    try:
+        clients = [threading.Thread(target=get) for i in range(40)]
+        for client in clients: client.start()
+        for client in clients: client.join()
+        stats = json.loads(urllib.request.urlopen(base + 'server_stats').read())
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert codes == [200]*40
+    assert stats['active'] == {'server_stats':1}
+    assert stats['activeOther'] == 0 and stats['queueDepth'] == 0
+    assert stats['admitted'] == 41
+    assert list(server.running.values()) in ([], ['server_stats'])
@@ -0,0 +1,24 @@
+import pytest
+import bulkImport
+
+@pytest.fixture(scope='module', autouse=True)
+def shutdown_pool():
+    yield
+    if bulkImport.pool is not None:
+        bulkImport.pool.shutdown()
+        bulkImport.pool = None
+
+def test_unavailable_scale_is_a_row_error(form):
+    base = form()
+    entries = [
+        {'object':'ok', 'specFilter':'Kbb', 'scale':'0.02'},
+        {'object':'no fov', 'specFilter':'Kcb', 'scale':'0.02'},
+        {'object':'not a scale', 'specFilter':'Kbb', 'scale':'SEL'},
+        {'object':'ok too', 'specFilter':'Kcb', 'scale':'0.10'},
+    ]
+    configs, results = bulkImport.check_entries(base, entries)
+    assert len(results) == 4
+    assert results[0]['errors'] == [] and results[0]['thumbnail']
+    assert results[1]['errors'] == ['scale 0.02 is not available with Kcb']
+    assert results[2]['errors'] == ['scale SEL is not available with Kbb']
+    assert results[3]['errors'] == [] and results[3]['thumbnail']
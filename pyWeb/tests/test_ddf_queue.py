@@ -0,0 +1,65 @@
+import os
+import pytest
+
+import ddfQueue
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    monkeypatch.setattr(ddfQueue, 'root', str(tmp_path))
+    monkeypatch.setattr(ddfQueue, 'queues', ddfQueue.OrderedDict())
+    yield tmp_path
+    for queue in ddfQueue.queues.values():
+        queue.stop()
+
+def write_ddf(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+    return str(path)
+
+@pytest.mark.parametrize('directory', ['/etc', '..', '{root}/../x',
+        '{root}/link'])
+def test_outside_root(root, directory):
+    os.symlink('/tmp', str(root / 'link'))
+    with pytest.raises(ValueError):
+        ddfQueue.get_queue(directory.format(root=root))
+    assert not ddfQueue.queues
+
+def test_watchers_capped(root, monkeypatch):
+    monkeypatch.setattr(ddfQueue, 'maxQueues', 2)
+    first = ddfQueue.get_queue(str(root / 'a'))
+    ddfQueue.get_queue(str(root / 'b'))
+    assert ddfQueue.get_queue(str(root / 'a')) is first
+    ddfQueue.get_queue(str(root / 'c'))
+    # b was the least recently used
+    assert list(ddfQueue.queues) == [str(root / 'a'), str(root / 'c')]
+    first.thread.join(0)
+    assert first.thread.is_alive()
+    ddfQueue.get_queue(str(root / 'd'))
+    first.thread.join(5)
+    assert not first.thread.is_alive() and first.watcher is None
+
+def test_duplicates(root, tmp_path_factory):
+    src = tmp_path_factory.mktemp('src')
+    queue = ddfQueue.get_queue(str(root / 'q'))
+    one = write_ddf(src / 'one.ddf', 'same')
+    assert queue.add(one) == ('one.ddf', False)
+    # A second copy written straight into the directory
+    write_ddf(root / 'q' / 'two.ddf', 'same')
+    queue.refresh('two.ddf')
+    assert queue.add(write_ddf(src / 'three.ddf', 'same')) == \
+            ('one.ddf', True)
+    # Removing one copy leaves the other as the duplicate
+    assert queue.dequeue('one.ddf')
+    assert queue.add(one) == ('two.ddf', True)
+    assert queue.dequeue('two.ddf')
+    assert queue.add(one) == ('one.ddf', False)
+
+@pytest.mark.parametrize('name', ['../../x.ddf', 'sub/x.ddf', '', '.',
+        '..', '.hidden.ddf', 'queueOrder'])
+def test_bad_names(root, tmp_path_factory, name):
+    src = write_ddf(tmp_path_factory.mktemp('src') / 'one.ddf', 'text')
+    queue = ddfQueue.get_queue(str(root / 'q'))
+    with pytest.raises(ValueError):
+        queue.add(src, name or '/')
+    assert sorted(os.listdir(str(root))) == ['q']
+    assert os.listdir(str(root / 'q')) == []
@@ -0,0 +1,29 @@
+import json
+
+import prerender
+
+def poisson_form(form, **values):
+    poisson = dict(objPattern='Statistical Dither', objSampler='poisson',
+            objFrames1=20, objLenX=2.0, objHgtY=2.0, objMinSep=1.0)
+    poisson.update(values)
+    return form(**poisson)
+
+def test_validate_shortfall(oop, form):
+    errors = oop.validate(poisson_form(form))
+    assert len(errors) == 1
+    assert errors[0].startswith('only ')
+    assert errors[0].endswith(' obj positions fit with a separation of 1.0')
+    assert oop.validate(poisson_form(form, objMinSep=0.1)) == []
+    assert oop.validate(poisson_form(form, objSeed='x')) == \
+            ['obj seed or separation is not a number']
+
+def test_draw_reports_shortfall(oop, form):
+    opts = {'fmt':'png', 'dpi':40, 'size':4.0}
+    qstr = poisson_form(form)
+    buf, contType, headers = prerender.draw(oop, qstr, opts)
+    placed = len(oop.objStat)
+    assert 0 < placed < 20
+    assert dict(headers)['X-Dither-Shortfall'] == json.dumps({'obj':placed})
+    buf, contType, headers = prerender.draw(oop,
+            poisson_form(form, objMinSep=0.1), opts)
+    assert 'X-Dither-Shortfall' not in dict(headers)
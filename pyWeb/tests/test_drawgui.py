@@ -0,0 +1,48 @@
+import time
+import threading
+
+import testServer
+
+def make_handler(sid=None):
+    handler = testServer.TestAppHandler.__new__(testServer.TestAppHandler)
+    handler.headers = {'Cookie':'oopSession=' + sid} if sid else {}
+    handler.extraHeaders = []
+    handler.status = testServer.HTTPStatus.OK
+    return handler
+
+def test_followers_of_failed_render(form, monkeypatch):
+    monkeypatch.setattr(testServer.TestAppHandler, 'sessions',
+            testServer.OrderedDict())
+    started = threading.Event()
+    release = threading.Event()
+    def renderSession(self, sess, key, qstr, opts):
+        started.set()
+        release.wait(5)
+        raise RuntimeError('no canvas')
+    monkeypatch.setattr(testServer.TestAppHandler, 'renderSession',
+            renderSession)
+    sid = make_handler().session().sid
+    leader = make_handler(sid)
+    errors = []
+    def lead():
+        try:
+            leader.drawgui(None, form())
+        except RuntimeError as e:
+            errors.append(e)
+    thread = threading.Thread(target=lead)
+    thread.start()
+    assert started.wait(5)
+    follower = make_handler(sid)
+    answers = []
+    waiter = threading.Thread(target=lambda:
+            answers.append(follower.drawgui(None, form())))
+    waiter.start()
+    # Let the follower find the render in progress
+    time.sleep(0.2)
+    release.set()
+    thread.join(5)
+    waiter.join(5)
+    assert len(errors) == 1
+    assert follower.status == testServer.HTTPStatus.INTERNAL_SERVER_ERROR
+    assert answers == [(b'drawing failed: no canvas', follower.PlainTextType)]
+    assert ('X-Superseded', '1') not in follower.extraHeaders
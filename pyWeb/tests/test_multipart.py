@@ -0,0 +1,117 @@
+import io
+import socket
+import threading
+import pytest
+
+from easyHTTP import EasyHTTPHandler, EasyHTTPServerThreaded, \
+        MultipartParser, RequestTooLarge
+
+boundary = b'bound'
+# The file holds pieces of the delimiter that must not end the part
+fileData = b'\r\n--boun\r\n-\r\n--bounx' + bytes(range(256))*3 + b'\r\n--'
+
+def body(parts, close=True):
+    out = [b'preamble']
+    for name, filename, data in parts:
+        disp = 'form-data; name="%s"' % name
+        if filename:
+            disp += '; filename="%s"' % filename
+        out += [b'\r\n--', boundary, b'\r\nContent-Disposition: ',
+                disp.encode(), b'\r\n\r\n', data]
+    if close:
+        out += [b'\r\n--', boundary, b'--\r\n']
+    return b''.join(out)
+
+formParts = [('a', None, b'1'), ('up', 'x.bin', fileData), ('b', None, b'')]
+
+class Trickle(io.BytesIO):
+    """
+    Gives back at most step bytes per read, as a socket may
+    """
+    def __init__(self, data, step):
+        io.BytesIO.__init__(self, data)
+        self.step = step
+
+    def read(self, n=-1):
+        return io.BytesIO.read(self, min(n, self.step))
+
+def parse(data, chunkSize=64*1024, step=None, maxPartSize=1024*1024,
+        length=None):
+    parser = MultipartParser(Trickle(data, step or len(data)), boundary,
+            len(data) if length is None else length, maxPartSize, 64)
+    parser.chunkSize = chunkSize
+    return [(headers.get_param('name', header='content-disposition'),
+            headers.get_filename(), part.read(), size)
+            for headers, part, size in parser.parts()]
+
+@pytest.mark.parametrize('chunkSize', list(range(1, 24)) + [37, 64, 1000])
+def test_boundary_split_across_chunks(chunkSize):
+    data = body(formParts)
+    expected = [(name, filename, value, len(value))
+            for name, filename, value in formParts]
+    assert parse(data, chunkSize) == expected
+    assert parse(data, chunkSize, step=3) == expected
+
+def test_part_too_large():
+    data = body(formParts)
+    assert parse(data, 7, maxPartSize=len(fileData))[1][3] == len(fileData)
+    with pytest.raises(RequestTooLarge):
+        parse(data, 7, maxPartSize=len(fileData) - 1)
+
+def test_headers_too_large(monkeypatch):
+    monkeypatch.setattr(MultipartParser, 'maxHeaderSize', 100)
+    data = body([('a', 'x'*200, b'1')])
+    with pytest.raises(RequestTooLarge):
+        parse(data, 16)
+
+@pytest.mark.parametrize('cut', [5, 12, 30, 60, -3])
+def test_truncated(cut):
+    data = body(formParts)
+    with pytest.raises(ValueError):
+        parse(data[:cut], 16)
+    # Content-Length shorter than the body
+    with pytest.raises(ValueError):
+        parse(data, 16, length=len(data) + cut if cut < 0 else cut)
+
+def test_no_closing_delimiter():
+    with pytest.raises(ValueError):
+        parse(body(formParts, close=False), 16)
+
+class UploadHandler(EasyHTTPHandler):
+    maxPartSize = 1024
+
+    def upload(self, req, qstr):
+        return self.response(str(sorted(qstr)), self.PlainTextType)
+
+@pytest.fixture(scope='module')
+def server():
+    server = EasyHTTPServerThreaded(('127.0.0.1', 0), UploadHandler)
+    thread = threading.Thread(target=server.serve_forever,
+            args=(server.pollInterval,), daemon=True)
+    thread.start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+def post(address, data, length=None):
+    head = ('POST /upload HTTP/1.1\r\nHost: x\r\n'
+            'Content-Type: multipart/form-data; boundary=bound\r\n'
+            'Content-Length: %d\r\nConnection: close\r\n\r\n' % (
+            len(data) if length is None else length)).encode()
+    with socket.create_connection(address, timeout=10) as sock:
+        sock.sendall(head + data)
+        sock.shutdown(socket.SHUT_WR)
+        answer = b''
+        while True:
+            data = sock.recv(65536)
+            if not data: break
+            answer += data
+    return int(answer.split()[1]), answer.split(b'\r\n\r\n', 1)[1]
+
+def test_http_status(server):
+    assert post(server, body(formParts)) == \
+            (200, b"['a', 'b', 'up', 'up.filename']")
+    big = body([('up', 'x.bin', b'x'*1025)])
+    assert post(server, big)[0] == 413
+    data = body(formParts)
+    assert post(server, data[:40], len(data))[0] == 400
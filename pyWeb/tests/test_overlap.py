@@ -0,0 +1,71 @@
+import itertools
+import numpy as np
+import pytest
+
+import overlap
+
+def brute_pairs(a, b, size, same=False):
+    return set((i, j) for i in range(len(a)) for j in range(len(b))
+            if (not same or i < j) and (np.abs(a[i] - b[j]) < size).all())
+
+def as_set(pairs):
+    i, j = pairs
+    assert len(set(zip(i.tolist(), j.tolist()))) == len(i)
+    return set(zip(i.tolist(), j.tolist()))
+
+@pytest.mark.parametrize('seed', range(8))
+def test_box_pairs(seed):
+    rng = np.random.default_rng(seed)
+    size = rng.uniform(0.2, 3.0, 2)
+    a = rng.uniform(-10, 10, (200,2))
+    b = rng.uniform(-5, 15, (150,2))
+    # Positions on cell edges and repeated positions
+    a[:20] = np.round(a[:20]/size)*size
+    b[:10] = a[:10]
+    a[20:25] = a[25:30]
+    assert as_set(overlap.box_pairs(a, b, size)) == brute_pairs(a, b, size)
+    assert as_set(overlap.box_pairs(a, size=size)) == \
+            brute_pairs(a, a, size, same=True)
+
+def test_box_pairs_empty():
+    a = np.zeros((3,2))
+    assert as_set(overlap.box_pairs(a, np.zeros((0,2)))) == set()
+    assert as_set(overlap.box_pairs(a, size=(0, 1))) == set()
+    assert as_set(overlap.box_pairs(a)) == set([(0, 1), (0, 2), (1, 2)])
+
+def polygons_overlap(p, q):
+    """
+    Separating axis test of two convex polygons; touching edges do
+    not count
+    """
+    for poly in (p, q):
+        edges = np.roll(poly, -1, axis=0) - poly
+        for n in edges[:,::-1]*[1, -1]:
+            if (p.dot(n).max() <= q.dot(n).min() or
+                    q.dot(n).max() <= p.dot(n).min()):
+                return False
+    return True
+
+@pytest.mark.parametrize('coordSys, pa', [('sky', 30.0), ('instr', 30.0),
+        ('sky', -117.0), ('instr', 0.0)])
+def test_check_overlaps(oop, form, coordSys, pa):
+    oop.update(form(imgMode='Slave1', specFilter='Kbb', scale='0.05',
+            coordSys=coordSys, pa=pa, objPattern='Statistical Dither',
+            objFrames1=40, objLenX=8.0, objHgtY=6.0,
+            skyPattern='Statistical Dither', skyFrames1=40, skyLenX=8.0,
+            skyHgtY=6.0, nodOffX=3.0, nodOffY=2.0))
+    oop.overlapLimit = 100000
+    result = oop.check_overlaps()
+    obj = oop.frame_offsets(oop.pattern_units())
+    sky = oop.frame_offsets(oop.pattern_units(sky=True), sky=True)
+    for name, verts in [('spec', oop.box_verts), ('imag', oop.diamond_verts)]:
+        a, b = verts(obj), verts(sky)
+        expected = set((i+1, j+1) for i, j in itertools.product(
+                range(len(a)), range(len(b)))
+                if polygons_overlap(a[i], b[j]))
+        assert expected
+        if name == 'spec':
+            # Not every pair, or the check would prove little
+            assert len(expected) < len(a)*len(b)
+        assert set(map(tuple, result[name])) == expected
+        assert result['counts'][name] == len(expected)
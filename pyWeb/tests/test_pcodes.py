@@ -0,0 +1,61 @@
+import json
+import time
+import pytest
+
+import testServer
+
+Handler = testServer.TestAppHandler
+
+class FakeOop:
+    def __init__(self):
+        self.asked = []
+
+    def get_p_codes(self, keckid):
+        self.asked.append(keckid)
+        return [] if keckid == 'nobody' else ['U%03d' % len(self.asked)]
+
+    def get_semester(self):
+        return '2018A'
+
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setattr(Handler, 'pCodes', testServer.OrderedDict())
+    monkeypatch.setattr(Handler, 'maxPCodes', 2)
+    monkeypatch.setattr(Handler, 'oop', FakeOop())
+    return Handler.__new__(Handler)
+
+def codes(handler, keckid):
+    body, contType = handler.getPCodes(None, {'keckID':[keckid]})
+    return json.loads(body)['keckid']
+
+def post(keckid, length=None):
+    body = b'keckID=' + keckid
+    return b''.join((b'POST /getPCodes HTTP/1.1\r\nHost: x\r\n',
+            b'Content-Length: ', str(length or len(body)).encode(),
+            b'\r\n\r\n', body))
+
+def test_cache_is_bounded(handler):
+    assert codes(handler, 'a') == ['U001']
+    assert codes(handler, 'b') == ['U002']
+    assert codes(handler, 'a') == ['U001']
+    codes(handler, 'c')
+    # b was the least recently used
+    assert list(handler.pCodes) == ['a', 'c']
+    assert codes(handler, 'nobody') == []
+    assert 'nobody' not in handler.pCodes
+    handler.pCodes['a'] = (time.time() - handler.pCodesTimeout, ['old'])
+    assert codes(handler, 'a') == ['U005']
+
+def test_admission_name(handler):
+    codes(handler, '123')
+    assert Handler.admissionName('getPCodes', post(b'123')) == 'getPCodes'
+    assert Handler.admissionName('getPCodes',
+            b'GET /getPCodes?keckID=123 HTTP/1.1\r\n\r\n') == 'getPCodes'
+    # Not cached, or not all of the body came in
+    assert Handler.admissionName('getPCodes', post(b'456')) == \
+            'getPCodes:fetch'
+    assert Handler.admissionName('getPCodes', post(b'12', 6 + 7)) == \
+            'getPCodes:fetch'
+    assert Handler.admissionName('getPCodes',
+            b'POST /getPCodes HTTP/1.1\r\nHost: x') == 'getPCodes:fetch'
+    assert Handler.admissionName('drawgui', post(b'123')) == 'drawgui'
@@ -0,0 +1,49 @@
+import json
+import pytest
+
+import testServer
+
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setattr(testServer.TestAppHandler, 'sessions',
+            testServer.OrderedDict())
+    handler = testServer.TestAppHandler.__new__(testServer.TestAppHandler)
+    handler.headers = {}
+    handler.extraHeaders = []
+    handler.status = None
+    return handler
+
+def options(handler, **values):
+    return handler.renderOptions(dict((name, [str(val)])
+            for name, val in values.items()))
+
+def test_defaults(handler):
+    assert options(handler) == {'fmt':'png', 'dpi':100, 'compress':6,
+            'quality':90, 'size':8.0}
+    assert options(handler, width=800, dpr=2)['dpi'] == 200
+    assert options(handler, width=400)['dpi'] == 50
+
+@pytest.mark.parametrize('values, dpi, size', [
+        ({'dpi':5000, 'size':100}, 200, 16.0),
+        ({'dpi':1, 'size':0.01}, 30, 2.0),
+        ({'width':1e9}, 200, 8.0),
+        ({'width':'nan', 'size':'nan'}, 100, 2.0),
+        ({'size':'inf'}, 100, 16.0)])
+def test_clamped(handler, values, dpi, size):
+    opts = options(handler, **values)
+    assert (opts['dpi'], opts['size']) == (dpi, size)
+
+def test_unknown_format(handler, form):
+    qstr = form()
+    qstr['fmt'] = ['tiff']
+    body, contType = handler.drawgui(None, qstr)
+    assert handler.status == testServer.HTTPStatus.BAD_REQUEST
+    assert body == b'unknown format'
+
+@pytest.mark.parametrize('pixels, width', [(100000, 1024), (1, 16)])
+def test_coverage_pixels_clamped(handler, form, pixels, width):
+    qstr = form()
+    qstr['pixels'] = [str(pixels)]
+    qstr['fmt'] = ['json']
+    body, contType = handler.coverage(None, qstr)
+    assert len(json.loads(body)['spec'][0]) == width
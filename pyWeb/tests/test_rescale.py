@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+# Limits (xMin, xMax, yMin, yMax) rescale() gave before it was
+# computed from the footprint vertices, with objLenX/objHgtY 3 and,
+# with a sky pattern, a 10,5 nod and skyLenX/skyHgtY 2
+oldLimits = [
+    ('Disabled', 'Stare', 'None', '0.02', (-4, 4, -4, 4)),
+    ('Disabled', 'Stare', 'None', '0.05', (-4, 6, -4, 6)),
+    ('Disabled', 'Stare', 'Box4', '0.02', (-4, 14, -4, 14)),
+    ('Disabled', 'Stare', 'Box4', '0.05', (-4, 14, -4, 14)),
+    ('Disabled', 'Box4', 'None', '0.02', (-4, 4, -4, 4)),
+    ('Disabled', 'Box4', 'None', '0.05', (-4, 6, -4, 6)),
+    ('Disabled', 'Box4', 'Box4', '0.02', (-4, 14, -4, 14)),
+    ('Disabled', 'Box4', 'Box4', '0.05', (-4, 14, -4, 14)),
+    ('Disabled', 'Box5', 'None', '0.02', (-4, 4, -4, 4)),
+    ('Disabled', 'Box5', 'None', '0.05', (-4, 6, -4, 6)),
+    ('Disabled', 'Box5', 'Box4', '0.02', (-4, 14, -4, 14)),
+    ('Disabled', 'Box5', 'Box4', '0.05', (-4, 14, -4, 14)),
+    ('Disabled', 'Box9', 'None', '0.02', (-4, 4, -4, 4)),
+    ('Disabled', 'Box9', 'None', '0.05', (-4, 6, -4, 6)),
+    ('Disabled', 'Box9', 'Box4', '0.02', (-4, 14, -4, 14)),
+    ('Disabled', 'Box9', 'Box4', '0.05', (-4, 14, -4, 14)),
+    ('Slave1', 'Stare', 'None', '0.02', (-30, 32, -30, 32)),
+    ('Slave1', 'Stare', 'None', '0.05', (-30, 32, -30, 32)),
+    ('Slave1', 'Stare', 'Box4', '0.02', (-30, 36, -30, 36)),
+    ('Slave1', 'Stare', 'Box4', '0.05', (-30, 36, -30, 36)),
+    ('Slave1', 'Box4', 'None', '0.02', (-30, 32, -30, 32)),
+    ('Slave1', 'Box4', 'None', '0.05', (-30, 32, -30, 32)),
+    ('Slave1', 'Box4', 'Box4', '0.02', (-30, 36, -30, 36)),
+    ('Slave1', 'Box4', 'Box4', '0.05', (-30, 36, -30, 36)),
+    ('Slave1', 'Box5', 'None', '0.02', (-30, 32, -30, 32)),
+    ('Slave1', 'Box5', 'None', '0.05', (-30, 32, -30, 32)),
+    ('Slave1', 'Box5', 'Box4', '0.02', (-30, 36, -30, 36)),
+    ('Slave1', 'Box5', 'Box4', '0.05', (-30, 36, -30, 36)),
+    ('Slave1', 'Box9', 'None', '0.02', (-30, 32, -30, 32)),
+    ('Slave1', 'Box9', 'None', '0.05', (-30, 32, -30, 32)),
+    ('Slave1', 'Box9', 'Box4', '0.02', (-30, 36, -30, 36)),
+    ('Slave1', 'Box9', 'Box4', '0.05', (-30, 36, -30, 36)),
+]
+
+@pytest.mark.parametrize('mode,obj,sky,scale,old', oldLimits)
+def test_fixed_patterns_keep_old_view(oop, form, mode, obj, sky, scale, old):
+    values = dict(imgMode=mode, objPattern=obj, skyPattern=sky, scale=scale,
+            objLenX=3, objHgtY=3, objFrames1=1 if obj == 'Stare' else obj[3])
+    if sky != 'None':
+        values.update(nodOffX=10, nodOffY=5, skyLenX=2, skyHgtY=2,
+                skyFrames1=4)
+    oop.update(form(**values))
+    xMin, xMax, yMin, yMax = old
+    assert oop.xMin <= xMin and oop.xMax >= xMax
+    assert oop.yMin <= yMin and oop.yMax >= yMax
+    verts = oop.footprint_verts().reshape(-1,2)
+    assert (verts.min(axis=0) >= [oop.xMin, oop.yMin]).all()
+    assert (verts.max(axis=0) <= [oop.xMax, oop.yMax]).all()
+    assert oop.xMax - oop.xMin == oop.yMax - oop.yMin
+
+@pytest.mark.parametrize('values', [
+    dict(objPattern='None', skyPattern='None'),
+    dict(objPattern='User Defined', defs=''),
+])
+def test_nothing_drawn(oop, form, values):
+    oop.update(form(**values))
+    assert oop.xMax - oop.xMin >= 2*oop.minHalfWidth
+    assert oop.gridScale >= oop.minGridScale
+    assert len(oop.render()) > 0
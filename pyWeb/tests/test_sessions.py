@@ -0,0 +1,32 @@
+import pytest
+
+import testServer
+
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setattr(testServer.TestAppHandler, 'sessions',
+            testServer.OrderedDict())
+    monkeypatch.setattr(testServer.TestAppHandler, 'maxSessions', 3)
+    handler = testServer.TestAppHandler.__new__(testServer.TestAppHandler)
+    handler.headers = {}
+    handler.extraHeaders = []
+    return handler
+
+def visit(handler, sid=None):
+    handler.headers = {'Cookie':'oopSession=' + sid} if sid else {}
+    return handler.session().sid
+
+def test_lru_eviction(handler):
+    a, b, c = [visit(handler) for i in range(3)]
+    # Using a makes b the least recently used
+    assert visit(handler, a) == a
+    d = visit(handler)
+    assert list(handler.sessions) == [c, a, d]
+    assert visit(handler, b) != b
+    assert len(handler.sessions) == 3
+
+def test_timeout(handler):
+    a = visit(handler)
+    handler.sessions[a].lastUsed -= handler.sessionTimeout + 1
+    assert visit(handler, a) != a
+    assert a not in handler.sessions and len(handler.sessions) == 1
@@ -0,0 +1,27 @@
+import threading
+
+import tooCache
+
+class CountingCache(tooCache.ToOCache):
+    def __init__(self):
+        tooCache.ToOCache.__init__(self, '', '2018A', interval=60.0)
+        self.fetches = 0
+        self.release = threading.Event()
+
+    def fetch(self):
+        self.fetches += 1
+        self.release.wait(5)
+        return [{'Semester':'2018A', 'ProjCode':'U001', 'Instrument':'OSIRIS',
+                'Date':'2018-03-01'}]
+
+def test_first_load_in_thread():
+    too = CountingCache()
+    too.start()
+    try:
+        assert not too.ready.wait(0.1)
+        too.release.set()
+        assert too.ready.wait(5)
+        assert too.fetches == 1
+        assert too.get_nights('2018A_U001', 'OSIRIS') == ['2018-03-01']
+    finally:
+        too.stop()
@@ -0,0 +1,27 @@
+import json
+import pytest
+
+import testServer
+
+def test_failed_update_is_not_kept(oop, form):
+    first = form()
+    oop.update(first)
+    oop.render()
+    bad = form(scale='0.07', objPattern='Box9', objFrames1=9)
+    for i in range(2):
+        with pytest.raises(KeyError):
+            oop.update(bad)
+    oop.update(first)
+    assert 'geometry' not in oop.skipped and 'raster' not in oop.skipped
+
+def test_drawgui_rejects_invalid_form(form, monkeypatch):
+    monkeypatch.setattr(testServer.TestAppHandler, 'sessions',
+            testServer.OrderedDict())
+    handler = testServer.TestAppHandler.__new__(testServer.TestAppHandler)
+    handler.headers = {}
+    handler.extraHeaders = []
+    handler.status = None
+    body, contType = handler.drawgui(None, form(scale='0.07'))
+    assert handler.status == testServer.HTTPStatus.BAD_REQUEST
+    assert json.loads(body) == {'errors':
+            ['scale 0.07 is not available with Zbb']}
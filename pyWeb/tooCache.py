@@ -0,0 +1,194 @@
+"""
+ToO schedule cache
+
+Keeps the ToO programs of a semester and their saved instrument
+configurations in memory, indexed the way the ToO submission form
+asks for them (program -> instrument -> night, program -> config ->
+target), so each dropdown is answered without a remote lookup. A
+background thread reloads everything on a timer and swaps the new
+indexes in whole; if a reload fails the old data is kept.
+"""
+
+import json
+import time
+import threading
+import urllib.request as url
+
+class ToOCache:
+    """
+    @type schedurl: string
+    @param schedurl: base URL of the telescope schedule API, may
+        point to a local stub
+    @type semester: string
+    @param semester: semester to load, e.g. 2018A
+    @type interval: float
+    @param interval: seconds between reloads
+    @type loadConfigs: function
+    @param loadConfigs: returns the saved configurations of a
+        semester as a list of dictionaries, or None to skip them
+    @type projects: dictionary
+    @param projects: semid -> program summary
+    @type instruments: dictionary
+    @param instruments: semid -> instrument -> sorted list of nights
+    @type configs: dictionary
+    @param configs: semid -> ddfname -> configuration summary
+    @type loaded: float
+    @param loaded: time of the last successful reload
+    @type error: string
+    @param error: why the last reload failed, empty if it did not
+    @type ready: threading.Event
+    @param ready: set once the first load has been tried
+    """
+    configFields = ['ddfname', 'object', 'specFilter', 'scale',
+            'imgFilter', 'objPattern', 'skyPattern', 'aoType', 'ra', 'dec']
+
+    def __init__(self, schedurl, semester, interval=300.0, loadConfigs=None):
+        self.schedurl = schedurl
+        self.semester = semester
+        self.interval = interval
+        self.loadConfigs = loadConfigs
+        self.projects = {}
+        self.instruments = {}
+        self.configs = {}
+        self.loaded = 0.0
+        self.error = ''
+        self.stopped = threading.Event()
+        self.ready = threading.Event()
+        self.thread = None
+
+    def fetch(self):
+        """
+        Reads the ToO schedule of the semester
+
+        @return returns the list of schedule rows
+        """
+        URL = ''.join((self.schedurl, 'cmd=getToO&semester=', self.semester))
+        res = url.urlopen(URL, timeout=30).read().decode('utf-8')
+        return json.loads(res) if res.strip() else []
+
+    def build_schedule(self, rows):
+        """
+        Builds the program and instrument indexes from schedule rows
+
+        @return returns the projects and instruments indexes
+        """
+        projects = {}
+        instruments = {}
+        for row in rows:
+            semid = ''.join((row.get('Semester', self.semester), '_',
+                    row['ProjCode']))
+            if semid not in projects:
+                projects[semid] = {'semid':semid,
+                        'title':row.get('Title', ''),
+                        'pi':row.get('Principal', row.get('PI', ''))}
+            nights = instruments.setdefault(semid, {}).setdefault(
+                    row.get('Instrument', ''), [])
+            night = row.get('Date', '')
+            if night and night not in nights:
+                nights.append(night)
+        for semid in instruments:
+            for nights in instruments[semid].values():
+                nights.sort()
+        return projects, instruments
+
+    def build_configs(self, configs):
+        """
+        Builds the configuration index, by program and DDF name
+
+        @return returns the configs index
+        """
+        index = {}
+        for cfg in configs:
+            semid = ''.join((str(cfg.get('semester', '')), '_',
+                    str(cfg.get('progname', ''))))
+            index.setdefault(semid, {})[cfg.get('ddfname', '')] = dict(
+                    (key, cfg.get(key, '')) for key in self.configFields)
+        return index
+
+    def refresh(self):
+        """
+        Reloads the schedule and the configurations. Either one that
+        cannot be read keeps its previous data.
+
+        @return returns True if both were loaded
+        """
+        errors = []
+        try:
+            projects, instruments = self.build_schedule(self.fetch())
+        except Exception as e:
+            errors.append(''.join(('schedule: ', str(e))))
+        else:
+            # Whole dictionaries are replaced, so a reader never sees
+            # a half built index
+            self.projects, self.instruments = projects, instruments
+        if self.loadConfigs:
+            try:
+                self.configs = self.build_configs(
+                        self.loadConfigs(self.semester))
+            except Exception as e:
+                errors.append(''.join(('configs: ', str(e))))
+        self.error = '; '.join(errors)
+        if not errors:
+            self.loaded = time.time()
+        return not errors
+
+    def run(self):
+        while True:
+            self.refresh()
+            self.ready.set()
+            if self.stopped.wait(self.interval):
+                return
+
+    def start(self):
+        """
+        Loads the cache and keeps reloading it in the background;
+        wait on ready for the first load
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def get_projects(self):
+        return sorted(self.projects.values(), key=lambda p: p['semid'])
+
+    def get_instruments(self, semid):
+        return sorted(self.instruments.get(semid, {}))
+
+    def get_nights(self, semid, instrument):
+        return list(self.instruments.get(semid, {}).get(instrument, []))
+
+    def get_configs(self, semid):
+        configs = self.configs.get(semid, {})
+        return [configs[name] for name in sorted(configs)]
+
+    def get_targets(self, semid, ddfname=None):
+        configs = self.configs.get(semid, {})
+        if ddfname:
+            configs = {ddfname:configs[ddfname]} if ddfname in configs else {}
+        return sorted(set(cfg['object'] for cfg in configs.values()
+                if cfg['object']))
+
+    def check_request(self, req):
+        """
+        Checks a ToO request against the cached schedule
+
+        @type req: dictionary
+        @param req: semid, instrument, night, ddfname and object
+
+        @return returns a list of error messages, empty if valid
+        """
+        errors = []
+        semid = req.get('semid', '')
+        if semid not in self.projects:
+            errors.append(''.join(('no ToO time for ', semid)))
+        elif req.get('instrument') not in self.instruments.get(semid, {}):
+            errors.append(''.join(('no ToO time on ', str(req.get('instrument')))))
+        elif self.get_nights(semid, req['instrument']) and \
+                req.get('night') not in self.get_nights(semid, req['instrument']):
+            errors.append(''.join(('no ToO time on ', str(req.get('night')))))
+        if req.get('ddfname') and req['ddfname'] not in self.configs.get(semid, {}):
+            errors.append(''.join(('unknown configuration ', req['ddfname'])))
+        return errors
@@ -0,0 +1,39 @@
+"""
+Local stand-in for the telescope schedule API
+
+Serves getToO and getPI from a JSON file of schedule rows, so the
+ToO pages of testServer can be tried without the real API:
+
+    python tooStub.py 8090 schedule.json
+    python testServer.py 8080 'http://localhost:8090/telSchedule?'
+
+The file holds a list of rows such as
+    {"Semester": "2018A", "ProjCode": "U020", "Instrument": "OSIRIS",
+     "Date": "2018-03-02", "Title": "...", "Principal": "..."}
+"""
+
+import sys
+import json
+from easyHTTP import EasyHTTPHandler, EasyHTTPServerThreaded
+
+class StubHandler (EasyHTTPHandler):
+    rows = []
+
+    def telSchedule(self, req, qstr):
+        cmd = self.getDefValue(qstr, 'cmd', '')
+        if cmd == 'getToO':
+            sem = self.getDefValue(qstr, 'semester', '')
+            res = [row for row in self.rows if row.get('Semester') == sem]
+        elif cmd == 'getPI':
+            semid = self.getDefValue(qstr, 'semid', '')
+            res = [row for row in self.rows if '_'.join((row.get('Semester'),
+                    row.get('ProjCode'))) == semid][:1]
+        else:
+            res = []
+        return self.response(json.dumps(res), self.PlainTextType)
+
+if __name__ == "__main__":
+    port = int(sys.argv[1])
+    with open(sys.argv[2]) as f:
+        StubHandler.rows = json.load(f)
+    EasyHTTPServerThreaded (('', port), StubHandler).run4ever()
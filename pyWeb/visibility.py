@@ -0,0 +1,287 @@
+"""
+Target visibility from Maunakea over one night
+
+The altitude of every target is computed at every time step of the
+night as one (targets x steps) array, from the local sidereal time of
+each step and the hour angle of each target. The sun's altitude gives
+the dark part of the night. Airmass, the rise and set through the
+telescope's altitude limit, the highest point and the dark hours above
+the limit all come from that array.
+
+The time steps, sidereal times and sun of a night are computed once
+and kept, with the results of every target already asked for that
+night, so the ToO form and the planner can ask again without
+recomputing. Positions are taken as given (no precession or
+refraction), which is well within what planning a night needs.
+"""
+
+import re
+import threading
+import collections
+import numpy as np
+from datetime import datetime, timedelta
+
+# Keck Observatory, Maunakea
+latitude = 19.8263
+longitude = -155.4783
+utcOffset = -10
+
+def parse_angle(val, hours=False):
+    """
+    Converts a coordinate to degrees
+
+    @type val: string or float
+    @param val: decimal degrees, or sexagesimal with : or spaces
+    @type hours: boolean
+    @param hours: True if sexagesimal values are in hours (RA)
+
+    @return returns the angle in degrees
+    """
+    if isinstance(val, (int, float)):
+        return float(val)
+    parts = [p for p in re.split('[: hdms]+', str(val).strip()) if p]
+    if not parts:
+        raise ValueError('no coordinate')
+    if len(parts) == 1:
+        return float(parts[0])
+    sign = -1.0 if parts[0].startswith('-') else 1.0
+    deg = sum(abs(float(p))/60.0**i for i, p in enumerate(parts))
+    return sign*deg*(15.0 if hours else 1.0)
+
+def julian_date(times):
+    """
+    @type times: numpy datetime64 array
+    @return returns the Julian dates
+    """
+    return (times - np.datetime64('2000-01-01T12:00')) / \
+            np.timedelta64(1, 's') / 86400.0 + 2451545.0
+
+def sidereal_degrees(jd):
+    """
+    Local sidereal time in degrees at the Julian dates
+    """
+    gmst = 280.46061837 + 360.98564736629*(jd - 2451545.0)
+    return np.mod(gmst + longitude, 360.0)
+
+def sun_position(jd):
+    """
+    Low precision solar RA and Dec in degrees (Astronomical Almanac)
+    """
+    n = jd - 2451545.0
+    L = np.radians(280.460 + 0.9856474*n)
+    g = np.radians(357.528 + 0.9856003*n)
+    lam = L + np.radians(1.915)*np.sin(g) + np.radians(0.020)*np.sin(2*g)
+    eps = np.radians(23.439 - 0.0000004*n)
+    ra = np.degrees(np.arctan2(np.cos(eps)*np.sin(lam), np.cos(lam)))
+    dec = np.degrees(np.arcsin(np.sin(eps)*np.sin(lam)))
+    return ra, dec
+
+def altitude(ra, dec, lst):
+    """
+    Altitude in degrees of each position at each sidereal time
+
+    @type ra: numpy array
+    @param ra: (N,) right ascensions in degrees
+    @type dec: numpy array
+    @param dec: (N,) declinations in degrees
+    @type lst: numpy array
+    @param lst: (T,) local sidereal times in degrees
+
+    @return returns an (N,T) array
+    """
+    ha = np.radians(lst[None,:] - np.asarray(ra)[:,None])
+    dec = np.radians(np.asarray(dec))[:,None]
+    lat = np.radians(latitude)
+    return np.degrees(np.arcsin(np.sin(lat)*np.sin(dec) +
+            np.cos(lat)*np.cos(dec)*np.cos(ha)))
+
+def airmass(alt):
+    """
+    Airmass at the altitudes (Pickering 2002), nan below the horizon
+    """
+    alt = np.asarray(alt, dtype=float)
+    h = np.where(alt > 0, alt, np.nan)
+    return 1.0/np.sin(np.radians(h + 244.0/(165.0 + 47.0*h**1.1)))
+
+class Night:
+    """
+    The time steps of one night and the targets computed for it
+
+    @type night: string
+    @param night: local (HST) date the night starts, YYYY-MM-DD
+    @type times: numpy array
+    @param times: UT of every step
+    @type lst: numpy array
+    @param lst: local sidereal time of every step, degrees
+    @type sunAlt: numpy array
+    @param sunAlt: altitude of the sun at every step, degrees
+    @type targets: dictionary
+    @param targets: (ra, dec) -> result of the target
+    """
+    def __init__(self, night, start, end, step):
+        self.night = night
+        first = datetime.strptime(night, '%Y-%m-%d') - \
+                timedelta(hours=utcOffset)
+        self.times = np.arange(np.datetime64(first + timedelta(hours=start)),
+                np.datetime64(first + timedelta(hours=end)) +
+                np.timedelta64(1, 's'), np.timedelta64(int(step*60), 's'))
+        jd = julian_date(self.times)
+        self.lst = sidereal_degrees(jd)
+        sunRa, sunDec = sun_position(jd)
+        self.sunAlt = np.degrees(np.arcsin(np.sin(np.radians(latitude))*
+                np.sin(np.radians(sunDec)) + np.cos(np.radians(latitude))*
+                np.cos(np.radians(sunDec))*
+                np.cos(np.radians(self.lst - sunRa))))
+        self.step = step
+        self.targets = {}
+
+    def time_at(self, index):
+        """
+        UT at a fractional step index, as an ISO string
+        """
+        when = self.times[0] + np.timedelta64(int(round(
+                index*self.step*60)), 's')
+        return str(when.astype('datetime64[m]')) + 'Z'
+
+class NightPlanner:
+    """
+    @type altLimit: float
+    @param altLimit: lowest altitude the telescope observes, degrees
+    @type darkAlt: float
+    @param darkAlt: sun altitude at the end of twilight, degrees
+    @type start: float
+    @param start: hours after local midnight starting the night (18.0
+        is 6pm on the night's date)
+    @type end: float
+    @param end: hours after local midnight ending the night (31.0 is
+        7am the next day)
+    @type step: float
+    @param step: minutes between steps
+    @type size: int
+    @param size: number of nights kept
+    """
+    altLimit = 18.0
+    darkAlt = -12.0
+    start = 18.0
+    end = 31.0
+    step = 5.0
+    size = 16
+
+    def __init__(self):
+        self.nights = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_night(self, night):
+        """
+        Returns the Night of a date, computing it the first time
+        """
+        with self.lock:
+            obj = self.nights.get(night)
+            if obj is None:
+                obj = self.nights[night] = Night(night, self.start,
+                        self.end, self.step)
+                while len(self.nights) > self.size:
+                    self.nights.popitem(last=False)
+            self.nights.move_to_end(night)
+            return obj
+
+    def compute(self, night, ra, dec):
+        """
+        Visibility of many targets in one pass over the night
+
+        @return returns a list with one dictionary per target
+        """
+        alt = altitude(ra, dec, night.lst)
+        above = alt >= self.altLimit
+        dark = night.sunAlt <= self.darkAlt
+        # Fractional index where the altitude crosses the limit
+        # between steps k-1 and k
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frac = (self.altLimit - alt[:,:-1])/(alt[:,1:] - alt[:,:-1])
+        rising = above[:,1:] & ~above[:,:-1]
+        setting = ~above[:,1:] & above[:,:-1]
+        hasRise = rising.any(axis=1)
+        hasSet = setting.any(axis=1)
+        rise = rising.argmax(axis=1)
+        sets = setting.shape[1] - 1 - setting[:,::-1].argmax(axis=1)
+        rows = np.arange(len(alt))
+        riseIdx = rise + frac[rows, rise]
+        setIdx = sets + frac[rows, sets]
+        best = alt.argmax(axis=1)
+        hours = (above & dark).sum(axis=1)*self.step/60.0
+        maxAlt = alt[rows, best]
+        results = []
+        for i in range(len(alt)):
+            results.append({
+                    'maxAlt':round(float(maxAlt[i]), 2),
+                    'minAirmass':None if maxAlt[i] <= 0 else
+                            round(float(airmass(maxAlt[i])), 3),
+                    'best':night.time_at(best[i]),
+                    'rise':night.time_at(riseIdx[i]) if hasRise[i] else None,
+                    'set':night.time_at(setIdx[i]) if hasSet[i] else None,
+                    'upAtStart':bool(above[i,0]),
+                    'upAtEnd':bool(above[i,-1]),
+                    'darkHours':round(float(hours[i]), 2),
+                    'altitude':np.round(alt[i], 1).tolist()
+                })
+        return results
+
+    def plan(self, night, targets, grid=False):
+        """
+        Visibility of targets over a night, reusing the targets
+        already computed for that night
+
+        @type night: string
+        @param night: local date the night starts, YYYY-MM-DD
+        @type targets: list
+        @param targets: dictionaries with the ra (hours if
+            sexagesimal) and dec of each target, and its name
+        @type grid: boolean
+        @param grid: True to also return the altitude at every step
+
+        @return returns a dictionary with the UT of the steps, the sun
+            altitude, the dark steps, and a result per target in order;
+            targets without a position get an error instead
+        """
+        obj = self.get_night(night)
+        keys = []
+        for tgt in targets:
+            try:
+                keys.append((parse_angle(tgt['ra'], True),
+                        parse_angle(tgt['dec'])))
+            except (KeyError, TypeError, ValueError):
+                keys.append(None)
+        with self.lock:
+            todo = sorted(set(key for key in keys
+                    if key is not None and key not in obj.targets))
+        if todo:
+            ra, dec = np.array(todo).T
+            results = self.compute(obj, ra, dec)
+            with self.lock:
+                obj.targets.update(zip(todo, results))
+        out = []
+        for tgt, key in zip(targets, keys):
+            if key is None:
+                res = {'error':'no ra/dec'}
+            else:
+                res = dict(obj.targets[key])
+                if not grid:
+                    del res['altitude']
+                res['ra'], res['dec'] = key
+            res['name'] = tgt.get('name', tgt.get('object', ''))
+            out.append(res)
+        return {'night':night,
+                'times':[str(t) + 'Z' for t in obj.times.astype('datetime64[m]')]
+                        if grid else [],
+                'sunAlt':np.round(obj.sunAlt, 1).tolist() if grid else [],
+                'dark':self.dark_span(obj),
+                'targets':out}
+
+    def dark_span(self, night):
+        """
+        UT of the end and start of twilight on a night
+        """
+        dark = np.nonzero(night.sunAlt <= self.darkAlt)[0]
+        if not len(dark):
+            return None
+        return [night.time_at(dark[0]), night.time_at(dark[-1])]